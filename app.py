@@ -21,6 +21,7 @@ from tools import (
     video2audio,
     simplify_language
 )
+from tools.telemetry import get_telemetry
 
 __version__ = "0.1.20"
 __author__ = "data-alchemists des DigiLab BS"
@@ -93,6 +94,31 @@ def show_info_box():
     st.sidebar.markdown(impressum, unsafe_allow_html=True)
 
 
+def show_telemetry():
+    """
+    Displays the latency percentiles, retries and tokens of all API calls of
+    this process in the sidebar, with downloads in csv and Prometheus format.
+
+    Returns:
+        None
+    """
+    telemetry = get_telemetry()
+    if len(telemetry) == 0:
+        return
+    with st.sidebar.expander("Telemetrie"):
+        st.dataframe(telemetry.summary(), hide_index=True)
+        st.download_button(
+            "CSV herunterladen",
+            data=telemetry.to_dataframe().to_csv(sep=";", index=False),
+            file_name="telemetry.csv",
+        )
+        st.download_button(
+            "Prometheus herunterladen",
+            data=telemetry.to_prometheus(),
+            file_name="telemetry.prom",
+        )
+
+
 def init_layout():
     """
     Initializes the layout of the application by setting the page configuration, loading CSS styles, and displaying the
@@ -171,6 +197,7 @@ def main():
     app = st.session_state[menu_action]
     app.show_ui()
     show_info_box()
+    show_telemetry()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+"""
+Compares the per request latency of a new OpenAI client per call (the old
+behaviour of get_completion) with the shared, pooled client from
+tools.llm_client.
+
+Usage:
+    python benchmarks/bench_client_pool.py --requests 200 --latency 0.02
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+from openai import OpenAI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stub_server import start_server, base_url
+from tools.llm_client import get_client, close_clients
+
+API_KEY = "stub-key"
+MESSAGES = [
+    {"role": "system", "content": "You are a benchmark."},
+    {"role": "user", "content": "Wieviele Personen in Basel sind 100-jährig?"},
+]
+
+
+def timed_calls(make_client, url: str, n: int) -> list:
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        client = make_client(url)
+        client.chat.completions.create(model="gpt-4o", messages=MESSAGES)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def new_client(url: str):
+    return OpenAI(api_key=API_KEY, base_url=url)
+
+
+def pooled_client(url: str):
+    return get_client(api_key=API_KEY, base_url=url)
+
+
+def summary(name: str, latencies: list) -> str:
+    latencies_ms = sorted(x * 1000 for x in latencies)
+    p95 = latencies_ms[int(0.95 * (len(latencies_ms) - 1))]
+    return (
+        f"{name:<16} mean {statistics.mean(latencies_ms):7.2f} ms  "
+        f"p50 {statistics.median(latencies_ms):7.2f} ms  p95 {p95:7.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument(
+        "--base-url", default=None, help="use an existing endpoint instead of the stub"
+    )
+    args = parser.parse_args()
+
+    server = None
+    url = args.base_url
+    if url is None:
+        server = start_server(0, args.latency)
+        url = base_url(server)
+    # warm up both paths so imports and the first connection are not measured
+    timed_calls(new_client, url, 3)
+    timed_calls(pooled_client, url, 3)
+
+    results = {
+        "new client": timed_calls(new_client, url, args.requests),
+        "pooled client": timed_calls(pooled_client, url, args.requests),
+    }
+    print(f"{args.requests} sequential requests against {url}")
+    for name, latencies in results.items():
+        print(summary(name, latencies))
+    close_clients()
+    if server is not None:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+Compares the local classifier (tools/local_classifier.py) with the LLM. The
+local model is trained on one part of LLM labelled texts and evaluated on
+the rest: rows/sec of the prediction, the share of texts it classifies
+(coverage) and how many of them get the same categories as from the LLM
+(agreement), for several probability thresholds. The LLM throughput is
+measured with the classifier against the local stub server, the hybrid
+rows/sec assumes the uncovered texts are sent to the LLM.
+
+The labelled texts are read from long output files of the classifier
+(output_<key>.csv with the columns text_id, text and result). Without files,
+synthetic survey answers are generated from the demo categories.
+
+Usage:
+    python benchmarks/bench_local_classifier.py data/output/output_2024-*.csv
+    python benchmarks/bench_local_classifier.py --synthetic 20000 --thresholds 0.8 0.9 0.95
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.stub_server import start_server, base_url
+from benchmarks.bench_tools import QuietPlaceholder, API_KEY
+
+FILLER = [
+    "mir gefällt",
+    "ich finde gut",
+    "besonders schön ist",
+    "am liebsten mag ich",
+    "toll finde ich",
+    "in basel gibt es",
+    "wirklich super",
+    "und natürlich",
+]
+logger = logging.getLogger("benchmark")
+
+
+def synthetic_labels(rows: int, seed: int) -> tuple:
+    """
+    Survey answers built from the words of one or two demo categories and
+    filler phrases, with typos. The categories are the labels.
+    """
+    categories = pd.read_excel(os.path.join(ROOT, "data/demo/demo_categories.xlsx"))
+    words = {
+        cat_id: [w.strip("(),.").lower() for w in str(label).split() if len(w) > 3] or [str(label).lower()]
+        for cat_id, label in zip(categories.iloc[:, 0], categories.iloc[:, 1])
+    }
+    cat_ids = list(words)
+    generator = np.random.default_rng(seed)
+    texts, labels = [], []
+    for _ in range(rows):
+        chosen = list(generator.choice(cat_ids, size=1 + (generator.random() < 0.2), replace=False))
+        parts = [generator.choice(FILLER)]
+        for cat_id in chosen:
+            parts += list(generator.choice(words[cat_id], size=2))
+        text = " ".join(parts)
+        if generator.random() < 0.3:
+            position = generator.integers(len(text))
+            text = text[:position] + text[position + 1 :]
+        texts.append(text)
+        labels.append([int(cat_id) for cat_id in chosen])
+    return texts, labels
+
+
+def file_labels(files: list) -> tuple:
+    df = pd.concat([pd.read_csv(f, sep=";", usecols=["text", "result"]) for f in files])
+    df = df.dropna().drop_duplicates("text", keep="last")
+    texts, labels = [], []
+    for text, result in zip(df["text"], df["result"]):
+        try:
+            labels.append([int(cat) for cat in json.loads(result)])
+        except (ValueError, TypeError):
+            continue
+        texts.append(text)
+    return texts, labels
+
+
+def llm_rows_per_second(texts: list, args) -> float:
+    """Rows/sec of the classifier with the LLM (stub server), no local stages."""
+    import shutil
+    import tempfile
+    import tools.classifier as classifier
+
+    workdir = tempfile.mkdtemp(prefix="bench_local_")
+    for name in ("OUTPUT_LONG", "OUTPUT_SHORT", "OUTPUT_STAT", "OUTPUT_ZIP", "OUTPUT_ERROR", "JOB_MANIFEST"):
+        setattr(classifier, name, os.path.join(workdir, os.path.basename(getattr(classifier, name))))
+    tool = classifier.Classifier(logger)
+    tool.use_cache = False
+    tool.resume = False
+    tool.max_concurrency = args.concurrency
+    tool.texts_df = pd.DataFrame({"text_id": range(len(texts)), "text": texts})
+    categories = pd.read_excel(os.path.join(ROOT, "data/demo/demo_categories.xlsx"))
+    tool.set_categories(categories)
+    tool.set_output_files("benchmark")
+    start = time.perf_counter()
+    try:
+        tool.run_classification(QuietPlaceholder())
+    finally:
+        elapsed = time.perf_counter() - start
+        shutil.rmtree(workdir, ignore_errors=True)
+    return len(texts) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="long output files of the classifier")
+    parser.add_argument("--synthetic", type=int, default=20000, help="synthetic texts if no files are given")
+    parser.add_argument("--test-share", type=float, default=0.2)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.7, 0.8, 0.9, 0.95])
+    parser.add_argument("--llm-rows", type=int, default=200, help="texts classified by the LLM, 0 to skip")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.5, help="latency of the stub server in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    os.chdir(ROOT)
+
+    from tools.local_classifier import LocalClassifier
+
+    texts, labels = file_labels(args.files) if args.files else synthetic_labels(args.synthetic, args.seed)
+    order = np.random.default_rng(args.seed).permutation(len(texts))
+    test = order[: int(len(texts) * args.test_share)]
+    train = order[len(test) :]
+    train_texts, train_labels = [texts[p] for p in train], [labels[p] for p in train]
+    test_texts, test_labels = [texts[p] for p in test], [labels[p] for p in test]
+
+    model = LocalClassifier("benchmark")
+    start = time.perf_counter()
+    model.fit(train_texts, train_labels, seed=args.seed)
+    train_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    model.predict_proba(test_texts)
+    local_rate = len(test_texts) / (time.perf_counter() - start)
+
+    llm_rate = None
+    if args.llm_rows > 0:
+        server = start_server(0, args.latency, "lognormal")
+        os.environ["OPENAI_BASE_URL"] = base_url(server)
+        os.environ["OPENAI_API_KEY"] = API_KEY
+        llm_rate = llm_rows_per_second(test_texts[: args.llm_rows], args)
+        server.shutdown()
+
+    rows = []
+    for threshold in args.thresholds:
+        result = model.evaluate(test_texts, test_labels, threshold)
+        hybrid = None
+        if llm_rate:
+            hybrid = 1 / (1 / local_rate + (1 - result["coverage"]) / llm_rate)
+        rows.append(
+            {
+                "min probability": threshold,
+                "coverage": f"{result['coverage']:.1%}",
+                "agreement": f"{result['agreement']:.1%}",
+                "hybrid rows/sec": round(hybrid, 1) if hybrid else None,
+            }
+        )
+    print(
+        f"{len(train_texts)} training texts ({train_seconds:.1f}s), {len(test_texts)} test texts, "
+        f"local: {local_rate:,.0f} rows/sec"
+        + (f", LLM (stub, {args.latency}s, concurrency {args.concurrency}): {llm_rate:.1f} rows/sec" if llm_rate else "")
+    )
+    print(pd.DataFrame(rows).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
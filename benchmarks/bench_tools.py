@@ -0,0 +1,259 @@
+"""
+End-to-end throughput benchmark of the tools against the local stub server.
+The tools are driven headlessly, no OpenAI key and no network are needed.
+For every scenario rows/sec, the p95 latency of the API calls (from the
+telemetry store) and the peak Python memory (tracemalloc) are reported.
+Imports and input preparation are not measured, each scenario returns the
+timed job and the number of rows it processes.
+
+Scenarios that need a package which is not installed are skipped.
+
+Usage:
+    python benchmarks/bench_tools.py --rows 500 --latency 0.05 --latency-dist lognormal
+    python benchmarks/bench_tools.py --scenarios classifier translation_csv --concurrency 16
+"""
+import os
+import sys
+import time
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+import tracemalloc
+from types import SimpleNamespace
+
+# Streamlit warns about the missing script context on every st.* call
+os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.stub_server import start_server, base_url, LATENCY_DISTRIBUTIONS
+
+API_KEY = "stub-key"
+QUESTIONS = [
+    "Fasse das Dokument zusammen.",
+    "Welche Massnahmen werden vorgeschlagen?",
+    "Wer ist zuständig?",
+]
+logger = logging.getLogger("benchmark")
+
+
+class QuietPlaceholder:
+    """Accepts all calls the tools make on Streamlit placeholders."""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def demo_texts(rows: int) -> list:
+    """The demo texts of the classifier, repeated and numbered to avoid cache hits."""
+    df = pd.read_excel(os.path.join(ROOT, "data/demo/demo_texts.xlsx"))
+    texts = list(df.iloc[:, 1].astype(str))
+    return [f"{texts[i % len(texts)]} ({i})" for i in range(rows)]
+
+
+def demo_pdfs() -> list:
+    folder = os.path.join(ROOT, "data/demo/summary_folder")
+    return [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.endswith(".pdf")]
+
+
+def prepare_classifier(args, workdir: str) -> tuple:
+    import tools.classifier as classifier
+
+    for name in ("OUTPUT_LONG", "OUTPUT_SHORT", "OUTPUT_STAT", "OUTPUT_ZIP", "OUTPUT_ERROR", "JOB_MANIFEST"):
+        file_name = os.path.basename(getattr(classifier, name))
+        setattr(classifier, name, os.path.join(workdir, file_name))
+    tool = classifier.Classifier(logger)
+    tool.use_cache = False
+    tool.max_concurrency = args.concurrency
+    tool.pack_size = args.pack_size
+    tool.texts_df = pd.DataFrame({"text_id": range(args.rows), "text": demo_texts(args.rows)})
+    categories = pd.read_excel(os.path.join(ROOT, "data/demo/demo_categories.xlsx"))
+    tool.categories_dic = dict(zip(categories.iloc[:, 0], categories.iloc[:, 1]))
+    tool.set_output_files("benchmark")
+    return lambda: tool.run_classification(QuietPlaceholder()), args.rows
+
+
+def prepare_translation_csv(args, workdir: str) -> tuple:
+    import tools.translation as translation
+
+    translation.OUTPUT_PATH = workdir + os.sep
+    tool = translation.Translation(logger)
+    tool.use_cache = False
+    tool.use_tm = False
+    # the translation memory would answer reruns without requests and
+    # write the benchmark texts into the production database
+    tool.use_tm = False
+    tool.max_concurrency = args.concurrency
+    tool.data = pd.DataFrame(
+        {"key": [f"key_{i}" for i in range(args.rows)], "value": demo_texts(args.rows)}
+    )
+    tool.input_file = SimpleNamespace(name="benchmark.csv")
+    tool.set_system_prompt("de", "en")
+    return lambda: tool.run_csv_translation(QuietPlaceholder()), args.rows
+
+
+def prepare_translation_json(args, workdir: str) -> tuple:
+    import tools.translation as translation
+
+    tool = translation.Translation(logger)
+    tool.use_cache = False
+    tool.max_concurrency = args.concurrency
+    keys = [f"key_{i}" for i in range(args.rows)]
+    source = dict(zip(keys, demo_texts(args.rows)))
+    languages = ["en", "fr", "it"]
+    tool.data = {"source": source, "de": {}, **{lang: {} for lang in languages}}
+    return lambda: tool.translate_json_file(QuietPlaceholder()), args.rows * len(languages)
+
+
+def prepare_summary(args, workdir: str) -> tuple:
+    import tools.summarizer as summarizer
+    from helper import extract_text_from_file
+
+    tool = summarizer.Summary(logger)
+    tool.use_cache = False
+    tool.max_concurrency = args.concurrency
+    texts = {os.path.basename(file): extract_text_from_file(file) for file in demo_pdfs()[: args.docs]}
+
+    def job():
+        for file, text in texts.items():
+            title, tokens = tool.extract_title(text[:500])
+            tool.add_tokens(tokens)
+            # generate_summary adds the tokens of the summary requests itself
+            tool.generate_summary(text, file, QuietPlaceholder())
+
+    return job, len(texts)
+
+
+def prepare_finder_index(args, workdir: str) -> tuple:
+    import tools.finder as finder
+    from helper import extract_text_from_file
+
+    finder.INDEX_SOURCES["local"]["indexdir"] = os.path.join(workdir, "indexdir_local")
+    finder.INDEX_SOURCES["local"]["docs_path"] = workdir
+    tool = finder.Finder(logger)
+    tool.index_source = "local"
+    docs = [
+        finder.Document(os.path.basename(file), file, extract_text_from_file(file))
+        for file in demo_pdfs()[: args.docs]
+    ]
+
+    def job():
+        for doc in docs:
+            tool.add_document(doc)
+
+    return job, len(docs)
+
+
+def prepare_pdfchat(args, workdir: str) -> tuple:
+    import tools.pdfchat as pdfchat
+    from helper import extract_text_from_file
+
+    tool = pdfchat.PdfChat(logger)
+    tool.document_text = extract_text_from_file(demo_pdfs()[0])
+
+    def job():
+        tool.create_embeddings(None)
+        for question in QUESTIONS:
+            tool.qa.run(f"Antworte auf deutsch: ***{question}***")
+
+    return job, len(QUESTIONS)
+
+
+SCENARIOS = {
+    "classifier": prepare_classifier,
+    "translation_csv": prepare_translation_csv,
+    "translation_json": prepare_translation_json,
+    "summary": prepare_summary,
+    "finder_index": prepare_finder_index,
+    "pdfchat": prepare_pdfchat,
+}
+
+
+def run_scenario(name: str, args) -> dict:
+    from tools.telemetry import get_telemetry
+
+    telemetry = get_telemetry()
+    workdir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    try:
+        job, rows = SCENARIOS[name](args, workdir)
+    except ImportError as err:
+        shutil.rmtree(workdir, ignore_errors=True)
+        return {"scenario": name, "status": f"skipped ({err})"}
+    telemetry.clear()
+    if args.memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        job()
+    finally:
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if args.memory else 0
+        if args.memory:
+            tracemalloc.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    calls = telemetry.to_dataframe()
+    latencies = calls["latency"].to_numpy()
+    return {
+        "scenario": name,
+        "status": "ok",
+        "rows": rows,
+        "seconds": round(elapsed, 2),
+        "rows/sec": round(rows / elapsed, 1),
+        "api calls": len(calls),
+        "retries": int(calls["retries"].sum()),
+        "errors": int((calls["outcome"] == "error").sum()),
+        "p95 ms": round(float(np.percentile(latencies, 95)) * 1000, 1) if len(latencies) else None,
+        "peak MB": round(peak / 2**20, 1) if args.memory else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--rows", type=int, default=200, help="texts for classifier and translation")
+    parser.add_argument("--docs", type=int, default=3, help="documents for summary and finder")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--pack-size", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--latency-dist", choices=LATENCY_DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-memory",
+        dest="memory",
+        action="store_false",
+        help="disable tracemalloc, it slows down Python code",
+    )
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    args = parser.parse_args()
+
+    server = start_server(
+        0, args.latency, args.latency_dist, args.error_rate, args.rate_limit_rate, args.seed
+    )
+    os.environ["OPENAI_BASE_URL"] = base_url(server)
+    # langchain reads the older variable names
+    os.environ["OPENAI_API_BASE"] = base_url(server)
+    os.environ["OPENAI_API_KEY"] = API_KEY
+    os.chdir(ROOT)
+
+    results = [run_scenario(name, args) for name in args.scenarios]
+    server.shutdown()
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(
+            f"stub latency {args.latency}s ({args.latency_dist}), errors {args.error_rate}, "
+            f"429 {args.rate_limit_rate}, concurrency {args.concurrency}"
+        )
+        print(pd.DataFrame(results).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,496 @@
+"""
+Local OpenAI compatible stub server for benchmarks. Responses are
+deterministic and no API key is required. Supported endpoints: chat
+completions (with streaming), embeddings, moderations, audio speech and
+transcriptions and image generations.
+
+Classification prompts of the classifier are answered with a valid list of
+category ids (or a json object for packed requests), translation prompts
+with the text tagged with the target language (or a json object with the
+same keys for packed requests), all other chat requests echo the user
+message.
+
+Usage:
+    python benchmarks/stub_server.py --port 8765 --latency 0.05 --latency-dist lognormal
+    python benchmarks/stub_server.py --error-rate 0.01 --rate-limit-rate 0.02
+"""
+import re
+import sys
+import json
+import math
+import time
+import zlib
+import array
+import base64
+import random
+import struct
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_PORT = 8765
+EMBEDDING_DIMENSIONS = 1536
+LATENCY_DISTRIBUTIONS = ["constant", "uniform", "lognormal"]
+# sigma of the lognormal distribution, gives a p99 of about 3x the median
+LOGNORMAL_SIGMA = 0.5
+RETRY_AFTER_MS = 50
+# limits reported in the x-ratelimit-* headers, the clients adapt to them
+DEFAULT_RPM = 10000
+DEFAULT_TPM = 10000000
+MODERATION_CATEGORIES = [
+    "harassment",
+    "harassment/threatening",
+    "hate",
+    "hate/threatening",
+    "self-harm",
+    "self-harm/instructions",
+    "self-harm/intent",
+    "sexual",
+    "sexual/minors",
+    "violence",
+    "violence/graphic",
+]
+CATEGORY_PATTERN = re.compile(r'(-?\d+): "')
+# system prompts of the translation tool, single values and packed json objects
+TRANSLATION_PATTERN = re.compile(r"^You will translate a user text from .+? to (.+?)\. ")
+PACKED_TRANSLATION_PATTERN = re.compile(r"^You will translate the values of a JSON object from .+? to (.+?)\. ")
+TRANSLATION_PROMPT = "Translate the following text: "
+PACKED_TRANSLATION_PROMPT = "Translate the values of the following JSON object: "
+
+
+class StubConfig:
+    """Latency and error injection settings shared by all handler threads."""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        latency_dist: str = "constant",
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        seed: int = 0,
+        rpm: int = DEFAULT_RPM,
+        tpm: int = DEFAULT_TPM,
+    ):
+        self.latency = latency
+        self.latency_dist = latency_dist
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rpm = rpm
+        self.tpm = tpm
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def rate_limit_headers(self) -> dict:
+        return {
+            "x-ratelimit-limit-requests": str(self.rpm),
+            "x-ratelimit-remaining-requests": str(self.rpm - 1),
+            "x-ratelimit-limit-tokens": str(self.tpm),
+            "x-ratelimit-remaining-tokens": str(self.tpm - 1000),
+        }
+
+    def sample(self):
+        """Returns the latency and the injected failure of the next request."""
+        with self.lock:
+            self.requests += 1
+            if self.latency_dist == "uniform":
+                latency = self.random.uniform(0, 2 * self.latency)
+            elif self.latency_dist == "lognormal" and self.latency > 0:
+                # median of the distribution is the configured latency
+                latency = self.random.lognormvariate(math.log(self.latency), LOGNORMAL_SIGMA)
+            else:
+                latency = self.latency
+            draw = self.random.random()
+        if draw < self.rate_limit_rate:
+            return latency, 429
+        if draw < self.rate_limit_rate + self.error_rate:
+            return latency, 500
+        return latency, None
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # keep-alive requires HTTP/1.1 and a Content-Length on every response
+    protocol_version = "HTTP/1.1"
+    # send headers and body in one packet, avoids delayed-ACK stalls
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+    config = StubConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_bytes(self, status: int, data: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, status: int, body: dict, headers: dict = None):
+        self.send_bytes(status, json.dumps(body).encode("utf-8"), "application/json", headers)
+
+    def send_stream(self, completion: dict):
+        """Sends a completion as server-sent events, one event per word."""
+        words = completion["choices"][0]["message"]["content"].split(" ")
+        events = []
+        for i, word in enumerate(words):
+            delta = {"content": word if i == 0 else " " + word}
+            events.append(
+                {
+                    "id": completion["id"],
+                    "object": "chat.completion.chunk",
+                    "created": completion["created"],
+                    "model": completion["model"],
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+                }
+            )
+        events.append(
+            {
+                "id": completion["id"],
+                "object": "chat.completion.chunk",
+                "created": completion["created"],
+                "model": completion["model"],
+                "choices": [],
+                "usage": completion["usage"],
+            }
+        )
+        parts = [f"data: {json.dumps(event)}\n\n".encode("utf-8") for event in events]
+        parts.append(b"data: [DONE]\n\n")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(sum(len(part) for part in parts)))
+        self.end_headers()
+        for part in parts:
+            self.wfile.write(part)
+            self.wfile.flush()
+
+    def send_failure(self, status: int):
+        if status == 429:
+            self.send_json(
+                429,
+                {
+                    "error": {
+                        "message": "Rate limit reached (stub)",
+                        "type": "requests",
+                        "code": "rate_limit_exceeded",
+                    }
+                },
+                headers={"retry-after-ms": str(RETRY_AFTER_MS)},
+            )
+        else:
+            self.send_json(
+                status,
+                {"error": {"message": "Injected server error (stub)", "type": "server_error"}},
+            )
+
+    def read_raw(self) -> bytes:
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def do_GET(self):
+        if self.path.endswith("/stub.png"):
+            self.send_bytes(200, png_image(), "image/png")
+        else:
+            self.send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def do_POST(self):
+        raw = self.read_raw()
+        latency, failure = self.config.sample()
+        if latency > 0:
+            time.sleep(latency)
+        if failure is not None:
+            self.send_failure(failure)
+            return
+        if self.path.endswith("/audio/transcriptions"):
+            response_format = multipart_field(raw, "response_format") or "json"
+            text = transcription(raw)
+            if response_format == "text":
+                self.send_bytes(200, text.encode("utf-8"), "text/plain")
+            else:
+                self.send_json(200, {"text": text})
+            return
+        body = json.loads(raw) if raw else {}
+        if self.path.endswith("/chat/completions") and body.get("stream"):
+            self.send_stream(chat_completion(body))
+        elif self.path.endswith("/chat/completions"):
+            self.send_json(200, chat_completion(body), self.config.rate_limit_headers())
+        elif self.path.endswith("/embeddings"):
+            self.send_json(200, embeddings(body), self.config.rate_limit_headers())
+        elif self.path.endswith("/moderations"):
+            self.send_json(200, moderation(body))
+        elif self.path.endswith("/images/generations"):
+            host = self.headers.get("Host", "127.0.0.1")
+            self.send_json(200, image_generation(body, f"http://{host}/v1/files/stub.png"))
+        elif self.path.endswith("/audio/speech"):
+            self.send_bytes(200, speech(body), "audio/mpeg")
+        else:
+            self.send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+
+def text_hash(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+
+def count_words(text) -> int:
+    return len(str(text).split())
+
+
+def classification_answer(system_prompt: str, text: str) -> str:
+    """
+    Answers a classifier prompt with category ids picked from the category
+    list of the system prompt, or with a json object for packed requests.
+    """
+    categories = [int(cat) for cat in CATEGORY_PATTERN.findall(system_prompt)]
+    if not categories:
+        return None
+
+    def pick(value: str) -> list:
+        return [categories[text_hash(value) % len(categories)]]
+
+    if text.lstrip().startswith("{"):
+        try:
+            texts = json.loads(text)
+            return json.dumps({key: pick(value) for key, value in texts.items()})
+        except ValueError:
+            pass
+    return json.dumps(pick(text))
+
+
+def translate(value, lang: str):
+    """Tags a text or every text of a list with the target language."""
+    if isinstance(value, list):
+        return [translate(item, lang) for item in value]
+    return f"[{lang}] {value}"
+
+
+def translation_answer(system_prompt: str, text: str) -> str:
+    """
+    Answers a translation prompt with the text tagged with the target
+    language, or with a json object with the same keys for packed requests.
+    """
+    match = PACKED_TRANSLATION_PATTERN.match(system_prompt)
+    if match and PACKED_TRANSLATION_PROMPT in text:
+        # the prompt may start with reference translations, the pack is last
+        pack = text.rsplit(PACKED_TRANSLATION_PROMPT, 1)[1]
+        try:
+            values = json.loads(pack)
+            return json.dumps(
+                {key: translate(value, match.group(1)) for key, value in values.items()},
+                ensure_ascii=False,
+            )
+        except (ValueError, AttributeError):
+            return None
+    match = TRANSLATION_PATTERN.match(system_prompt)
+    if match and text.startswith(TRANSLATION_PROMPT):
+        value = text[len(TRANSLATION_PROMPT):]
+        if value.lstrip().startswith("["):
+            try:
+                return json.dumps(translate(json.loads(value), match.group(1)), ensure_ascii=False)
+            except ValueError:
+                pass
+        return translate(value, match.group(1))
+    return None
+
+
+def chat_completion(body: dict) -> dict:
+    messages = body.get("messages", [])
+    text = messages[-1]["content"] if messages else ""
+    if not isinstance(text, str):
+        # vision requests send a list of parts
+        text = " ".join(part.get("text", "") for part in text if isinstance(part, dict))
+    system_prompt = messages[0]["content"] if len(messages) > 1 else ""
+    prompt_tokens = sum(count_words(m.get("content", "")) for m in messages)
+    content = (
+        classification_answer(str(system_prompt), text)
+        or translation_answer(str(system_prompt), text)
+        or f"echo: {text[:200]}"
+    )
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": count_words(content),
+            "total_tokens": prompt_tokens + count_words(content),
+        },
+    }
+
+
+def embedding_vector(value, dimensions: int) -> list:
+    """Deterministic unit vector derived from the input."""
+    key = value if isinstance(value, str) else json.dumps(value)
+    seed = int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    vector = [rng.gauss(0, 1) for _ in range(dimensions)]
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector]
+
+
+def embeddings(body: dict) -> dict:
+    inputs = body.get("input", [])
+    if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+        inputs = [inputs]
+    dimensions = body.get("dimensions") or EMBEDDING_DIMENSIONS
+    data = []
+    for i, value in enumerate(inputs):
+        vector = embedding_vector(value, dimensions)
+        if body.get("encoding_format") == "base64":
+            vector = base64.b64encode(array.array("f", vector).tobytes()).decode("ascii")
+        data.append({"object": "embedding", "index": i, "embedding": vector})
+    tokens = sum(len(v) if isinstance(v, list) else count_words(v) for v in inputs)
+    return {
+        "object": "list",
+        "data": data,
+        "model": body.get("model", "text-embedding-stub"),
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
+
+
+def moderation(body: dict) -> dict:
+    inputs = body.get("input", "")
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    results = []
+    for value in inputs:
+        rng = random.Random(text_hash(str(value)))
+        scores = {category: rng.random() * 0.01 for category in MODERATION_CATEGORIES}
+        results.append(
+            {
+                "flagged": False,
+                "categories": {category: False for category in MODERATION_CATEGORIES},
+                "category_scores": scores,
+            }
+        )
+    return {
+        "id": "modr-stub",
+        "model": body.get("model", "omni-moderation-latest"),
+        "results": results,
+    }
+
+
+def png_image() -> bytes:
+    """A 1x1 pixel png."""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return (
+            struct.pack(">I", len(data))
+            + kind
+            + data
+            + struct.pack(">I", zlib.crc32(kind + data))
+        )
+
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)
+    pixels = zlib.compress(b"\x00\x20\x60\xa0")
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", pixels) + chunk(b"IEND", b"")
+
+
+def image_generation(body: dict, url: str) -> dict:
+    n = body.get("n") or 1
+    if body.get("response_format") == "b64_json":
+        item = {"b64_json": base64.b64encode(png_image()).decode("ascii")}
+    else:
+        item = {"url": url}
+    item["revised_prompt"] = body.get("prompt", "")
+    return {"created": int(time.time()), "data": [dict(item) for _ in range(n)]}
+
+
+def speech(body: dict) -> bytes:
+    """Silent mp3-like payload, the length grows with the input text."""
+    return b"ID3\x03\x00\x00\x00\x00\x00\x00" + b"\x00" * (16 * len(body.get("input", "")))
+
+
+def multipart_field(raw: bytes, name: str) -> str:
+    match = re.search(
+        rb'name="' + name.encode("ascii") + rb'"\r\n\r\n(.*?)\r\n', raw, re.DOTALL
+    )
+    return match.group(1).decode("utf-8") if match else None
+
+
+def transcription(raw: bytes) -> str:
+    return f"stub transcript of {len(raw)} bytes"
+
+
+def start_server(
+    port: int = DEFAULT_PORT,
+    latency: float = 0.0,
+    latency_dist: str = "constant",
+    error_rate: float = 0.0,
+    rate_limit_rate: float = 0.0,
+    seed: int = 0,
+    rpm: int = DEFAULT_RPM,
+    tpm: int = DEFAULT_TPM,
+):
+    """
+    Starts the stub server in a background thread.
+
+    Args:
+        port (int, optional): The port to listen on, 0 picks a free port.
+        latency (float, optional): Median seconds to wait before a response.
+        latency_dist (str, optional): One of LATENCY_DISTRIBUTIONS.
+        error_rate (float, optional): Share of requests answered with 500.
+        rate_limit_rate (float, optional): Share of requests answered with 429.
+        seed (int, optional): Seed of the latency and error sampling.
+        rpm (int, optional): Requests per minute reported in the headers.
+        tpm (int, optional): Tokens per minute reported in the headers.
+
+    Returns:
+        ThreadingHTTPServer: The running server, stop it with shutdown().
+    """
+    config = StubConfig(latency, latency_dist, error_rate, rate_limit_rate, seed, rpm, tpm)
+    handler = type("Handler", (StubHandler,), {"config": config})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.config = config
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def base_url(server) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--latency-dist", choices=LATENCY_DISTRIBUTIONS, default="constant")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rpm", type=int, default=DEFAULT_RPM)
+    parser.add_argument("--tpm", type=int, default=DEFAULT_TPM)
+    args = parser.parse_args()
+    server = start_server(
+        args.port,
+        args.latency,
+        args.latency_dist,
+        args.error_rate,
+        args.rate_limit_rate,
+        args.seed,
+        args.rpm,
+        args.tpm,
+    )
+    print(f"Stub server listening on {base_url(server)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
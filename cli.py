@@ -0,0 +1,402 @@
+"""
+Runs the batch tools of the toolbox without Streamlit, e.g. as scheduled job
+on a worker node. The settings of the app are passed as options, the outputs
+are written to the output folder (data/output/) as in the app.
+
+The OpenAI key is read from the environment (OPENAI_API_KEY) if there is no
+Streamlit secrets file.
+
+Exit codes:
+    0  the job is complete
+    1  the job is incomplete (failed texts, too many errors or the budget
+       was reached), a classification can be resumed by running it again
+    2  invalid arguments or input file
+    130  interrupted
+
+Usage:
+    python cli.py classify texts.xlsx categories.xlsx --no-match-code -99 --pack-size 10
+    python cli.py train-local categories.xlsx --no-match-code -99
+    python cli.py classify texts.xlsx categories.xlsx --local-model --min-probability 0.9
+    python cli.py translate pairs.csv --source de --target en --sep ";"
+    python cli.py translate strings.json
+    python cli.py translate report.pdf --source de --target fr
+    python cli.py summarize report.pdf notes.txt --limit 20 --limit-type Sätze
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+# st.* calls of the tools are no-ops without a session, the warnings about
+# the missing script context are not needed
+os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+
+import pandas as pd
+
+EXIT_OK = 0
+EXIT_INCOMPLETE = 1
+EXIT_INPUT_ERROR = 2
+EXIT_INTERRUPTED = 130
+# minimal seconds between two progress lines
+PROGRESS_INTERVAL = 2.0
+
+logger = logging.getLogger("cli")
+
+
+class InputError(Exception):
+    """Invalid input found by the cli, reported without traceback."""
+
+
+class ProgressReporter:
+    """
+    Replaces the Streamlit placeholders and progress bars the tools write
+    to. Progress is logged at most every PROGRESS_INTERVAL seconds, other
+    calls on the placeholder are ignored.
+    """
+
+    def __init__(self, interval: float = PROGRESS_INTERVAL):
+        self.interval = interval
+        self._last = 0.0
+
+    def _log(self, message, force: bool = False):
+        now = time.monotonic()
+        if force or now - self._last >= self.interval:
+            self._last = now
+            logger.info(str(message))
+
+    def write(self, message, *args, **kwargs):
+        self._log(message)
+
+    def markdown(self, message, *args, **kwargs):
+        self._log(message)
+
+    def progress(self, value, text: str = None):
+        self._log(f"{value:.0%} {text or ''}", force=value >= 1.0)
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def read_table(file_name: str, sep: str = ",", nrows: int = None) -> pd.DataFrame:
+    if file_name.lower().endswith(".xlsx"):
+        return pd.read_excel(file_name, nrows=nrows)
+    return pd.read_csv(file_name, sep=sep, nrows=nrows)
+
+
+def check_columns(file_name: str, sep: str, min_columns: int, max_columns: int):
+    """Raises InputError if the table has less than min_columns or more than max_columns columns."""
+    columns = len(read_table(file_name, sep, nrows=0).columns)
+    if not min_columns <= columns <= max_columns:
+        expected = min_columns if min_columns == max_columns else f"{min_columns} to {max_columns}"
+        raise InputError(f"{file_name} has {columns} columns, expected {expected}.")
+
+
+def apply_common_settings(tool, args):
+    if args.model:
+        tool.model = args.model
+    tool.max_concurrency = args.concurrency
+    tool.budget = args.budget
+    tool.use_cache = not args.no_cache
+
+
+def report_usage(tool):
+    logger.info(
+        f"Tokens in: {tool.tokens_in}, out: {tool.tokens_out}, "
+        f"cached in: {tool.cached_tokens_in}, out: {tool.cached_tokens_out}, "
+        f"cost: ${tool.cost():.4f}"
+    )
+    if tool.budget_exceeded:
+        logger.warning(f"The budget of ${tool.budget:.2f} was reached.")
+
+
+def classify(args) -> int:
+    import tools.classifier as classifier
+    from tools.dedup import DEDUP_NONE, DEDUP_EXACT, DEDUP_NEAR
+    from tools.input_reader import TableInput
+
+    check_columns(args.categories, args.sep, 2, 3)
+    check_columns(args.texts, args.sep, 2, 2)
+    tool = classifier.Classifier(logger)
+    apply_common_settings(tool, args)
+    tool.set_categories(read_table(args.categories, args.sep))
+    tool.no_match_code = args.no_match_code
+    tool.max_categories = args.max_categories
+    tool.pack_size = args.pack_size
+    tool.hierarchical = not args.flat
+    tool.max_groups = args.max_groups
+    tool.resume = not args.no_resume
+    tool.dedup_mode = {"none": DEDUP_NONE, "exact": DEDUP_EXACT, "near": DEDUP_NEAR}[args.dedup]
+    tool.near_threshold = args.near_threshold
+    tool.pre_classify = args.pre_classify
+    tool.embedding_margin = args.margin
+    tool.use_local_model = args.local_model
+    tool.local_min_probability = args.min_probability
+    tool.text_source = TableInput(args.texts, columns=["text_id", "text"], sep=args.sep)
+    if args.key:
+        tool.set_output_files(args.key)
+    if args.estimate:
+        return print_plan(tool)
+    status = tool.run_classification(ProgressReporter())
+    report_usage(tool)
+    logger.info(
+        f"{tool.text_count} texts, {tool.failed_count} failed, status: {status}, output: {tool.output_file_zip}"
+    )
+    if not tool.stage_summary_df.empty:
+        logger.info(f"Stages:\n{tool.stage_summary_df.to_string(index=False)}")
+    return EXIT_OK if status == "completed" else EXIT_INCOMPLETE
+
+
+def train_local(args) -> int:
+    import tools.classifier as classifier
+
+    check_columns(args.categories, args.sep, 2, 3)
+    tool = classifier.Classifier(logger)
+    tool.set_categories(read_table(args.categories, args.sep))
+    tool.no_match_code = args.no_match_code
+    try:
+        model = tool.train_local_model()
+    except ValueError as err:
+        # too few texts or categories of earlier classifications
+        raise InputError(str(err)) from err
+    logger.info(
+        f"Model {model.file_name} trained with {model.trained_texts} texts, "
+        f"validation: {model.validation['coverage']:.1%} classified locally, "
+        f"{model.validation['agreement']:.1%} of them as by the LLM"
+    )
+    return EXIT_OK
+
+
+def translate(args) -> int:
+    import tools.translation as translation
+    from tools.tool_base import OUTPUT_PATH
+    from tools.input_reader import TableInput
+
+    tool = translation.Translation(logger)
+    apply_common_settings(tool, args)
+    tool.use_tm = not args.no_tm
+    tool.tm_fuzzy_threshold = args.tm_threshold
+    tool.tm_reuse_fuzzy = args.tm_reuse_fuzzy
+    tool.pack_size = args.pack_size
+    reporter = ProgressReporter()
+    file_name = os.path.basename(args.input)
+    if args.input.lower().endswith(".csv"):
+        tool.input_type = tool.formats[translation.InputFormat.KEY_VALUE_PAIRS.value]
+        check_columns(args.input, args.sep, 2, 2)
+        tool.separator = args.sep
+        tool.lang_source, tool.lang_target = args.source, args.target
+        tool.data_source = TableInput(args.input, columns=["key", "value"], sep=args.sep)
+        tool.set_system_prompt(args.source, args.target)
+        if args.estimate:
+            return print_plan(tool)
+        tool.start_budget()
+        output_file, _ = tool.translate_csv(file_name, reporter)
+        failed = tool.failed_rows
+    elif args.input.lower().endswith(".json"):
+        tool.input_type = tool.formats[translation.InputFormat.MULTI_LANG_JSON.value]
+        with open(args.input, "r", encoding="utf-8") as file:
+            tool.input_file = file
+            if not tool.parse_json():
+                logger.error(f"{args.input} is not a multi-lang json file.")
+                return EXIT_INPUT_ERROR
+        pending = len(tool.get_changed_items())
+        if tool.fingerprints is None:
+            logger.info(f"The file has no fingerprints, {pending} keys pending.")
+        else:
+            logger.info(f"{pending} keys new or changed since the last translation.")
+        if args.estimate:
+            return print_plan(tool)
+        tool.start_budget()
+        output = tool.translate_json_file(reporter)
+        output_file = tool.json_output_file(file_name)
+        with open(output_file, "w", encoding="utf-8") as file:
+            json.dump(output, file, indent=4, ensure_ascii=False)
+        failed = 0
+    elif args.input.lower().endswith((".txt", ".pdf")):
+        from helper import extract_text_from_file
+
+        tool.input_type = tool.formats[translation.InputFormat.FILE.value]
+        tool.lang_source, tool.lang_target = args.source, args.target
+        tool.text = extract_text_from_file(args.input)
+        if not tool.text:
+            logger.error(f"No text found in {args.input}.")
+            return EXIT_INPUT_ERROR
+        if args.estimate:
+            return print_plan(tool)
+        tool.start_budget()
+        output = tool.translate_document(reporter)
+        output_file = os.path.join(OUTPUT_PATH, os.path.splitext(file_name)[0] + "_translation.txt")
+        with open(output_file, "w", encoding="utf-8") as file:
+            file.write(output)
+        failed = len(tool.failed_chunks())
+    else:
+        logger.error("Only csv (key value pairs), json (multi-lang), txt and pdf files are supported.")
+        return EXIT_INPUT_ERROR
+    report_usage(tool)
+    if tool.use_tm:
+        logger.info(tool.tm_report())
+    logger.info(f"Output: {output_file}, failed rows or chunks: {failed}")
+    return EXIT_INCOMPLETE if failed or tool.budget_exceeded else EXIT_OK
+
+
+def summarize(args) -> int:
+    import tools.summarizer as summarizer
+    from helper import extract_text_from_file
+
+    tool = summarizer.Summary(logger)
+    apply_common_settings(tool, args)
+    tool.limit_number = args.limit
+    tool.limit_type = args.limit_type
+    reporter = ProgressReporter()
+    tool.start_budget()
+    incomplete = 0
+    for path in args.files:
+        if tool.budget_reached():
+            tool.budget_exceeded = True
+            break
+        text = extract_text_from_file(path)
+        if not text:
+            logger.error(f"{path} is empty or could not be read.")
+            incomplete += 1
+            continue
+        file_name = os.path.basename(path)
+        result = tool.summarize_text(text, file_name, reporter)
+        if not result["summary"]:
+            incomplete += 1
+        tool.save_file(os.path.splitext(file_name)[0] + ".json", result)
+        logger.info(f"{file_name}: {result['title']}")
+    report_usage(tool)
+    return EXIT_INCOMPLETE if incomplete or tool.budget_exceeded else EXIT_OK
+
+
+def print_plan(tool) -> int:
+    plan = tool.estimate_cost()
+    if plan is None:
+        logger.error("The input contains no texts.")
+        return EXIT_INPUT_ERROR
+    print(plan.to_dataframe(tool.max_concurrency).to_string(index=False))
+    return EXIT_OK
+
+
+def build_parser() -> argparse.ArgumentParser:
+    from tools.tool_base import DEFAULT_MAX_CONCURRENCY, MAX_CONCURRENCY_LIMIT, MODEL_OPTIONS
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "--model", choices=MODEL_OPTIONS, help="model, defaults to the model of the tool"
+    )
+    common.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_MAX_CONCURRENCY,
+        choices=range(1, MAX_CONCURRENCY_LIMIT + 1),
+        metavar=f"1..{MAX_CONCURRENCY_LIMIT}",
+        help="parallel requests",
+    )
+    common.add_argument("--budget", type=float, default=0.0, help="cost limit in USD, 0 = no limit")
+    common.add_argument("--no-cache", action="store_true", help="do not use the response cache")
+    common.add_argument("--telemetry", help="write the recorded API calls to this csv file")
+    common.add_argument("-v", "--verbose", action="store_true")
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_classify = commands.add_parser("classify", parents=[common], help="classify texts")
+    parser_classify.add_argument("texts", help="csv or xlsx file with the columns text_id and text")
+    parser_classify.add_argument(
+        "categories", help="csv or xlsx file with the columns cat_id, text and optionally group"
+    )
+    parser_classify.add_argument("--sep", default=",", help="separator of csv input files")
+    parser_classify.add_argument("--no-match-code", type=int, default=-99)
+    parser_classify.add_argument("--max-categories", type=int, default=3)
+    parser_classify.add_argument("--pack-size", type=int, default=1, help="texts per request")
+    parser_classify.add_argument("--max-groups", type=int, default=2, help="groups selected in the first stage")
+    parser_classify.add_argument("--flat", action="store_true", help="ignore the groups of the categories")
+    parser_classify.add_argument("--dedup", choices=["none", "exact", "near"], default="exact")
+    parser_classify.add_argument("--near-threshold", type=float, default=0.9)
+    parser_classify.add_argument("--pre-classify", action="store_true", help="embedding pre-classifier")
+    parser_classify.add_argument("--margin", type=float, default=0.05, help="margin of the pre-classifier")
+    parser_classify.add_argument(
+        "--local-model", action="store_true", help="classify confident texts with the local model"
+    )
+    parser_classify.add_argument(
+        "--min-probability", type=float, default=0.9, help="minimal probability of the local model"
+    )
+    parser_classify.add_argument("--no-resume", action="store_true", help="do not continue a previous run")
+    parser_classify.add_argument("--key", help="key in the names of the output files")
+    parser_classify.add_argument("--estimate", action="store_true", help="only show the cost estimate")
+    parser_classify.set_defaults(func=classify)
+
+    parser_train = commands.add_parser(
+        "train-local",
+        parents=[common],
+        help="train the local model of a category set with the results of earlier classifications",
+    )
+    parser_train.add_argument("categories", help="csv or xlsx file with the columns cat_id, text and optionally group")
+    parser_train.add_argument("--sep", default=",", help="separator of a csv file")
+    parser_train.add_argument("--no-match-code", type=int, default=-99)
+    parser_train.set_defaults(func=train_local)
+
+    parser_translate = commands.add_parser(
+        "translate", parents=[common], help="translate a key value csv, a multi-lang json or a document"
+    )
+    parser_translate.add_argument("input", help="csv (key, value), multi-lang json, txt or pdf file")
+    parser_translate.add_argument("--source", default="de", help="source language of csv and document files")
+    parser_translate.add_argument("--target", default="en", help="target language of csv and document files")
+    parser_translate.add_argument("--sep", default=";", help="separator of the csv file")
+    parser_translate.add_argument(
+        "--pack-size", type=int, default=50, help="entries of a csv or json file translated in one request"
+    )
+    parser_translate.add_argument("--no-tm", action="store_true", help="do not use the translation memory")
+    parser_translate.add_argument(
+        "--tm-threshold", type=float, default=0.8, help="minimal similarity of a translation memory match"
+    )
+    parser_translate.add_argument(
+        "--tm-reuse-fuzzy", action="store_true", help="reuse similar translations without a request"
+    )
+    parser_translate.add_argument("--estimate", action="store_true", help="only show the cost estimate")
+    parser_translate.set_defaults(func=translate)
+
+    parser_summarize = commands.add_parser("summarize", parents=[common], help="summarize pdf or txt files")
+    parser_summarize.add_argument("files", nargs="+", help="pdf or txt files")
+    parser_summarize.add_argument("--limit", type=int, default=500, help="maximal length of the summary")
+    parser_summarize.add_argument(
+        "--limit-type", choices=["Zeichen", "Tokens", "Sätze"], default="Zeichen"
+    )
+    parser_summarize.set_defaults(func=summarize)
+    return parser
+
+
+def main(argv: list = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+    if not args.verbose:
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+    for path in getattr(args, "files", None) or [
+        getattr(args, name) for name in ("texts", "categories", "input") if hasattr(args, name)
+    ]:
+        if not os.path.isfile(path):
+            logger.error(f"File not found: {path}")
+            return EXIT_INPUT_ERROR
+    try:
+        exit_code = args.func(args)
+    except KeyboardInterrupt:
+        logger.warning("Interrupted.")
+        exit_code = EXIT_INTERRUPTED
+    except InputError as err:
+        logger.error(f"Invalid input: {err}")
+        exit_code = EXIT_INPUT_ERROR
+    if args.telemetry:
+        from tools.telemetry import get_telemetry
+
+        get_telemetry().to_csv(args.telemetry)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -50,6 +50,12 @@ def save_json_object(data, filename):
         json.dump(data, file, indent=4)
 
 
+def to_builtin(value):
+    """Converts numpy scalars (e.g. ids read with pandas) to python types, so
+    they can be serialized to json."""
+    return value.item() if hasattr(value, "item") else value
+
+
 def download_button(data, download_filename, button_text):
     """
     Generates a download button for a given data object.
@@ -94,7 +100,8 @@ def get_var(varname: str) -> str:
     Retrieves the value of a given environment variable or secret from the Streamlit configuration.
 
     If the current host is the local machine (according to the hostname), the environment variable is looked up in the system's environment variables.
-    Otherwise, the secret value is fetched from Streamlit's secrets dictionary.
+    Otherwise, the secret value is fetched from Streamlit's secrets dictionary,
+    falling back to the environment variable if the secret is not defined.
 
     Args:
         varname (str): The name of the environment variable or secret to retrieve.
@@ -107,8 +114,13 @@ def get_var(varname: str) -> str:
     """
     if socket.gethostname().lower() == LOCAL_HOST:
         return os.environ[varname]
-    else:
+    try:
         return st.secrets[varname]
+    except (KeyError, FileNotFoundError):
+        # no secrets file, e.g. when running headless or in benchmarks
+        if varname in os.environ:
+            return os.environ[varname]
+        raise
 
 
 def get_random_word(length=5) -> str:
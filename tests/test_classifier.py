@@ -0,0 +1,57 @@
+import os
+import sys
+import logging
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd
+
+import tools.classifier as classifier
+import tools.input_reader as input_reader
+from tools.input_reader import TableInput
+
+
+class Placeholder:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class Classifier(classifier.Classifier):
+    """Assigns every text to category 1, counts the requests per text."""
+
+    def __init__(self, logger):
+        super().__init__(logger)
+        self.requests = {}
+
+    def count_tokens(self, texts):
+        return [len(text) // 4 for text in texts]
+
+    def get_completion(self, text, index=0, system_prompt=None, use_cache=None, max_tokens=None, response_format=None):
+        self.requests[text] = self.requests.get(text, 0) + 1
+        return "[1]", [1, 1]
+
+
+def test_duplicates_in_later_chunks_are_classified_once(tmp_path, monkeypatch):
+    for name in ("OUTPUT_LONG", "OUTPUT_SHORT", "OUTPUT_STAT", "OUTPUT_ZIP", "OUTPUT_ERROR", "JOB_MANIFEST"):
+        monkeypatch.setattr(classifier, name, str(tmp_path / os.path.basename(getattr(classifier, name))))
+    monkeypatch.setattr(input_reader, "CHUNK_ROWS", 3)
+    texts = ["Text A", "Text B", "Text C", "Text A", "text  b", "Text D", "Text C"]
+    input_file = tmp_path / "texts.csv"
+    pd.DataFrame({"text_id": range(len(texts)), "text": texts}).to_csv(input_file, index=False)
+    tool = Classifier(logging.getLogger(__name__))
+    tool.use_cache = False
+    tool.resume = False
+    tool.pack_size = 1
+    tool.max_concurrency = 1
+    tool.categories_dic = {1: "Eins", 2: "Zwei"}
+    tool.text_source = TableInput(str(input_file), columns=["text_id", "text"])
+    tool.set_output_files("dedup")
+
+    assert tool.run_classification(Placeholder()) == "completed"
+
+    assert tool.requests == {"Text A": 1, "Text B": 1, "Text C": 1, "Text D": 1}
+    assert tool.duplicate_count == 3
+    assert tool.estimate_cost().requests == 4
+    short = pd.read_csv(tool.output_file_short, sep=";")
+    assert sorted(short["text_id"]) == list(range(len(texts)))
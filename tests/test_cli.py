@@ -0,0 +1,24 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pytest
+
+import cli
+
+
+def test_unknown_model_is_rejected(tmp_path, capsys):
+    input_file = tmp_path / "pairs.csv"
+    input_file.write_text("key,value\nk1,Wert\n")
+    with pytest.raises(SystemExit) as exit:
+        cli.main(["translate", str(input_file), "--model", "gpt-4o-mini"])
+    assert exit.value.code == cli.EXIT_INPUT_ERROR
+    assert "invalid choice" in capsys.readouterr().err
+
+
+def test_wrong_number_of_columns(tmp_path):
+    input_file = tmp_path / "pairs.csv"
+    input_file.write_text("key\nk1\n")
+    assert cli.main(["translate", str(input_file), "--estimate"]) == cli.EXIT_INPUT_ERROR
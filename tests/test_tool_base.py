@@ -0,0 +1,36 @@
+import os
+import sys
+import logging
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import tools.tool_base as tool_base
+from tools.llm_cache import ResponseCache
+
+
+class FailingCompletions:
+    def create(self, **kwargs):
+        raise ValueError("invalid request")
+
+
+class FailingClient:
+    def __init__(self):
+        completions = type("Completions", (), {"with_raw_response": FailingCompletions()})
+        self.chat = type("Chat", (), {"completions": completions})
+
+
+def test_response_format_is_part_of_the_cache_key():
+    request = ("gpt-4o", "system", "text", 0.3, 100)
+    assert ResponseCache.make_key(*request) == ResponseCache.make_key(*request, None)
+    assert ResponseCache.make_key(*request) != ResponseCache.make_key(
+        *request, {"type": "json_object"}
+    )
+
+
+def test_failed_completion_has_no_tokens(monkeypatch):
+    monkeypatch.setattr(tool_base, "get_client", lambda **kwargs: FailingClient())
+    tool = tool_base.ToolBase(logging.getLogger(__name__))
+    tool.use_cache = False
+    assert tool.get_completion("text", 7, system_prompt="system") == ("", [0, 0])
+    assert "ValueError" in tool.failed_calls[7]
@@ -0,0 +1,104 @@
+import os
+import sys
+import io
+import json
+import logging
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd
+
+import tools.translation as translation
+
+
+class Placeholder:
+    def __init__(self):
+        self.messages = []
+
+    def markdown(self, message, *args, **kwargs):
+        self.messages.append(message)
+
+
+class Translator(translation.Translation):
+    """Answers all requests with the values prefixed by EN."""
+
+    def __init__(self, logger):
+        super().__init__(logger)
+        self.use_cache = False
+        self.use_tm = False
+        self.calls = 0
+
+    def count_tokens(self, texts):
+        return [len(text) // 4 for text in texts]
+
+    def get_completion(self, text, index=0, system_prompt=None, use_cache=None, max_tokens=None, response_format=None):
+        self.calls += 1
+        if "JSON object: " in text:
+            values = json.loads(text.split("JSON object: ", 1)[1])
+            return json.dumps({key: f"EN {value}" for key, value in values.items()}), [10, 10]
+        return "EN " + text.split(": ", 1)[1], [1, 1]
+
+
+class FirstPackFails(Translator):
+    """Fails the first request completely, answers all others."""
+
+    def get_completion(self, text, index=0, system_prompt=None, use_cache=None, max_tokens=None, response_format=None):
+        if self.calls == 0:
+            self.calls += 1
+            return "", [0, 0]
+        return super().get_completion(text, index, system_prompt, use_cache, max_tokens, response_format)
+
+
+def test_rows_progress_without_finished_rows():
+    assert translation.rows_progress_expression(0, 100, 5.0).endswith("–")
+    assert "10.0 Zeilen/s" in translation.rows_progress_expression(50, 100, 5.0)
+
+
+def test_translate_csv_first_pack_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(translation, "OUTPUT_PATH", f"{tmp_path}/")
+    tool = FirstPackFails(logging.getLogger(__name__))
+    tool.max_concurrency = 1
+    tool.pack_size = 5
+    tool.data = pd.DataFrame(
+        {"key": [f"k{i}" for i in range(10)], "value": [f"Wert {i}" for i in range(10)]}
+    )
+    placeholder = Placeholder()
+
+    file_name, _ = tool.translate_csv("pairs.csv", placeholder)
+
+    assert placeholder.messages[0] == "0 von 10 Zeilen übersetzt, verbleibend ca. –"
+    assert tool.failed_rows == 0
+    result = pd.read_csv(file_name, sep=";")
+    assert list(result["translation"]) == [f"EN Wert {i}" for i in range(10)]
+
+
+class Progress:
+    def progress(self, *args, **kwargs):
+        pass
+
+
+def parse(tool, data):
+    tool.input_file = io.StringIO(json.dumps(data))
+    assert tool.parse_json()
+
+
+def test_fingerprints_are_stored_in_the_translated_file():
+    tool = Translator(logging.getLogger(__name__))
+    source = {"a": "Hallo", "b": "Welt"}
+    parse(tool, {"source": source, "de": dict(source), "en": {}})
+    assert tool.fingerprints is None
+    assert sorted(tool.get_changed_items()) == ["a", "b"]
+
+    output = tool.translate_json_file(Progress())
+    assert translation.FINGERPRINTS_KEY in output
+    assert output["en"] == {"a": "EN Hallo", "b": "EN Welt"}
+
+    # the downloaded file is up to date
+    parse(tool, json.loads(json.dumps(output)))
+    assert tool.get_changed_items() == []
+
+    # a changed source value is found in the downloaded file
+    output["source"]["a"] = "Hallo zusammen"
+    parse(tool, json.loads(json.dumps(output)))
+    assert tool.get_changed_items() == ["a"]
@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tools.translation_memory import TranslationMemory
+
+
+def memory(tmp_path):
+    tm = TranslationMemory(str(tmp_path / "tm.db"))
+    tm.add(
+        [
+            ("Der Bericht wurde heute veröffentlicht.", "The report was published today.", [10, 8]),
+            ("Die Sitzung beginnt um neun Uhr.", "The meeting starts at nine.", [9, 7]),
+        ],
+        "de",
+        "en",
+    )
+    return tm
+
+
+def test_fuzzy_match(tmp_path):
+    tm = memory(tmp_path)
+    exact, fuzzy, missing = tm.lookup(
+        [
+            "Die Sitzung beginnt um neun Uhr.",
+            "Der Bericht wurde gestern veröffentlicht.",
+            "Ein ganz anderer Satz ohne Entsprechung.",
+        ],
+        "de",
+        "en",
+        0.8,
+    )
+    assert exact[2] == 1.0
+    assert fuzzy[1] == "The report was published today."
+    assert 0.8 <= fuzzy[2] < 1.0
+    assert missing is None
+
+
+def test_no_fuzzy_lookup_at_threshold_one(tmp_path, monkeypatch):
+    tm = memory(tmp_path)
+    monkeypatch.setattr(tm, "fuzzy_matches", lambda *args: pytest.fail("fuzzy lookup with threshold 1"))
+    matches = tm.lookup(["Der Bericht wurde gestern veröffentlicht."], "de", "en", 1.0)
+    assert matches == [None]
@@ -0,0 +1,295 @@
+import os
+import json
+import uuid
+from datetime import datetime
+
+from tools.llm_client import get_client
+
+BATCH_PATH = "./data/batch/"
+JOBS_PATH = BATCH_PATH + "jobs/"
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+EXECUTION_MODE_OPTIONS = ["Interaktiv", "Batch (asynchron)"]
+FINAL_STATES = ["completed", "failed", "expired", "cancelled"]
+
+
+def build_request(
+    custom_id: str,
+    model: str,
+    system_prompt: str,
+    text: str,
+    temperature: float,
+    max_tokens: int,
+) -> dict:
+    """Builds one line of a batch input file for the chat completions endpoint."""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": text},
+            ],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        },
+    }
+
+
+def write_jsonl(file_name: str, rows: list):
+    with open(file_name, "w", encoding="utf-8") as file:
+        for row in rows:
+            file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+def read_jsonl(file_name: str) -> list:
+    with open(file_name, "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def parse_output_lines(lines: list) -> dict:
+    """
+    Parses the lines of a batch output file.
+
+    Args:
+        lines (list): Decoded json lines of the output or error file.
+
+    Returns:
+        dict: custom_id -> {"content": str, "tokens": [in, out], "error": str}
+    """
+    results = {}
+    for line in lines:
+        response = line.get("response") or {}
+        body = response.get("body") or {}
+        if line.get("error") or response.get("status_code", 200) >= 400:
+            error = line.get("error") or body.get("error") or "unknown error"
+            results[line["custom_id"]] = {"content": "", "tokens": [0, 0], "error": str(error)}
+            continue
+        usage = body.get("usage", {})
+        results[line["custom_id"]] = {
+            "content": body["choices"][0]["message"]["content"].strip(),
+            "tokens": [usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)],
+            "error": None,
+        }
+    return results
+
+
+class BatchBackend:
+    """Interface of the batch backends."""
+
+    name = None
+
+    def submit(self, requests_file: str) -> str:
+        """Submits a jsonl requests file and returns the remote batch id."""
+        raise NotImplementedError
+
+    def status(self, remote_id: str) -> str:
+        """Returns the status of a batch, see FINAL_STATES."""
+        raise NotImplementedError
+
+    def results(self, remote_id: str) -> dict:
+        """Returns the results of a completed batch, see parse_output_lines."""
+        raise NotImplementedError
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """Runs the jobs with the OpenAI Batch API."""
+
+    name = "openai"
+
+    def submit(self, requests_file: str) -> str:
+        client = get_client()
+        with open(requests_file, "rb") as file:
+            input_file = client.files.create(file=file, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=COMPLETION_WINDOW,
+        )
+        return batch.id
+
+    def status(self, remote_id: str) -> str:
+        return get_client().batches.retrieve(remote_id).status
+
+    def results(self, remote_id: str) -> dict:
+        client = get_client()
+        batch = client.batches.retrieve(remote_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                text = client.files.content(file_id).text
+                lines += [json.loads(line) for line in text.splitlines() if line.strip()]
+        return parse_output_lines(lines)
+
+
+def echo_responder(body: dict) -> str:
+    return body["messages"][-1]["content"]
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    File based stand-in for the batch API. A batch is processed on the first
+    status request after submission, each request is answered by the
+    responder function. The default responder echoes the user message, jobs
+    of tools with an entry in LOCAL_RESPONDERS are answered by that one.
+    """
+
+    name = "local"
+
+    def __init__(self, responder=echo_responder, folder: str = BATCH_PATH + "local/"):
+        self.responder = responder
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def file_name(self, remote_id: str, kind: str) -> str:
+        return os.path.join(self.folder, f"{remote_id}_{kind}.jsonl")
+
+    def submit(self, requests_file: str) -> str:
+        remote_id = f"local_batch_{uuid.uuid4().hex[:12]}"
+        write_jsonl(self.file_name(remote_id, "input"), read_jsonl(requests_file))
+        return remote_id
+
+    def status(self, remote_id: str) -> str:
+        if os.path.exists(self.file_name(remote_id, "output")):
+            return "completed"
+        if not os.path.exists(self.file_name(remote_id, "input")):
+            return "failed"
+        output = []
+        for request in read_jsonl(self.file_name(remote_id, "input")):
+            content = self.responder(request["body"])
+            output.append(
+                {
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": {
+                            "choices": [{"message": {"content": content}}],
+                            "usage": {
+                                "prompt_tokens": sum(
+                                    len(m["content"].split()) for m in request["body"]["messages"]
+                                ),
+                                "completion_tokens": len(content.split()),
+                            },
+                        },
+                    },
+                    "error": None,
+                }
+            )
+        write_jsonl(self.file_name(remote_id, "output"), output)
+        return "completed"
+
+    def results(self, remote_id: str) -> dict:
+        return parse_output_lines(read_jsonl(self.file_name(remote_id, "output")))
+
+
+BACKENDS = {
+    OpenAIBatchBackend.name: OpenAIBatchBackend,
+    LocalBatchBackend.name: LocalBatchBackend,
+}
+# responders of the local backend per tool, tools without responder get echo_responder
+LOCAL_RESPONDERS = {}
+DEFAULT_BACKEND = os.environ.get("BATCH_BACKEND", OpenAIBatchBackend.name)
+
+
+class BatchJob:
+    """
+    A submitted batch job. The job is persisted as json file in JOBS_PATH, so
+    it can be polled and merged after a restart of the app.
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        tool: str,
+        backend: str,
+        remote_id: str = None,
+        status: str = "created",
+        meta: dict = None,
+        created: str = None,
+        merged: bool = False,
+        output_file: str = None,
+    ):
+        self.job_id = job_id
+        self.tool = tool
+        self.backend = backend
+        self.remote_id = remote_id
+        self.status = status
+        self.meta = meta or {}
+        self.created = created or datetime.now().strftime("%Y-%m-%d %H:%M")
+        self.merged = merged
+        self.output_file = output_file
+
+    @property
+    def requests_file(self) -> str:
+        return os.path.join(BATCH_PATH, f"{self.job_id}_requests.jsonl")
+
+    @property
+    def manifest_file(self) -> str:
+        return os.path.join(JOBS_PATH, f"{self.job_id}.json")
+
+    def get_backend(self) -> BatchBackend:
+        if self.backend == LocalBatchBackend.name:
+            return LocalBatchBackend(LOCAL_RESPONDERS.get(self.tool, echo_responder))
+        return BACKENDS[self.backend]()
+
+    def save(self):
+        os.makedirs(JOBS_PATH, exist_ok=True)
+        with open(self.manifest_file, "w", encoding="utf-8") as file:
+            json.dump(self.__dict__, file, indent=4, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, manifest_file: str):
+        with open(manifest_file, "r", encoding="utf-8") as file:
+            return cls(**json.load(file))
+
+    def requests(self) -> list:
+        return read_jsonl(self.requests_file)
+
+    def poll(self) -> str:
+        """Updates and returns the status of the job."""
+        if self.status not in FINAL_STATES:
+            self.status = self.get_backend().status(self.remote_id)
+            self.save()
+        return self.status
+
+    def results(self) -> dict:
+        return self.get_backend().results(self.remote_id)
+
+
+def submit_batch(tool: str, requests: list, meta: dict, backend: str = DEFAULT_BACKEND) -> BatchJob:
+    """
+    Writes the requests to a jsonl file, submits it to the backend and
+    persists the job.
+
+    Args:
+        tool (str): Name of the tool submitting the job.
+        requests (list): Requests created with build_request.
+        meta (dict): Tool specific data needed to merge the results.
+        backend (str, optional): Key of the backend in BACKENDS.
+
+    Returns:
+        BatchJob: The submitted job.
+    """
+    os.makedirs(BATCH_PATH, exist_ok=True)
+    job_id = f"{tool.lower()}_{datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}_{uuid.uuid4().hex[:6]}"
+    job = BatchJob(job_id, tool, backend, meta=meta)
+    write_jsonl(job.requests_file, requests)
+    job.remote_id = job.get_backend().submit(job.requests_file)
+    job.status = "submitted"
+    job.save()
+    return job
+
+
+def list_jobs(tool: str = None) -> list:
+    """Returns the persisted jobs, newest first, optionally only those of a tool."""
+    if not os.path.exists(JOBS_PATH):
+        return []
+    jobs = [
+        BatchJob.load(os.path.join(JOBS_PATH, file_name))
+        for file_name in os.listdir(JOBS_PATH)
+        if file_name.endswith(".json")
+    ]
+    jobs = [job for job in jobs if tool is None or job.tool == tool]
+    return sorted(jobs, key=lambda job: job.job_id, reverse=True)
@@ -1,20 +1,42 @@
 import streamlit as st
+import re
 import json
+import hashlib
+import glob
 from datetime import datetime
 import os
+import time
+import logging
+from collections import deque
+import numpy as np
 import pandas as pd
 import altair as alt
 from enum import Enum
 
-from helper import create_file, append_row, zip_files, init_logging
+from helper import create_file, append_row, zip_files, init_logging, to_builtin
+from tools.batch import build_request, submit_batch, LOCAL_RESPONDERS
+from tools.result_buffer import ResultBuffer
+from tools.input_reader import table_from_upload, read_excel_cached
+from tools.local_classifier import (
+    LocalClassifier,
+    categories_key,
+    DEFAULT_MIN_PROBABILITY,
+)
+from tools.dedup import (
+    DuplicateIndex,
+    DEDUP_NONE,
+    DEDUP_EXACT,
+    DEDUP_NEAR,
+    DEFAULT_NEAR_THRESHOLD,
+)
 from tools.tool_base import (
     ToolBase,
     DEFAULT_MODEL,
-    MAX_ERRORS,
     LOGFILE,
     DEMO_PATH,
     OUTPUT_PATH,
-    DEFAULT_MODEL
+    EMBEDDING_MODEL,
+    EMBEDDING_BATCH_SIZE,
 )
 
 
@@ -23,6 +45,7 @@ OUTPUT_SHORT = OUTPUT_PATH + "output_short_{}.csv"
 OUTPUT_STAT = OUTPUT_PATH + "output_stat_{}.csv"
 OUTPUT_ZIP = OUTPUT_PATH + "output_{}.zip"
 OUTPUT_ERROR = OUTPUT_PATH + "output_error_{}.txt"
+JOB_MANIFEST = OUTPUT_PATH + "job_classifier_{}.json"
 DEMO_TEXTS_FILE = DEMO_PATH + "demo_texts.xlsx"
 DEMO_CATEORIES_FILE = DEMO_PATH + "demo_categories.xlsx"
 
@@ -43,19 +66,72 @@ categories: [1: Bildung, 2: Bevölkerung, 3: Arbeit und Erwerb, 4: Energie]\n
 text: "Wie spät ist es?"\n
 output: [{2}]
 """
+PACKED_SYSTEM_PROMPT_TEMPLATE = """You are a expert data classifier. You will be provided with a JSON object that maps text ids to texts. Your task is to assign each text to one to maximum {0} of the following categories: [{1}]\n
+Answer with a JSON object that maps every text id to a list of indexes of the matching categories for this text. If none of the categories apply to a text use [{2}]. Always answer with the JSON object only, the lists must only include numbers.\n
+examples for categories: [1: Bildung, 2: Bevölkerung, 3: Arbeit und Erwerb, 4: Energie]\n
+texts: {{"1": "Wieviele Personen in Basel sind 100-jährig oder älter?", "2": "Wie spät ist es?"}}\n
+output: {{"1": [2], "2": [{2}]}}
+"""
+# upper limit for the texts in one packed request, keeps single failures cheap
+MAX_PACK_INPUT_TOKENS = 8000
+MAX_PACK_SIZE = 50
+# tokens of the id, quotes and separators of a text in the json object
+PACK_TEXT_OVERHEAD = 8
+# minimal difference between the cosine similarity of the best and the second
+# best category for an assignment by the embedding pre-classifier
+DEFAULT_EMBEDDING_MARGIN = 0.05
+# the job stops if MAX_FAILURE_RATE of the last FAILURE_WINDOW texts failed,
+# the rate is checked once MIN_FAILURE_SAMPLES texts are done
+FAILURE_WINDOW = 50
+MIN_FAILURE_SAMPLES = 10
+MAX_FAILURE_RATE = 0.5
+# retry pass for failed texts: one text per request, more attempts and a
+# longer read timeout than in the main pass
+RETRY_LLM_RETRIES = 5
+RETRY_TIMEOUT = 300.0
+NO_RESPONSE_ERROR = "Keine Antwort"
+INVALID_RESPONSE_ERROR = "invalid response"
+# groups selected in the first stage of the two-stage classification
+DEFAULT_MAX_GROUPS = 2
+DEDUP_OPTIONS = [
+    "Nicht zusammenfassen",
+    "Identische Texte zusammenfassen",
+    "Identische und ähnliche Texte zusammenfassen",
+]
 logger = init_logging(__name__, LOGFILE)
 
 
+def parse_category_ids(response: str):
+    """Returns the category ids of a response, None if it is no json list of ids."""
+    try:
+        return [int(cat) for cat in json.loads(response)]
+    except (ValueError, TypeError):
+        return None
+
+
+def local_batch_responder(body: dict) -> str:
+    """Answers a request of the local batch backend with the no match code of its system prompt."""
+    match = re.search(r"return \[(-?\d+)\]", body["messages"][0]["content"])
+    return f"[{match.group(1)}]" if match else "[]"
+
+
 class Classifier(ToolBase):
     def __init__(self, logger):
         super().__init__(logger)
         self.title = "Klassifizierung"
         self._texts_df = pd.DataFrame()
+        self.text_source = None
+        self.text_count = 0
         self._categories_dic = {}
+        self.category_groups = {}
         self._settings = {}
         self.results_df = pd.DataFrame()
         self.stats_df = pd.DataFrame()
         self.errors = []
+        # failed texts of the current job: text, rows (text id, text) and reason
+        self.dead_letters = []
+        self.failed_count = 0
+        self.outcomes = deque(maxlen=FAILURE_WINDOW)
         self.category_list_expression = ""
 
         self.texts_input = None
@@ -68,18 +144,38 @@ class Classifier(ToolBase):
         self.no_match_code = -99
         self.no_match_code_options = []
         self.max_categories = 10
+        self.pack_size = 1
+        self.hierarchical = True
+        self.max_groups = DEFAULT_MAX_GROUPS
+        self.resume = True
+        self.pre_classify = False
+        self.embedding_margin = DEFAULT_EMBEDDING_MARGIN
+        self.stage_summary_df = pd.DataFrame()
+        self.use_local_model = False
+        self.local_min_probability = DEFAULT_MIN_PROBABILITY
+        self.local_model = None
+        self.dedup_mode = DEDUP_EXACT
+        self.near_threshold = DEFAULT_NEAR_THRESHOLD
+        self.duplicate_count = 0
+        # duplicates of a job across its chunks, see classify_chunk
+        self.duplicates = None
+        self.known_responses = {}
         self.model = DEFAULT_MODEL
 
-        self.key = f"{datetime.now().strftime('%Y-%m-%d-%H-%M')}"
+        self.set_output_files(f"{datetime.now().strftime('%Y-%m-%d-%H-%M')}")
+
+        self.script_name, script_extension = os.path.splitext(__file__)
+        self.intro = self.get_intro()
+
+    def set_output_files(self, key: str):
+        """Sets the key used in the names of all output files."""
+        self.key = key
         self.output_file_long = OUTPUT_LONG.format(self.key)
         self.output_file_short = OUTPUT_SHORT.format(self.key)
         self.output_file_stat = OUTPUT_STAT.format(self.key)
         self.output_errors = OUTPUT_ERROR.format(self.key)
         self.output_file_zip = OUTPUT_ZIP.format(self.key)
 
-        self.script_name, script_extension = os.path.splitext(__file__)
-        self.intro = self.get_intro()
-
     @property
     def texts_df(self):
         return self._texts_df
@@ -87,6 +183,19 @@ class Classifier(ToolBase):
     @texts_df.setter
     def texts_df(self, value):
         self._texts_df = value
+        # texts set directly replace an uploaded file
+        self.text_source = None
+
+    def text_chunks(self):
+        """
+        Yields the input texts as DataFrames with the columns text_id and
+        text. Uploaded files are read in chunks, the index continues over all
+        chunks.
+        """
+        if self.text_source is not None:
+            yield from self.text_source.chunks()
+        else:
+            yield self.texts_df
 
     @property
     def categories_dic(self):
@@ -99,6 +208,43 @@ class Classifier(ToolBase):
         for k, v in value.items():
             cat_list.append(f'{k}: "{v}"')
         self.category_list_expression = ",".join(cat_list)
+        # categories set without groups
+        self.category_groups = {}
+
+    @property
+    def category_groups(self):
+        return self._category_groups
+
+    @category_groups.setter
+    def category_groups(self, value):
+        self._category_groups = value
+        # group names in the order of the categories, numbered from 1 in the prompt
+        self.groups = list(
+            dict.fromkeys(group for group in value.values() if group is not None)
+        )
+        self._leaf_prompts = {}
+
+    @property
+    def two_stage(self) -> bool:
+        """True if the texts are first assigned to groups, then to categories."""
+        return self.hierarchical and len(self.groups) > 1
+
+    def set_categories(self, df: pd.DataFrame):
+        """
+        Sets the categories from a table with the columns id and text and an
+        optional third column with the group of each category. Categories
+        without group are offered in the second stage for every group.
+
+        Args:
+            df (pd.DataFrame): The categories table.
+        """
+        df.columns = ["cat_id", "text", "group"][: len(df.columns)]
+        self.categories_dic = dict(zip(df["cat_id"], df["text"]))
+        if "group" in df.columns:
+            self.category_groups = {
+                cat_id: None if pd.isna(group) else str(group)
+                for cat_id, group in zip(df["cat_id"], df["group"])
+            }
 
     @property
     def system_prompt(self):
@@ -106,6 +252,469 @@ class Classifier(ToolBase):
             self.max_categories, self.category_list_expression, self.no_match_code
         )
 
+    @property
+    def packed_system_prompt(self):
+        return PACKED_SYSTEM_PROMPT_TEMPLATE.format(
+            self.max_categories, self.category_list_expression, self.no_match_code
+        )
+
+    @property
+    def group_system_prompt(self):
+        groups = ",".join(
+            f'{number}: "{group}"' for number, group in enumerate(self.groups, 1)
+        )
+        return SYSTEM_PROMPT_TEMPLATE.format(self.max_groups, groups, self.no_match_code)
+
+    def leaf_system_prompt(self, groups: tuple) -> str:
+        """
+        Returns the prompt of the second stage with the categories of the
+        given groups. The prompts are built once per combination of groups.
+
+        Args:
+            groups (tuple): Sorted group numbers, starting at 1.
+
+        Returns:
+            str: The system prompt.
+        """
+        prompt = self._leaf_prompts.get(groups)
+        if prompt is None:
+            names = {self.groups[number - 1] for number in groups}
+            categories = [
+                f'{k}: "{v}"'
+                for k, v in self.categories_dic.items()
+                if self.category_groups.get(k) in names
+                or self.category_groups.get(k) is None
+            ]
+            prompt = SYSTEM_PROMPT_TEMPLATE.format(
+                self.max_categories, ",".join(categories), self.no_match_code
+            )
+            self._leaf_prompts[groups] = prompt
+        return prompt
+
+    def parse_group_response(self, response: str):
+        """
+        Parses the answer of the first stage.
+
+        Args:
+            response (str): The model response, a list of group numbers.
+
+        Returns:
+            tuple: The sorted group numbers, at most max_groups, empty if no
+            group matches. None if the response is not a list of numbers.
+        """
+        try:
+            numbers = {int(number) for number in json.loads(response)}
+        except (ValueError, TypeError):
+            return None
+        groups = sorted(n for n in numbers if 1 <= n <= len(self.groups))
+        return tuple(groups[: self.max_groups])
+
+    def pack_max_tokens(self, pack_size: int) -> int:
+        """Completion tokens needed for the answer to a pack of texts."""
+        return pack_size * (8 + 4 * self.max_categories) + 20
+
+    def build_packs(self, texts: list, text_tokens: list = None) -> list:
+        """
+        Groups the texts into packs of at most pack_size texts. The texts of
+        a pack, the system prompt and the expected answer must fit into the
+        context of the model and MAX_PACK_INPUT_TOKENS.
+
+        Args:
+            texts (list): The cleaned texts.
+            text_tokens (list, optional): Token count of every text, counted
+                if None.
+
+        Returns:
+            list: Lists of positions in texts.
+        """
+        if text_tokens is None:
+            text_tokens = self.count_tokens(texts)
+        prompt_tokens = self.count_tokens([self.packed_system_prompt])[0]
+        budget = min(
+            MAX_PACK_INPUT_TOKENS,
+            self.chunk_size() - prompt_tokens - self.pack_max_tokens(self.pack_size),
+        )
+        packs, pack, pack_tokens = [], [], 0
+        for position, tokens in enumerate(text_tokens):
+            tokens += PACK_TEXT_OVERHEAD
+            if pack and (len(pack) == self.pack_size or pack_tokens + tokens > budget):
+                packs.append(pack)
+                pack, pack_tokens = [], 0
+            pack.append(position)
+            pack_tokens += tokens
+        if pack:
+            packs.append(pack)
+        return packs
+
+    def parse_packed_response(self, response: str, ids: list):
+        """
+        Parses the answer to a packed request.
+
+        Args:
+            response (str): The model response.
+            ids (list): The text ids sent in the request.
+
+        Returns:
+            dict: id -> list of category ids, None if the response is not a
+            json object with a list of numbers for every id.
+        """
+        response = response.strip()
+        if response.startswith("```"):
+            response = response.strip("`").removeprefix("json").strip()
+        try:
+            parsed = json.loads(response)
+            if not isinstance(parsed, dict):
+                return None
+            return {id: [int(cat) for cat in parsed[id]] for id in ids}
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    def classify_pack(self, texts: list, indices: list):
+        """
+        Classifies several texts with one request. If the answer cannot be
+        parsed, the texts are classified one by one.
+
+        Args:
+            texts (list): The cleaned texts.
+            indices (list): The text ids, used in error messages.
+
+        Returns:
+            tuple: list of responses (category lists as string, empty if the
+            text failed) and the tokens [in, out] used for the pack.
+        """
+        ids = [str(i + 1) for i in range(len(texts))]
+        payload = json.dumps(dict(zip(ids, texts)), ensure_ascii=False)
+        response, tokens = self.get_completion(
+            payload,
+            indices[0],
+            system_prompt=self.packed_system_prompt,
+            max_tokens=self.pack_max_tokens(len(texts)),
+        )
+        tokens = list(tokens) if tokens else [0, 0]
+        parsed = self.parse_packed_response(response, ids) if response else None
+        if parsed is not None:
+            return [json.dumps(parsed[id]) for id in ids], tokens
+        logger.warning(
+            f"Packed response for texts {indices[0]}..{indices[-1]} could not be parsed, classifying them one by one."
+        )
+        responses = []
+        for text, index in zip(texts, indices):
+            response, row_tokens = self.get_completion(text, index)
+            responses.append(response)
+            if row_tokens:
+                tokens[0] += row_tokens[0]
+                tokens[1] += row_tokens[1]
+        return responses, tokens
+
+    def classify_packed(
+        self,
+        texts: list,
+        indices: list,
+        placeholder,
+        checkpoint=None,
+        responses: list = None,
+    ) -> list:
+        """
+        Classifies the texts in packs of several texts per request, the packs
+        are sent in parallel.
+
+        Args:
+            texts (list): The cleaned texts.
+            indices (list): The text ids.
+            placeholder: The placeholder object used for displaying progress.
+            checkpoint (callable, optional): Called with the responses list
+                after every finished pack.
+            responses (list, optional): Responses known before, e.g. from the
+                pre-classifier. Only texts with a response of None are sent.
+
+        Returns:
+            list: The response for every text, None for texts of cancelled packs.
+        """
+        if responses is None:
+            responses = [None] * len(texts)
+        open_positions = [p for p, response in enumerate(responses) if response is None]
+        packs = [
+            [open_positions[p] for p in pack]
+            for pack in self.build_packs([texts[p] for p in open_positions])
+        ]
+
+        def classify(pack):
+            return self.classify_pack(
+                [texts[p] for p in pack], [indices[p] for p in pack]
+            )
+
+        def show_progress(done, total, position, result):
+            pack_responses, tokens = result
+            self.add_tokens(tokens)
+            for p, response in zip(packs[position], pack_responses):
+                responses[p] = response
+                self.record_outcome(indices[p], response)
+            placeholder.write(
+                f"Paket {done}/{total} ({len(packs[position])} Texte) klassifiziert, Fehler: {len(self.errors)}"
+            )
+            if checkpoint is not None:
+                checkpoint(responses)
+            return not self.failure_rate_exceeded()
+
+        self.run_concurrent(classify, packs, progress_callback=show_progress)
+        return responses
+
+    def classify_in_groups(self, text: str, index) -> tuple:
+        """
+        Classifies a text in two stages: the first request selects the
+        groups, the second one the categories of these groups. If the first
+        answer cannot be parsed, the text is classified with all categories.
+
+        Args:
+            text (str): The cleaned text.
+            index: The text id, used in error messages.
+
+        Returns:
+            tuple: The response (category list as string, empty if the text
+            failed) and the tokens [in, out] of both requests.
+        """
+        response, tokens = self.get_completion(
+            text, index, system_prompt=self.group_system_prompt
+        )
+        tokens = list(tokens) if tokens else [0, 0]
+        if not response:
+            return "", tokens
+        groups = self.parse_group_response(response)
+        if groups == ():
+            return json.dumps([to_builtin(self.no_match_code)]), tokens
+        if groups is None:
+            logger.warning(
+                f"Group response for text {index} could not be parsed, classifying it with all categories."
+            )
+            system_prompt = self.system_prompt
+        else:
+            system_prompt = self.leaf_system_prompt(groups)
+        response, leaf_tokens = self.get_completion(
+            text, index, system_prompt=system_prompt
+        )
+        if leaf_tokens:
+            tokens[0] += leaf_tokens[0]
+            tokens[1] += leaf_tokens[1]
+        return response, tokens
+
+    def classify_grouped(
+        self,
+        texts: list,
+        indices: list,
+        placeholder,
+        checkpoint=None,
+        responses: list = None,
+    ) -> list:
+        """
+        Classifies the texts in two stages, see classify_in_groups. Both
+        requests of a text run in the same worker, so the second stage of a
+        text overlaps with the first stage of the following texts.
+
+        Args:
+            texts (list): The cleaned texts.
+            indices (list): The text ids.
+            placeholder: The placeholder object used for displaying progress.
+            checkpoint (callable, optional): Called with the responses list
+                after every finished text.
+            responses (list, optional): Responses known before, e.g. from the
+                pre-classifier. Only texts with a response of None are sent.
+
+        Returns:
+            list: The response for every text, None for cancelled texts.
+        """
+        if responses is None:
+            responses = [None] * len(texts)
+        open_positions = [p for p, response in enumerate(responses) if response is None]
+
+        def classify(position):
+            return self.classify_in_groups(texts[position], indices[position])
+
+        def show_progress(done, total, position, result):
+            position = open_positions[position]
+            response, tokens = result
+            self.add_tokens(tokens)
+            responses[position] = response
+            self.record_outcome(indices[position], response)
+            placeholder.write(
+                f"Text {done}/{total} klassifiziert, Fehler: {len(self.errors)}"
+            )
+            if checkpoint is not None:
+                checkpoint(responses)
+            return not self.failure_rate_exceeded()
+
+        self.run_concurrent(classify, open_positions, progress_callback=show_progress)
+        return responses
+
+    def record_outcome(self, index, response: str):
+        """Counts a classified text for the failure rate, failed texts have an empty response."""
+        self.outcomes.append(bool(response))
+        if not response:
+            self.errors.append(index)
+
+    def failure_rate_exceeded(self) -> bool:
+        """True if too many of the recently classified texts failed."""
+        return (
+            len(self.outcomes) >= MIN_FAILURE_SAMPLES
+            and self.outcomes.count(False) >= MAX_FAILURE_RATE * len(self.outcomes)
+        )
+
+    def retry_dead_letters(self, placeholder):
+        """
+        Retry pass for the texts that failed in the main pass. Every text is
+        sent on its own with all categories, with RETRY_LLM_RETRIES attempts
+        and a read timeout of RETRY_TIMEOUT seconds. Texts that fail again
+        remain in dead_letters with the new reason.
+
+        Args:
+            placeholder: The placeholder object used for displaying progress.
+        """
+        letters, self.dead_letters = self.dead_letters, []
+        indices = [letter["rows"][0][0] for letter in letters]
+        retries, timeout = self.llm_retries, self.request_timeout
+        self.llm_retries, self.request_timeout = RETRY_LLM_RETRIES, RETRY_TIMEOUT
+
+        def show_progress(done, total, position, result):
+            letter = letters[position]
+            if result[0]:
+                self.write_results(
+                    [index for index, _ in letter["rows"]],
+                    [text for _, text in letter["rows"]],
+                    [result[0]] * len(letter["rows"]),
+                )
+            else:
+                letter["error"] = self.failed_calls.pop(indices[position], letter["error"])
+                self.dead_letters.append(letter)
+            placeholder.write(
+                f"Wiederholung {done}/{total}: {len(self.dead_letters)} Texte weiterhin fehlerhaft"
+            )
+
+        try:
+            results = self.get_completions(
+                [letter["text"] for letter in letters],
+                progress_callback=show_progress,
+                system_prompt=self.system_prompt,
+                indices=indices,
+            )
+        finally:
+            self.llm_retries, self.request_timeout = retries, timeout
+            self.flush_results()
+        # texts not sent because the budget was reached
+        self.dead_letters += [
+            letter for letter, result in zip(letters, results) if result is None
+        ]
+
+    def write_dead_letters(self):
+        """Appends the texts that could not be classified to the error file."""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        append_row(
+            self.output_errors,
+            [
+                [now, index, letter["error"]]
+                for letter in self.dead_letters
+                for index, _ in letter["rows"]
+            ],
+        )
+
+    def pre_classify_texts(self, texts: list, placeholder) -> list:
+        """
+        First stage of the classification. The category labels and the texts
+        are embedded, a text is assigned to the most similar category if its
+        cosine similarity exceeds the one of the second best category by at
+        least embedding_margin. The batches of texts are embedded in parallel.
+        Texts of failed batches are left to the LLM.
+
+        Args:
+            texts (list): The cleaned texts.
+            placeholder: The placeholder object used for displaying progress.
+
+        Returns:
+            list: The response for every text, a category list as string like
+            the answer of the LLM, None for ambiguous texts.
+        """
+        responses = [None] * len(texts)
+        codes = [code for code in self.categories_dic if code != self.no_match_code]
+        if len(codes) < 2 or len(texts) == 0:
+            return responses
+        try:
+            labels = self.get_embeddings(
+                [str(self.categories_dic[code]) for code in codes]
+            )
+        except Exception as err:
+            logger.warning(f"Category labels could not be embedded: {err}")
+            return responses
+        batches = [
+            range(start, min(start + EMBEDDING_BATCH_SIZE, len(texts)))
+            for start in range(0, len(texts), EMBEDDING_BATCH_SIZE)
+        ]
+
+        def score(batch):
+            try:
+                # the api rejects empty inputs
+                vectors = self.get_embeddings([texts[p] or " " for p in batch])
+            except Exception as err:
+                logger.warning(
+                    f"Texts {batch.start}..{batch.stop - 1} could not be embedded: {err}"
+                )
+                return None
+            similarity = vectors @ labels.T
+            top_two = np.partition(similarity, -2, axis=1)[:, -2:]
+            return similarity.argmax(axis=1), top_two[:, 1] - top_two[:, 0]
+
+        assigned = 0
+
+        def show_progress(done, total, position, result):
+            nonlocal assigned
+            if result is not None:
+                best, margin = result
+                for p in np.flatnonzero(margin >= self.embedding_margin):
+                    responses[batches[position][p]] = json.dumps(
+                        [to_builtin(codes[best[p]])]
+                    )
+                    assigned += 1
+            placeholder.write(
+                f"Vorklassifizierung {done}/{total}: {assigned} Texte zugeordnet"
+            )
+
+        self.run_concurrent(score, batches, progress_callback=show_progress)
+        return responses
+
+    def stage_summary(
+        self, local_stage: list, embedding_stage: list, llm_stage: list
+    ) -> pd.DataFrame:
+        """
+        Texts, duration and cost of the classification stages. The saving
+        is the LLM cost and time of the texts classified by the local model
+        or the pre-classifier, extrapolated from the texts the LLM
+        classified, less the time and cost of these stages.
+
+        Args:
+            local_stage (list): Texts, seconds and cost of the local model.
+            embedding_stage (list): Texts, seconds and cost of the pre-classifier.
+            llm_stage (list): Texts, seconds and cost of the LLM.
+
+        Returns:
+            pd.DataFrame: One row per stage used and the estimated saving.
+        """
+        rows = []
+        if self.local_model is not None:
+            rows.append(["Lokales Modell", *local_stage])
+        if self.pre_classify:
+            rows.append(["Embeddings", *embedding_stage])
+        rows.append(["LLM", *llm_stage])
+        texts, seconds, cost = np.add(local_stage, embedding_stage).tolist()
+        llm_texts, llm_seconds, llm_cost = llm_stage
+        if llm_texts > 0:
+            rows.append(
+                [
+                    "Einsparung (geschätzt)",
+                    texts,
+                    texts * llm_seconds / llm_texts - seconds,
+                    texts * llm_cost / llm_texts - cost,
+                ]
+            )
+        df = pd.DataFrame(rows, columns=["Stufe", "Texte", "Sekunden", "Kosten (USD)"])
+        return df.round({"Sekunden": 1, "Kosten (USD)": 4})
+
     def calc_stats(self):
         """Analyzes the results of the API call and returns a DataFrame with
         the results.
@@ -120,17 +729,16 @@ class Classifier(ToolBase):
         Raises:
             None
         """
-        self.results_df = pd.read_csv(self.output_file_short, sep=";")
+        self.results_df = self.short_results.to_dataframe()
+        # make sure cat_id is numeric.
+        cat_ids = pd.to_numeric(self.results_df["cat_id"], errors="coerce")
         agg_df = (
-            self.results_df.groupby("cat_id")["text_id"]
+            self.results_df.assign(cat_id=cat_ids.fillna(self.no_match_code).astype(int))
+            .groupby("cat_id")["text_id"]
             .size()
             .reset_index(name="count")
         )
-        # make sure cat_id is numeric.
-        agg_df["cat_id"] = pd.to_numeric(agg_df["cat_id"], errors="coerce")
-        agg_df["cat_id"].fillna(self.no_match_code, inplace=True)
-        agg_df["cat_id"] = agg_df["cat_id"].astype(int)
-        agg_df["cat_code"] = agg_df["cat_id"].apply(lambda x: self.categories_dic[x])
+        agg_df["cat_code"] = agg_df["cat_id"].map(self.categories_dic)
         agg_df.to_csv(self.output_file_stat, sep=";")
         return agg_df
 
@@ -169,13 +777,9 @@ class Classifier(ToolBase):
 
     def show_settings(self):
         def manage_demo():
-            self.texts_df = pd.read_excel(DEMO_TEXTS_FILE)
+            self.texts_df = read_excel_cached(DEMO_TEXTS_FILE)
             self.texts_df.columns = ["text_id", "text"]
-            categories_df = pd.read_excel(DEMO_CATEORIES_FILE)
-            categories_df.columns = ["cat_id", "text"]
-            self.categories_dic = dict(
-                zip(categories_df["cat_id"], categories_df["text"])
-            )
+            self.set_categories(read_excel_cached(DEMO_CATEORIES_FILE))
             self.get_nomatch_code()
             self.preview_data()
 
@@ -188,16 +792,16 @@ class Classifier(ToolBase):
             )
             if self.texts_input is None:
                 with st.expander("Demo-Texte", expanded=False):
-                    df = pd.read_excel(DEMO_TEXTS_FILE, index_col=0)
+                    df = read_excel_cached(DEMO_TEXTS_FILE, index_col=0)
                     st.dataframe(df.head())
             else:
                 with st.expander(f"Preview ({self.texts_input.name})", expanded=False):
-                    if self.texts_input.name.endswith(".xlsx"):
-                        self.texts_df = pd.read_excel(self.texts_input)
-                    elif self.texts_input.name.endswith(".csv"):
-                        self.texts_df = pd.read_csv(self.texts_input)
-                    self.texts_df.columns = ["text_id", "text"]
-                    st.dataframe(self.texts_df, hide_index=True)
+                    # large files are not loaded, the texts are read in chunks
+                    # when the job runs
+                    self.text_source = table_from_upload(
+                        self.texts_input, columns=["text_id", "text"]
+                    )
+                    st.dataframe(self.text_source.preview(), hide_index=True)
 
             # categories
             self.categories_input = st.file_uploader(
@@ -207,7 +811,7 @@ class Classifier(ToolBase):
             )
             if self.categories_input is None:
                 with st.expander("Demo-Kategorien", expanded=False):
-                    df = pd.read_excel(DEMO_CATEORIES_FILE, index_col=0)
+                    df = read_excel_cached(DEMO_CATEORIES_FILE, index_col=0)
                     st.dataframe(df.head())
             else:
                 with st.expander(self.categories_input.name, expanded=False):
@@ -215,12 +819,24 @@ class Classifier(ToolBase):
                         self.categories_df = pd.read_excel(self.categories_input)
                     elif self.categories_input.name.endswith(".csv"):
                         self.categories_df = pd.read_csv(self.categories_input)
-                    self.categories_df.columns = ["cat_id", "text"]
-                    self.categories_dic = dict(
-                        zip(self.categories_df["cat_id"], self.categories_df["text"])
-                    )
+                    self.set_categories(self.categories_df)
                     st.dataframe(self.categories_df)
                 self.get_nomatch_code()
+                if len(self.groups) > 1:
+                    self.hierarchical = st.checkbox(
+                        "Zweistufige Klassifizierung",
+                        value=self.hierarchical,
+                        help="Die Kategorien-Datei enthält eine Spalte mit Gruppen. Jeder Text wird zuerst den passenden Gruppen zugeordnet und danach nur mit den Kategorien dieser Gruppen klassifiziert. Bei grossen Kategorienlisten spart das Kosten und verbessert die Genauigkeit. Die Einstellung 'Texte pro Anfrage' wird dabei nicht verwendet.",
+                    )
+                    if self.hierarchical:
+                        self.max_groups = st.number_input(
+                            "Maximale Anzahl Gruppen",
+                            min_value=1,
+                            max_value=len(self.groups),
+                            value=min(self.max_groups, len(self.groups)),
+                            step=1,
+                            help="Anzahl Gruppen, deren Kategorien im zweiten Schritt angeboten werden.",
+                        )
 
         def manage_interactive():
             self.texts_input = st.text_area(
@@ -246,6 +862,55 @@ class Classifier(ToolBase):
             value=3,
             step=1,
         )
+        self.max_concurrency = self.get_max_concurrency()
+        self.use_cache = self.get_use_cache()
+        if self.formats.index(self.input_type) < InputFormat.INTERACTIVE.value:
+            self.pack_size = st.number_input(
+                "Texte pro Anfrage",
+                min_value=1,
+                max_value=MAX_PACK_SIZE,
+                value=self.pack_size,
+                step=1,
+                help="Mehrere Texte werden in einer Anfrage klassifiziert. Die Kategorienliste wird so nur einmal pro Anfrage gesendet, was bei grossen Kategorienlisten Kosten und Zeit spart. Bei 1 wird jeder Text einzeln klassifiziert.",
+            )
+            self.dedup_mode = DEDUP_OPTIONS.index(
+                st.selectbox(
+                    "Duplikate",
+                    options=DEDUP_OPTIONS,
+                    index=self.dedup_mode,
+                    help="Texte, die sich nur in Gross-/Kleinschreibung, Zeilenumbrüchen oder Leerzeichen unterscheiden, werden nur einmal klassifiziert. Das Resultat wird für alle Text-IDs geschrieben. Ähnliche Texte werden mit MinHash erkannt.",
+                )
+            )
+            if self.dedup_mode == DEDUP_NEAR:
+                self.near_threshold = st.slider(
+                    "Mindestähnlichkeit",
+                    min_value=0.5,
+                    max_value=1.0,
+                    value=self.near_threshold,
+                    step=0.01,
+                    help="Geschätzter Anteil gemeinsamer Zeichenfolgen (Jaccard-Ähnlichkeit), ab dem zwei Texte als Duplikate gelten.",
+                )
+            self.pre_classify = st.checkbox(
+                "Vorklassifizierung mit Embeddings",
+                value=self.pre_classify,
+                help="Texte und Kategorien werden mit einem günstigen Embedding-Modell verglichen. Ist eine Kategorie deutlich ähnlicher als alle anderen, wird sie direkt zugeordnet, nur die übrigen Texte werden vom Sprachmodell klassifiziert. Es wird höchstens eine Kategorie pro Text zugeordnet.",
+            )
+            if self.pre_classify:
+                self.embedding_margin = st.slider(
+                    "Mindestabstand Ähnlichkeit",
+                    min_value=0.0,
+                    max_value=0.3,
+                    value=self.embedding_margin,
+                    step=0.01,
+                    help="Minimaler Abstand der Kosinus-Ähnlichkeit zwischen der ähnlichsten und der zweitähnlichsten Kategorie. Je grösser der Abstand, desto mehr Texte werden vom Sprachmodell klassifiziert.",
+                )
+            self.budget = self.get_budget()
+            self.resume = st.checkbox(
+                "Abgebrochene Aufträge fortsetzen",
+                value=self.resume,
+                help="Wird derselbe Auftrag (gleiche Texte, Kategorien und Einstellungen) erneut gestartet, werden die bereits klassifizierten Texte übersprungen und die Resultate in die bestehenden Ausgabedateien geschrieben.",
+            )
+            self.get_execution_mode()
         if self.formats.index(self.input_type) == InputFormat.DEMO.value:
             manage_demo()
         elif self.formats.index(self.input_type) == InputFormat.FILE.value:
@@ -254,6 +919,33 @@ class Classifier(ToolBase):
             manage_interactive()
         else:
             st.warning("Diese Option wird noch nicht unterstützt.")
+        if self.formats.index(self.input_type) < InputFormat.INTERACTIVE.value:
+            self.show_local_model_settings()
+
+    def show_local_model_settings(self):
+        """Settings of the local model, shown once the categories are known."""
+        self.use_local_model = st.checkbox(
+            "Lokales Modell verwenden",
+            value=self.use_local_model,
+            help="Ein lokales Modell wird mit den Resultaten früherer Aufträge mit denselben Kategorien trainiert. Es klassifiziert Tausende Texte pro Sekunde ohne Kosten. Nur Texte, bei denen das Modell unsicher ist, werden an das Sprachmodell geschickt.",
+        )
+        if not self.use_local_model:
+            return
+        self.local_min_probability = st.slider(
+            "Mindestwahrscheinlichkeit",
+            min_value=0.5,
+            max_value=0.99,
+            value=self.local_min_probability,
+            step=0.01,
+            help="Ein Text wird lokal klassifiziert, wenn das Modell für jede Kategorie mindestens so sicher ist. Je höher der Wert, desto mehr Texte werden vom Sprachmodell klassifiziert.",
+        )
+        model = LocalClassifier.load(self.categories_key())
+        if model is None:
+            st.info("Für diese Kategorien wurde noch kein lokales Modell trainiert.")
+        else:
+            st.info(
+                f"Lokales Modell vom {model.trained_at}, trainiert mit {model.trained_texts} Texten. Testdaten: {model.validation['coverage']:.0%} lokal klassifiziert, davon {model.validation['agreement']:.0%} wie das Sprachmodell."
+            )
 
     def show_stats(self):
         bar_chart = (
@@ -267,6 +959,563 @@ class Classifier(ToolBase):
         )
         st.altair_chart(bar_chart, use_container_width=True)
 
+    def clean_text(self, text: str) -> str:
+        """Removes line breaks and the csv separator from a text."""
+        return text.replace(chr(13), " ").replace(chr(10), " ").replace(";", " ")
+
+    def run_classification(self, placeholder):
+        """
+        Classifies all input texts chunk by chunk, so uploads of any size are
+        processed with bounded memory. Duplicates are classified once, the
+        result of the first text of a group is used for all of its text ids,
+        also in later chunks.
+        The texts are sent to the LLM in parallel, the results are buffered
+        for the long and short output files in the order of the input as soon
+        as all previous texts are done and written in batches, so an
+        interrupted job keeps its results. Failed texts are collected as dead
+        letters and sent again in a retry pass at the end, texts that still
+        fail are written with the reason to the error file. The job only
+        stops early if at least MAX_FAILURE_RATE of the recent texts failed.
+        If the same job has been started before and resume is
+        set, the output files of that run are reused and texts found in the
+        short output file are skipped. In the end the statistics are
+        calculated and all output files are zipped.
+
+        Args:
+            placeholder: The placeholder object used for displaying progress.
+
+        Returns:
+            str: The status of the job, "completed" or "incomplete" if texts
+            failed or were skipped.
+        """
+        self.errors = []
+        self.start_budget()
+        self.local_model = self.load_local_model() if self.use_local_model else None
+        job_id = self.job_id()
+        manifest = self.load_manifest(job_id) if self.resume else None
+        if manifest is not None and os.path.exists(
+            OUTPUT_SHORT.format(manifest["key"])
+        ):
+            self.set_output_files(manifest["key"])
+            self.open_result_buffers(load=True)
+            completed = self.completed_ids()
+            placeholder.write(
+                f"Auftrag {job_id} wird fortgesetzt, {len(completed)} Texte sind bereits klassifiziert."
+            )
+        else:
+            self.create_output_files()
+            completed = set()
+        self.duplicate_count = 0
+        self.duplicates = DuplicateIndex(self.dedup_mode, self.near_threshold)
+        self.known_responses = {}
+        self.text_count = 0
+        self.save_manifest(job_id, "running")
+        stages = np.zeros((3, 3))
+        pending = 0
+        stopped = False
+        self.dead_letters = []
+        self.failed_calls = {}
+        self.outcomes.clear()
+        for chunk in self.text_chunks():
+            self.text_count += len(chunk)
+            indices, texts = [], []
+            for index, text in zip(chunk.index, chunk["text"]):
+                if str(index) not in completed:
+                    indices.append(index)
+                    texts.append(self.clean_text(text))
+            if len(texts) == 0:
+                continue
+            chunk_pending, chunk_stages = self.classify_chunk(indices, texts, placeholder)
+            pending += chunk_pending
+            stages += chunk_stages
+            if self.failure_rate_exceeded() or self.budget_exceeded:
+                # the texts of the following chunks are left for a resume
+                stopped = True
+                break
+        if self.dead_letters and not stopped:
+            self.retry_dead_letters(placeholder)
+        self.write_dead_letters()
+        self.failed_count = sum(len(letter["rows"]) for letter in self.dead_letters)
+        if self.pre_classify or self.local_model is not None:
+            self.stage_summary_df = self.stage_summary(*stages.tolist())
+            logger.info(f"Classification stages:\n{self.stage_summary_df.to_string()}")
+        status = (
+            "completed"
+            if pending == 0 and self.failed_count == 0 and not stopped
+            else "incomplete"
+        )
+        self.save_manifest(job_id, status)
+        self.finish_output()
+        return status
+
+    def classify_chunk(self, indices: list, texts: list, placeholder) -> tuple:
+        """
+        Classifies a chunk of the input: duplicates are collapsed, the unique
+        texts go through the local model and the pre-classifier (if set) and
+        the LLM and the results are written for every text of the chunk in
+        input order. Duplicates of a text classified in an earlier chunk of
+        the job get its result, the results of the representatives are kept
+        in known_responses for the whole job.
+
+        Args:
+            indices (list): The text ids.
+            texts (list): The cleaned texts.
+            placeholder: The placeholder object used for displaying progress.
+
+        Returns:
+            tuple: Number of cancelled texts and the texts, seconds and cost
+            of the local model, the pre-classifier and the LLM stage. Failed
+            texts are added to dead_letters.
+        """
+        # the stages classify the unique texts, response_of maps every text to
+        # the response of its representative. Representatives of an earlier
+        # chunk are unique texts with their known response, if they failed
+        # the first duplicate in this chunk is classified instead.
+        representative_of = self.duplicates.add(texts)
+        unique = []
+        unique_position = {}
+        response_of = []
+        for p, r in enumerate(representative_of):
+            if r not in unique_position:
+                unique_position[r] = len(unique)
+                unique.append((p, r))
+            response_of.append(unique_position[r])
+        responses = [self.known_responses.get(r) for p, r in unique]
+        reused = len(responses) - responses.count(None)
+        classified = len(unique) - reused
+        duplicates = len(texts) - classified
+        self.duplicate_count += duplicates
+        if duplicates > 0:
+            placeholder.write(
+                f"{duplicates} Duplikate gefunden, {classified} von {len(texts)} Texten werden klassifiziert."
+            )
+        all_indices, all_texts = indices, texts
+        indices = [all_indices[p] for p, r in unique]
+        texts = [all_texts[p] for p, r in unique]
+        written = 0
+
+        def write_range(responses, start, stop):
+            self.write_results(
+                all_indices[start:stop],
+                all_texts[start:stop],
+                [responses[response_of[p]] for p in range(start, stop)],
+            )
+
+        def checkpoint(responses):
+            # writes the completed texts at the start of the input
+            nonlocal written
+            start = written
+            while written < len(response_of) and responses[response_of[written]] is not None:
+                written += 1
+            if written > start:
+                write_range(responses, start, written)
+
+        checkpoint(responses)
+        stage_start = time.perf_counter()
+        if self.local_model is not None:
+            open_positions = [p for p, response in enumerate(responses) if response is None]
+            predicted = self.local_model.predict(
+                [texts[p] for p in open_positions], self.local_min_probability, self.max_categories
+            )
+            for p, response in zip(open_positions, predicted):
+                responses[p] = response
+            checkpoint(responses)
+        local_stage = [
+            len(texts) - responses.count(None) - reused,
+            time.perf_counter() - stage_start,
+            0.0,
+        ]
+        stage_start, stage_cost = time.perf_counter(), self.cost()
+        if self.pre_classify:
+            open_positions = [p for p, response in enumerate(responses) if response is None]
+            embedded = self.pre_classify_texts([texts[p] for p in open_positions], placeholder)
+            for p, response in zip(open_positions, embedded):
+                responses[p] = response
+            checkpoint(responses)
+        embedding_stage = [
+            len(texts) - responses.count(None) - reused - local_stage[0],
+            time.perf_counter() - stage_start,
+            self.cost() - stage_cost,
+        ]
+        open_positions = [p for p, response in enumerate(responses) if response is None]
+
+        def show_progress(done, total, position, result):
+            position = open_positions[position]
+            indices_str = result[0]
+            responses[position] = indices_str
+            checkpoint(responses)
+            text = texts[position]
+            if len(indices_str) > 0:
+                placeholder.write(
+                    f"Result {done}/{total}: {text[:50] + '...'}, index= {indices[position]}, output: {indices_str} "
+                )
+            else:
+                placeholder.write(
+                    f"Error {done}/{total}: {text[:50] + '...'}, index= {indices[position]}"
+                )
+            self.record_outcome(indices[position], indices_str)
+            return not self.failure_rate_exceeded()
+
+        stage_start, stage_cost = time.perf_counter(), self.cost()
+        try:
+            if self.two_stage:
+                responses = self.classify_grouped(
+                    texts, indices, placeholder, checkpoint=checkpoint, responses=responses
+                )
+            elif self.pack_size > 1:
+                responses = self.classify_packed(
+                    texts, indices, placeholder, checkpoint=checkpoint, responses=responses
+                )
+            else:
+                self.get_completions(
+                    [texts[p] for p in open_positions],
+                    progress_callback=show_progress,
+                    indices=[indices[p] for p in open_positions],
+                )
+        finally:
+            # keeps the checkpointed results if the job is interrupted
+            self.flush_results()
+        llm_stage = [
+            len([p for p in open_positions if responses[p] is not None]),
+            time.perf_counter() - stage_start,
+            self.cost() - stage_cost,
+        ]
+        # texts after a failed or cancelled one
+        write_range(responses, written, len(response_of))
+        # failed texts go to the dead letters with all their text ids
+        failed_rows = {}
+        for p, u in enumerate(response_of):
+            if responses[u] == "":
+                failed_rows.setdefault(u, []).append((all_indices[p], all_texts[p]))
+        for u, rows in failed_rows.items():
+            self.dead_letters.append(
+                {
+                    "text": texts[u],
+                    "rows": rows,
+                    "error": self.failed_calls.pop(indices[u], NO_RESPONSE_ERROR),
+                }
+            )
+        if self.dedup_mode != DEDUP_NONE:
+            for (p, r), response in zip(unique, responses):
+                if response:
+                    self.known_responses[r] = response
+        pending = len([u for u in response_of if responses[u] is None])
+        return pending, [local_stage, embedding_stage, llm_stage]
+
+    def job_id(self) -> str:
+        """
+        Returns the id of the current classification job, a hash of the texts,
+        the categories and the settings that change the results.
+        """
+        content = hashlib.sha256()
+        settings = [self.model, self.max_categories, to_builtin(self.no_match_code)]
+        if self.pre_classify:
+            settings += [EMBEDDING_MODEL, self.embedding_margin]
+        if self.local_model is not None:
+            settings += [
+                "local_model",
+                self.local_model.trained_at,
+                self.local_min_probability,
+            ]
+        if self.dedup_mode == DEDUP_NEAR:
+            settings += ["near_duplicates", self.near_threshold]
+        if self.two_stage:
+            settings += [
+                "groups",
+                self.max_groups,
+                [[to_builtin(k), g] for k, g in self.category_groups.items()],
+            ]
+        content.update(json.dumps(settings).encode("utf-8"))
+        content.update(self.category_list_expression.encode("utf-8"))
+        if self.text_source is not None:
+            # the content hash of an upload identifies its texts and ids
+            content.update(self.text_source.content_hash.encode("utf-8"))
+        else:
+            for index, text in zip(self.texts_df.index, self.texts_df["text"]):
+                content.update(f"{index}\x1f{text}\x1e".encode("utf-8"))
+        return content.hexdigest()[:16]
+
+    def load_manifest(self, job_id: str):
+        """Returns the manifest of a previous run of the job, None if there is none."""
+        file_name = JOB_MANIFEST.format(job_id)
+        if not os.path.exists(file_name):
+            return None
+        with open(file_name, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def save_manifest(self, job_id: str, status: str):
+        """Saves the output key and the status of the job."""
+        manifest = {
+            "job_id": job_id,
+            "key": self.key,
+            "status": status,
+            "texts": self.text_count,
+            "failed": self.failed_count,
+            "categories": self.categories_key(),
+            # only jobs without local model and pre-classifier are used to
+            # train the local model
+            "llm_labels_only": self.local_model is None and not self.pre_classify,
+            "updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with open(JOB_MANIFEST.format(job_id), "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=4)
+
+    def categories_key(self) -> str:
+        return categories_key(self.categories_dic, self.no_match_code)
+
+    def local_training_data(self) -> pd.DataFrame:
+        """
+        Collects the results of earlier jobs with the current categories
+        whose texts were all classified by the LLM. A text found in several
+        jobs is used once, with the latest result.
+
+        Returns:
+            pd.DataFrame: The columns text and labels (list of category ids).
+        """
+        key = self.categories_key()
+        frames = []
+        for file_name in sorted(glob.glob(JOB_MANIFEST.format("*")), key=os.path.getmtime):
+            with open(file_name, "r", encoding="utf-8") as file:
+                manifest = json.load(file)
+            output_file = OUTPUT_LONG.format(manifest["key"])
+            if (
+                manifest.get("categories") == key
+                and manifest.get("llm_labels_only")
+                and os.path.exists(output_file)
+            ):
+                frames.append(pd.read_csv(output_file, sep=";", usecols=["text", "result"]))
+        if not frames:
+            return pd.DataFrame(columns=["text", "labels"])
+        df = pd.concat(frames).dropna().drop_duplicates("text", keep="last")
+
+        df["labels"] = df["result"].map(parse_category_ids)
+        return df.dropna(subset=["labels"])[["text", "labels"]]
+
+    def train_local_model(self) -> LocalClassifier:
+        """
+        Trains and saves the local model of the current categories, see
+        local_training_data.
+
+        Returns:
+            LocalClassifier: The trained model.
+
+        Raises:
+            ValueError: If there are not enough results to train the model.
+        """
+        df = self.local_training_data()
+        model = LocalClassifier(self.categories_key())
+        model.fit(list(df["text"]), list(df["labels"]))
+        model.save()
+        logger.info(
+            f"Local model {model.key} trained with {model.trained_texts} texts, validation: {model.validation}"
+        )
+        return model
+
+    def load_local_model(self):
+        """Returns the saved local model of the current categories, None if there is none."""
+        model = LocalClassifier.load(self.categories_key())
+        if model is None:
+            self.report(
+                "Für diese Kategorien gibt es kein lokales Modell, alle Texte werden vom Sprachmodell klassifiziert.",
+                logging.WARNING,
+            )
+        return model
+
+    def completed_ids(self) -> set:
+        """Returns the ids of the texts found in the short output file."""
+        return set(self.short_results.to_dataframe()["text_id"].astype(str))
+
+    def estimate_cost(self):
+        """
+        Tokenises all texts and returns the expected requests, tokens and cost
+        of the classification with the current settings. Duplicates are
+        counted once. The expected answer is the completion limit of a pack
+        and the second stage of a two-stage classification is counted with
+        the categories of the largest groups, so the estimate is an upper
+        bound.
+
+        Returns:
+            CostPlan: The plan.
+        """
+        plan = self.new_cost_plan()
+        packed_prompt_tokens = self.count_tokens([self.packed_system_prompt])[0]
+        prompt_tokens = self.count_tokens([self.system_prompt])[0]
+        if self.two_stage:
+            group_sizes = pd.Series(list(self.category_groups.values())).value_counts()
+            largest = tuple(
+                sorted(
+                    self.groups.index(group) + 1
+                    for group in group_sizes.index[: self.max_groups]
+                )
+            )
+            # tokens of both requests of a text
+            prompt_tokens = sum(
+                self.count_tokens([self.group_system_prompt, self.leaf_system_prompt(largest)])
+            )
+        duplicates = DuplicateIndex(self.dedup_mode, self.near_threshold)
+        for chunk in self.text_chunks():
+            texts = [self.clean_text(text) for text in chunk["text"]]
+            offset = duplicates.count
+            representative_of = duplicates.add(texts)
+            texts = [text for p, text in enumerate(texts) if representative_of[p] == offset + p]
+            text_tokens = self.count_tokens(texts)
+            if self.two_stage:
+                plan.add(
+                    2 * sum(text_tokens) + prompt_tokens * len(texts),
+                    2 * self.pack_max_tokens(1) * len(texts),
+                    requests=2 * len(texts),
+                )
+            elif self.pack_size > 1:
+                for pack in self.build_packs(texts, text_tokens):
+                    plan.add(
+                        packed_prompt_tokens
+                        + sum(text_tokens[p] + PACK_TEXT_OVERHEAD for p in pack),
+                        self.pack_max_tokens(len(pack)),
+                    )
+            else:
+                plan.add(
+                    sum(text_tokens) + prompt_tokens * len(texts),
+                    self.pack_max_tokens(1) * len(texts),
+                    requests=len(texts),
+                )
+        return plan
+
+    def create_output_files(self):
+        create_file(self.output_file_long, ["text_id", "text", "result"])
+        create_file(self.output_file_short, ["text_id", "cat_id"])
+        create_file(self.output_errors, ["time", "text_id", "error_message"])
+        self.open_result_buffers()
+
+    def open_result_buffers(self, load: bool = False):
+        """
+        Creates the buffers of the long and short output files. The short
+        results are kept in memory for the statistics.
+
+        Args:
+            load (bool, optional): Read the rows already in the short output
+                file, used when a job is resumed.
+        """
+        self.long_results = ResultBuffer(
+            self.output_file_long, ["text_id", "text", "result"], keep=False
+        )
+        self.short_results = ResultBuffer(self.output_file_short, ["text_id", "cat_id"])
+        if load:
+            self.short_results.load()
+
+    def flush_results(self):
+        """Writes the buffered results to the output files."""
+        self.long_results.flush()
+        self.short_results.flush()
+
+    def write_results(self, indices: list, texts: list, results: list):
+        """
+        Adds the classification results to the buffers of the long and short
+        output files, the buffers are written to the files in batches.
+        Empty results (failed or cancelled texts) are skipped, results that
+        are no list of category ids are added to dead_letters.
+
+        Args:
+            indices (list): The text ids.
+            texts (list): The cleaned texts.
+            results (list): The model responses, lists of category ids as string.
+        """
+        for index, text, indices_str in zip(indices, texts, results):
+            if not indices_str:
+                continue
+            cat_ids = parse_category_ids(indices_str)
+            if cat_ids is None:
+                self.dead_letters.append(
+                    {"text": text, "rows": [(index, text)], "error": INVALID_RESPONSE_ERROR}
+                )
+                continue
+            self.long_results.extend([[index, text, str(indices_str)]])
+            self.short_results.extend([(index, item) for item in cat_ids])
+
+    def finish_output(self):
+        """Calculates the statistics and zips all output files."""
+        self.flush_results()
+        self.stats_df = self.calc_stats()
+        file_names = [
+            self.output_file_long,
+            self.output_file_short,
+            self.output_file_stat,
+            self.output_errors,
+        ]
+        zip_files(file_names, self.output_file_zip)
+
+    def submit_classification_batch(self):
+        """
+        Submits all texts as one batch job. The output key, the categories and
+        the settings are stored with the job, so the results can be merged
+        into the usual output files after a restart of the app.
+
+        Returns:
+            BatchJob: The submitted job.
+        """
+        requests = [
+            build_request(
+                str(index),
+                self.model,
+                self.system_prompt,
+                self.clean_text(text),
+                self.temperature,
+                self.max_tokens,
+            )
+            for chunk in self.text_chunks()
+            for index, text in zip(chunk.index, chunk["text"])
+        ]
+        self.text_count = len(requests)
+        meta = {
+            "key": self.key,
+            "categories": [
+                (to_builtin(k), v) for k, v in self.categories_dic.items()
+            ],
+            "no_match_code": to_builtin(self.no_match_code),
+        }
+        return submit_batch(
+            self.__class__.__name__, requests, meta, backend=self.batch_backend
+        )
+
+    def merge_classification_batch(self, job):
+        """
+        Writes the results of a completed batch job to the output files of the
+        job. Failed requests and answers that are no list of category ids
+        are written to the error file.
+
+        Args:
+            job (BatchJob): The completed job.
+
+        Returns:
+            str: The path of the zip file with all outputs.
+        """
+        self.set_output_files(job.meta["key"])
+        self.categories_dic = dict(job.meta["categories"])
+        self.no_match_code = job.meta["no_match_code"]
+        self.create_output_files()
+        self.dead_letters = []
+        requests = job.requests()
+        results = job.results()
+        indices, texts, responses = [], [], []
+        for request in requests:
+            result = results.get(request["custom_id"])
+            indices.append(request["custom_id"])
+            texts.append(request["body"]["messages"][-1]["content"])
+            if result is None or result["error"]:
+                error = result["error"] if result else "no result"
+                append_row(
+                    self.output_errors,
+                    [[datetime.now().strftime("%Y-%m-%d %H:%M:%S"), request["custom_id"], error]],
+                )
+                responses.append("")
+            else:
+                self.add_tokens(result["tokens"])
+                responses.append(result["content"])
+        # answers that are no list of category ids go to the error file
+        self.write_results(indices, texts, responses)
+        self.write_dead_letters()
+        self.finish_output()
+        return self.output_file_zip
+
     def check_input(self):
         ok = (self.formats.index(self.input_type) == InputFormat.DEMO.value) or (
             self.texts_input is not None and self.categories_dic is not None
@@ -288,55 +1537,39 @@ class Classifier(ToolBase):
             set.
         """
         ok = self.check_input()
-        if st.button("Klassifizieren", disabled=(ok == False)):
-            if self.formats.index(self.input_type) < InputFormat.INTERACTIVE.value:
-                cnt = 1
-                self.errors = []
-
-                create_file(self.output_file_long, ["text_id", "text", "result"])
-                create_file(self.output_file_short, ["text_id", "cat_id"])
-                create_file(self.output_errors, ["time", "text_id", "error_message"])
+        batch_input = self.formats.index(self.input_type) < InputFormat.INTERACTIVE.value
+        if batch_input and st.button("Kosten schätzen", disabled=(ok == False)):
+            self.show_cost_plan(self.estimate_cost())
+        if batch_input and self.use_local_model and st.button("Lokales Modell trainieren"):
+            try:
+                model = self.train_local_model()
+                st.success(
+                    f"Lokales Modell mit {model.trained_texts} Texten trainiert. Testdaten: {model.validation['coverage']:.0%} lokal klassifiziert, davon {model.validation['agreement']:.0%} wie das Sprachmodell."
+                )
+            except ValueError as err:
+                st.warning(f"Das lokale Modell konnte nicht trainiert werden: {err}")
+        if batch_input and self.is_batch_mode():
+            if st.button("Batch-Job einreichen", disabled=(ok == False)):
+                job = self.submit_classification_batch()
+                st.success(f"Batch-Job {job.job_id} mit {self.text_count} Texten wurde eingereicht.")
+            self.show_batch_jobs(self.merge_classification_batch)
+        elif st.button("Klassifizieren", disabled=(ok == False)):
+            if batch_input:
                 placeholder = st.empty()
-                for index, row in self.texts_df.iterrows():
-                    text = (
-                        row["text"]
-                        .replace(chr(13), " ")
-                        .replace(chr(10), " ")
-                        .replace(";", " ")
-                    )
-                    indices, tokens = self.get_completion(text, index)
-                    if len(indices) > 0:
-                        placeholder.write(
-                            f"Result {cnt}/{len(self.texts_df)}: {text[:50] + '...'}, index= {index}, output: {indices} "
-                        )
-                        append_row(self.output_file_long, [[index, text, str(indices)]])
-                        append_row(
-                            self.output_file_short,
-                            [(index, item) for item in json.loads(indices)],
-                        )
-                        self.tokens_in += tokens[0]
-                        self.tokens_out += tokens[1]
-                        cnt += 1
-                    else:
-                        placeholder.write(
-                            f"Error {cnt}/{len(self.texts_df)}: {text[:50] + '...'}, index= {index}"
-                        )
-                        self.errors.append(index)
-
-                    # if loop has failed 3 times quit
-                    if len(self.errors) == MAX_ERRORS:
-                        break
-
+                self.run_classification(placeholder)
                 placeholder.markdown(self.token_use_expression())
-                self.stats_df = self.calc_stats()
+                self.show_budget_warning()
+                if self.failed_count > 0:
+                    st.warning(
+                        f"{self.failed_count} Texte konnten nicht klassifiziert werden. Sie sind mit dem Grund in der Fehlerdatei aufgeführt und werden beim Fortsetzen des Auftrags erneut klassifiziert."
+                    )
+                if self.duplicate_count > 0:
+                    st.info(
+                        f"{self.duplicate_count} Duplikate wurden nur einmal klassifiziert."
+                    )
+                if self.pre_classify or self.local_model is not None:
+                    st.table(self.stage_summary_df.set_index("Stufe"))
                 self.show_stats()
-                file_names = [
-                    self.output_file_long,
-                    self.output_file_short,
-                    self.output_file_stat,
-                    self.output_errors,
-                ]
-                zip_files(file_names, self.output_file_zip)
                 if os.path.exists(self.output_file_zip):
                     with open(self.output_file_zip, "rb") as fp:
                         btn = st.download_button(
@@ -364,3 +1597,6 @@ class Classifier(ToolBase):
                         st.markdown(f"- {self.categories_dic[idx]}")
                 else:
                     st.markdown("Keine Übereinstimmung gefunden.")
+
+
+LOCAL_RESPONDERS[Classifier.__name__] = local_batch_responder
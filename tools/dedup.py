@@ -0,0 +1,158 @@
+import re
+import zlib
+import hashlib
+
+import numpy as np
+
+DEDUP_NONE = 0
+DEDUP_EXACT = 1
+DEDUP_NEAR = 2
+# minimal estimated jaccard similarity of the shingles of two near-duplicates
+DEFAULT_NEAR_THRESHOLD = 0.9
+NUM_PERMUTATIONS = 128
+# 16 bands of 8 rows: pairs with a similarity of 0.9 become candidates with a
+# probability above 99.9%, pairs with 0.5 with about 6%
+LSH_BANDS = 16
+SHINGLE_SIZE = 5
+# mersenne prime 2^31 - 1, a * x + b stays below 2^63 for x, a, b < 2^31
+MERSENNE_PRIME = (1 << 31) - 1
+SEED = 1
+
+_whitespace = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Returns the text used to compare texts: line breaks and the csv separator
+    are removed as in Classifier.clean_text, whitespace is collapsed and the
+    text is lower case.
+    """
+    text = str(text).replace(chr(13), " ").replace(chr(10), " ").replace(";", " ")
+    return _whitespace.sub(" ", text).strip().casefold()
+
+
+class MinHasher:
+    """MinHash signatures of the character shingles of texts."""
+
+    def __init__(
+        self,
+        num_permutations: int = NUM_PERMUTATIONS,
+        shingle_size: int = SHINGLE_SIZE,
+        seed: int = SEED,
+    ):
+        generator = np.random.default_rng(seed)
+        self.a = generator.integers(1, MERSENNE_PRIME, num_permutations, dtype=np.uint64)
+        self.b = generator.integers(0, MERSENNE_PRIME, num_permutations, dtype=np.uint64)
+        self.shingle_size = shingle_size
+
+    def signature(self, text: str) -> np.ndarray:
+        size = self.shingle_size
+        shingles = {text[i : i + size] for i in range(max(len(text) - size + 1, 1))}
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        ) % np.uint64(MERSENNE_PRIME)
+        permuted = (np.outer(self.a, hashes) + self.b[:, None]) % np.uint64(MERSENNE_PRIME)
+        return permuted.min(axis=1)
+
+
+class DuplicateIndex:
+    """
+    Finds the duplicates of texts added in several calls, e.g. the chunks of
+    a classification job. Exact duplicates are found with a hash of the
+    normalised text. In DEDUP_NEAR mode the remaining texts are compared
+    with MinHash signatures, texts sharing an LSH band with a representative
+    are verified against it, so groups do not drift by chaining similar
+    texts. Positions count all texts added so far.
+    """
+
+    def __init__(self, mode: int = DEDUP_EXACT, threshold: float = DEFAULT_NEAR_THRESHOLD):
+        self.mode = mode
+        self.threshold = threshold
+        self.count = 0
+        self._exact = {}
+        self._hasher = MinHasher() if mode == DEDUP_NEAR else None
+        self._band_rows = NUM_PERMUTATIONS // LSH_BANDS
+        self._buckets = {}
+        # signatures of the representatives, rows are added as needed
+        self._signatures = np.zeros((0, NUM_PERMUTATIONS), dtype=np.uint32)
+        self._signature_positions = []
+
+    def add(self, texts: list) -> list:
+        """
+        Assigns every text to a representative, the first text of its group
+        of duplicates in this or an earlier call.
+
+        Args:
+            texts (list): The texts.
+
+        Returns:
+            list: The position of the representative of every text, a
+            representative points to itself.
+        """
+        offset = self.count
+        self.count += len(texts)
+        if self.mode == DEDUP_NONE:
+            return list(range(offset, self.count))
+        representatives = []
+        for position, text in enumerate(texts, offset):
+            normalized = normalize_text(text)
+            key = hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+            if key in self._exact:
+                representatives.append(self._exact[key])
+                continue
+            representative = position
+            if self._hasher is not None:
+                representative = self._near_duplicate(normalized, position)
+            self._exact[key] = representative
+            representatives.append(representative)
+        return representatives
+
+    def _near_duplicate(self, normalized: str, position: int) -> int:
+        """Returns the representative of a near-duplicate, or adds the text as representative."""
+        band_rows = self._band_rows
+        signature = self._hasher.signature(normalized).astype(np.uint32)
+        bands = [
+            (band, signature[band * band_rows : (band + 1) * band_rows].tobytes())
+            for band in range(LSH_BANDS)
+        ]
+        candidates = set()
+        for band in bands:
+            candidates.update(self._buckets.get(band, ()))
+        if candidates:
+            candidate_rows = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            similarity = (self._signatures[candidate_rows] == signature).mean(axis=1)
+            matches = candidate_rows[similarity >= self.threshold]
+            if len(matches):
+                return self._signature_positions[matches.min()]
+        row = len(self._signature_positions)
+        if row == len(self._signatures):
+            self._signatures = np.resize(self._signatures, (max(2 * row, 64), NUM_PERMUTATIONS))
+        self._signatures[row] = signature
+        self._signature_positions.append(position)
+        for band in bands:
+            self._buckets.setdefault(band, []).append(row)
+        return position
+
+
+def find_duplicates(
+    texts: list,
+    mode: int = DEDUP_EXACT,
+    threshold: float = DEFAULT_NEAR_THRESHOLD,
+) -> list:
+    """
+    Assigns every text to a representative, the first text of its group of
+    duplicates, see DuplicateIndex.
+
+    Args:
+        texts (list): The texts.
+        mode (int, optional): DEDUP_NONE, DEDUP_EXACT or DEDUP_NEAR.
+        threshold (float, optional): Minimal estimated jaccard similarity of
+            near-duplicates.
+
+    Returns:
+        list: The position of the representative of every text, a
+        representative points to itself.
+    """
+    return DuplicateIndex(mode, threshold).add(texts)
@@ -1,4 +1,3 @@
-from openai import OpenAI
 import streamlit as st
 import os
 import pandas as pd
@@ -19,6 +18,7 @@ from helper import (
     encode_image,
 )
 from tools.tool_base import ToolBase, TEMP_PATH, IMAGE_PATH, UPLOAD_PATH
+from tools.llm_client import get_client
 
 
 FILE_FORMAT_OPTIONS = ["jpg", "jpeg", "png", "gif"]
@@ -153,30 +153,33 @@ class Image2Text(ToolBase):
                 )
 
     def image2text(self, file_path: str) -> str:
-        client = OpenAI()
+        client = get_client()
         base64_image = encode_image(file_path)
-        response = client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Descscribe the picture in german. The location is Basel, Switzerland",
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url":  f"data:image/jpeg;base64,{base64_image}",
-                                "detail": "high"
+        with self.track("chat.vision") as call:
+            response = client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": "Descscribe the picture in german. The location is Basel, Switzerland",
                             },
-                        },
-                    ],
-                }
-            ],
-            max_tokens=self.max_tokens,
-        )
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url":  f"data:image/jpeg;base64,{base64_image}",
+                                    "detail": "high"
+                                },
+                            },
+                        ],
+                    }
+                ],
+                max_tokens=self.max_tokens,
+            )
+            call["tokens_in"] = response.usage.prompt_tokens
+            call["tokens_out"] = response.usage.completion_tokens
         return response.choices[0].message.content
 
     def run_demo(self):
@@ -1,10 +1,10 @@
 import streamlit as st
 import os
-from openai import OpenAI
 from enum import Enum
 
 from helper import get_image_from_url
 from tools.tool_base import ToolBase, TEMP_PATH, OUTPUT_PATH, DEMO_PATH
+from tools.llm_client import get_client
 
 DEMO_FILE = DEMO_PATH + "000000406031.pdf"
 TEMP_FILE = TEMP_PATH + "temp_audio."
@@ -45,14 +45,15 @@ class ImageGenerator(ToolBase):
             )
 
     def generate_image(self, user_prompt: str) -> str:
-        client = OpenAI()
-        response = client.images.generate(
-            model="dall-e-3",
-            prompt=user_prompt,
-            size=self.size,
-            quality=self.quality,
-            n=1,
-        )
+        client = get_client()
+        with self.track("images", model="dall-e-3"):
+            response = client.images.generate(
+                model="dall-e-3",
+                prompt=user_prompt,
+                size=self.size,
+                quality=self.quality,
+                n=1,
+            )
         self.image_url = response.data[0].url
 
     def run(self):
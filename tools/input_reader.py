@@ -0,0 +1,222 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from tools.tool_base import TEMP_PATH
+
+# rows per chunk, a chunk of short texts uses a few MB
+CHUNK_ROWS = 10000
+PREVIEW_ROWS = 1000
+# parsed uploads kept between Streamlit reruns
+UPLOAD_CACHE_SIZE = 8
+HASH_BLOCK_SIZE = 1 << 20
+
+_upload_cache = OrderedDict()
+# streamlit file id -> content hash, avoids hashing an upload on every rerun
+_upload_hashes = {}
+_upload_cache_lock = threading.Lock()
+
+
+class TableInput:
+    """
+    A csv or xlsx table that is read in chunks of CHUNK_ROWS rows, so the
+    memory use does not depend on the size of the file. Csv files are read
+    with pandas chunks, xlsx files with the read-only row iterator of
+    openpyxl. The index of the chunks continues over the whole table, as if
+    the file had been read at once.
+    """
+
+    def __init__(
+        self,
+        file_name: str,
+        columns: list = None,
+        sep: str = ",",
+        encoding: str = "utf-8",
+        content_hash: str = None,
+    ):
+        """
+        Args:
+            file_name (str): Path of the csv or xlsx file.
+            columns (list, optional): Names replacing the header of the file.
+            sep (str, optional): Separator of csv files.
+            encoding (str, optional): Encoding of csv files.
+            content_hash (str, optional): Hash of the file content, calculated
+                if None.
+        """
+        self.file_name = file_name
+        self.columns = columns
+        self.sep = sep
+        self.encoding = encoding
+        self.content_hash = content_hash or file_hash(file_name)
+        self._preview = None
+        self._row_count = None
+
+    @property
+    def is_excel(self) -> bool:
+        return self.file_name.lower().endswith(".xlsx")
+
+    def chunks(self, chunk_rows: int = None):
+        """
+        Yields the table as DataFrames of at most chunk_rows rows.
+
+        Args:
+            chunk_rows (int, optional): Rows per chunk, defaults to CHUNK_ROWS.
+
+        Yields:
+            pd.DataFrame: The next rows of the table.
+        """
+        chunk_rows = chunk_rows or CHUNK_ROWS
+        if self.is_excel:
+            yield from self._excel_chunks(chunk_rows)
+        else:
+            reader = pd.read_csv(
+                self.file_name,
+                sep=self.sep,
+                encoding=self.encoding,
+                chunksize=chunk_rows,
+            )
+            with reader:
+                for chunk in reader:
+                    yield self._rename(chunk)
+
+    def _excel_chunks(self, chunk_rows: int):
+        # like pd.read_excel: first sheet, first row is the header
+        workbook = load_workbook(self.file_name, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            start, batch = 0, []
+            for row in rows:
+                batch.append(row)
+                if len(batch) == chunk_rows:
+                    yield self._excel_frame(batch, header, start)
+                    start += len(batch)
+                    batch = []
+            if batch:
+                yield self._excel_frame(batch, header, start)
+        finally:
+            workbook.close()
+
+    def _excel_frame(self, rows: list, header: tuple, start: int) -> pd.DataFrame:
+        df = pd.DataFrame.from_records(
+            rows,
+            columns=list(header),
+            index=pd.RangeIndex(start, start + len(rows)),
+        )
+        return self._rename(df)
+
+    def _rename(self, df: pd.DataFrame) -> pd.DataFrame:
+        if self.columns is not None:
+            df.columns = self.columns
+        return df
+
+    def preview(self, rows: int = PREVIEW_ROWS) -> pd.DataFrame:
+        """Returns the first rows of the table, read once."""
+        if self._preview is None:
+            self._preview = next(self.chunks(rows), pd.DataFrame(columns=self.columns))
+        return self._preview
+
+    def count_rows(self) -> int:
+        """
+        Returns the number of rows without the header, counted once. Csv
+        files are read in chunks of the first column only, for xlsx files the
+        dimension of the sheet is used if the file records it.
+        """
+        if self._row_count is None:
+            if self.is_excel:
+                workbook = load_workbook(self.file_name, read_only=True, data_only=True)
+                try:
+                    sheet = workbook.worksheets[0]
+                    max_row = sheet.max_row
+                    if max_row is None:
+                        max_row = sum(1 for _ in sheet.iter_rows(values_only=True))
+                    self._row_count = max(max_row - 1, 0)
+                finally:
+                    workbook.close()
+            else:
+                reader = pd.read_csv(
+                    self.file_name,
+                    sep=self.sep,
+                    encoding=self.encoding,
+                    usecols=[0],
+                    chunksize=CHUNK_ROWS,
+                )
+                with reader:
+                    self._row_count = sum(len(chunk) for chunk in reader)
+        return self._row_count
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Reads the whole table, only for jobs that need all rows at once."""
+        return pd.concat(list(self.chunks()))
+
+
+def file_hash(file_name: str) -> str:
+    content = hashlib.sha256()
+    with open(file_name, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+            content.update(block)
+    return content.hexdigest()
+
+
+def table_from_upload(
+    uploaded_file, columns: list = None, sep: str = ",", encoding: str = "utf-8"
+) -> TableInput:
+    """
+    Returns the uploaded csv or xlsx file as TableInput. The content is
+    stored once in the temp folder under its hash, later reruns with the same
+    upload reuse the stored file and the parsed preview.
+
+    Args:
+        uploaded_file (UploadedFile): The Streamlit upload.
+        columns (list, optional): Names replacing the header of the file.
+        sep (str, optional): Separator of csv files.
+        encoding (str, optional): Encoding of csv files.
+
+    Returns:
+        TableInput: The table.
+    """
+    file_id = getattr(uploaded_file, "file_id", None)
+    with _upload_cache_lock:
+        content_hash = _upload_hashes.get(file_id)
+    if content_hash is None:
+        content_hash = hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+        if file_id is not None:
+            with _upload_cache_lock:
+                _upload_hashes[file_id] = content_hash
+    key = (content_hash, tuple(columns or ()), sep, encoding)
+    with _upload_cache_lock:
+        table = _upload_cache.get(key)
+        if table is not None:
+            _upload_cache.move_to_end(key)
+            return table
+    _, extension = os.path.splitext(uploaded_file.name)
+    file_name = os.path.join(TEMP_PATH, f"upload_{content_hash[:16]}{extension.lower()}")
+    if not os.path.exists(file_name):
+        with open(file_name, "wb") as file:
+            file.write(uploaded_file.getbuffer())
+    table = TableInput(file_name, columns, sep, encoding, content_hash=content_hash)
+    with _upload_cache_lock:
+        _upload_cache[key] = table
+        while len(_upload_cache) > UPLOAD_CACHE_SIZE:
+            _upload_cache.popitem(last=False)
+    return table
+
+
+@lru_cache(maxsize=16)
+def _read_excel(file_name: str, modified: float, index_col) -> pd.DataFrame:
+    return pd.read_excel(file_name, index_col=index_col)
+
+
+def read_excel_cached(file_name: str, index_col=None) -> pd.DataFrame:
+    """
+    Reads a small xlsx file, e.g. the demo data, once per process and
+    modification time. Returns a copy, callers may change it.
+    """
+    return _read_excel(file_name, os.path.getmtime(file_name), index_col).copy()
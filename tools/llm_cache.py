@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+CACHE_PATH = "./data/cache/"
+CACHE_FILE = CACHE_PATH + "llm_cache.db"
+CACHE_MAX_ENTRIES = 50000
+CACHE_TTL_SECONDS = 30 * 24 * 3600
+# eviction is checked every n inserts, not on every write
+EVICTION_INTERVAL = 100
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT,
+    tokens_in INTEGER,
+    tokens_out INTEGER,
+    created REAL,
+    last_access REAL
+);
+"""
+CREATE_INDEX = """
+CREATE INDEX IF NOT EXISTS idx_last_access ON responses (last_access);
+"""
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class ResponseCache:
+    """
+    Disk backed cache for LLM responses. Entries are evicted in least
+    recently used order once the cache holds more than max_entries rows and
+    expire after ttl seconds.
+    """
+
+    def __init__(
+        self,
+        file_name: str = CACHE_FILE,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        ttl: int = CACHE_TTL_SECONDS,
+    ):
+        folder = os.path.dirname(file_name)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.file_name = file_name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._inserts = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(file_name, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(CREATE_TABLE)
+        self._conn.execute(CREATE_INDEX)
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(
+        model: str,
+        system_prompt: str,
+        text: str,
+        temperature: float,
+        max_tokens: int,
+        response_format: dict = None,
+    ) -> str:
+        """
+        Builds the cache key for a request.
+
+        Args:
+            model (str): The model name.
+            system_prompt (str): The system prompt.
+            text (str): The user text.
+            temperature (float): The sampling temperature.
+            max_tokens (int): The completion token limit.
+            response_format (dict, optional): The response format, requests
+                without one keep the keys of earlier versions.
+
+        Returns:
+            str: sha256 hex digest identifying the request.
+        """
+        request = [model, system_prompt, text, temperature, max_tokens]
+        if response_format is not None:
+            request.append(response_format)
+        payload = json.dumps(request, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """
+        Returns the cached response for key.
+
+        Args:
+            key (str): Key created with make_key.
+
+        Returns:
+            tuple: (response, [tokens_in, tokens_out]) or None if the key is
+            not cached or has expired.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, tokens_in, tokens_out, created FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is not None and now - row[3] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+        return row[0], [row[1], row[2]]
+
+    def set(self, key: str, response: str, tokens: list):
+        """
+        Stores a response in the cache.
+
+        Args:
+            key (str): Key created with make_key.
+            response (str): The response text.
+            tokens (list): [tokens_in, tokens_out] of the original call.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, response, tokens[0], tokens[1], now, now),
+            )
+            self._conn.commit()
+            self._inserts += 1
+            if self._inserts % EVICTION_INTERVAL == 0:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        self._conn.execute(
+            "DELETE FROM responses WHERE created < ?", (now - self.ttl,)
+        )
+        count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access LIMIT ?)",
+                (count - self.max_entries,),
+            )
+        self._conn.commit()
+
+    def clear(self):
+        """Removes all entries from the cache and resets the counters."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self.hits, self.misses = 0, 0
+
+    def stats(self) -> dict:
+        """Returns the number of entries and the hit/miss counters."""
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"entries": count, "hits": self.hits, "misses": self.misses}
+
+
+def get_response_cache() -> ResponseCache:
+    """Returns the process wide response cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
@@ -0,0 +1,74 @@
+import os
+import threading
+
+import httpx
+from openai import OpenAI
+
+from helper import get_var
+
+# connection pool per client, should be >= the number of parallel requests
+HTTP_POOL_SIZE = 32
+HTTP_TIMEOUT = 120.0
+HTTP_CONNECT_TIMEOUT = 10.0
+# retries of the openai sdk, ToolBase retries itself and uses 0
+SDK_MAX_RETRIES = 2
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(
+    api_key: str = None,
+    base_url: str = None,
+    timeout: float = HTTP_TIMEOUT,
+    pool_size: int = HTTP_POOL_SIZE,
+    max_retries: int = SDK_MAX_RETRIES,
+) -> OpenAI:
+    """
+    Returns a shared OpenAI client. One client with a keep-alive connection
+    pool is created per api key, base url and timeout and reused by all tools,
+    so TLS handshakes and connection setup are only paid once per process.
+
+    Args:
+        api_key (str, optional): The API key. Defaults to the OPENAI_API_KEY
+            variable.
+        base_url (str, optional): The API endpoint. Defaults to the
+            OPENAI_BASE_URL environment variable or the OpenAI API.
+        timeout (float, optional): Read timeout in seconds.
+        pool_size (int, optional): Maximum number of connections.
+        max_retries (int, optional): Retries done by the openai sdk.
+
+    Returns:
+        OpenAI: The client.
+    """
+    if api_key is None:
+        api_key = get_var("OPENAI_API_KEY")
+    if base_url is None:
+        base_url = os.environ.get("OPENAI_BASE_URL")
+    key = (api_key, base_url, timeout, pool_size, max_retries)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=pool_size,
+                ),
+                timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT),
+            )
+            client = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=http_client,
+                max_retries=max_retries,
+            )
+            _clients[key] = client
+        return client
+
+
+def close_clients():
+    """Closes all shared clients and their connection pools."""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.multiclass import OneVsRestClassifier
+from sklearn.preprocessing import MultiLabelBinarizer
+
+from helper import to_builtin
+
+MODEL_PATH = "./data/models/"
+MODEL_FILE = MODEL_PATH + "classifier_{}.pkl"
+MIN_TRAINING_TEXTS = 200
+# a text is classified locally if the probability of every category is at
+# least this high or at most 1 - this value
+DEFAULT_MIN_PROBABILITY = 0.9
+# share of the training texts kept aside to measure the agreement with the LLM
+VALIDATION_SHARE = 0.1
+MAX_FEATURES = 200000
+# inverse regularisation strength, short texts need little regularisation
+REGULARISATION_C = 10.0
+PREDICT_BATCH_SIZE = 10000
+
+
+def categories_key(categories_dic: dict, no_match_code) -> str:
+    """Returns the key of a category set, the ids, labels and the no match code."""
+    content = json.dumps(
+        [[to_builtin(k), str(v)] for k, v in categories_dic.items()]
+        + [to_builtin(no_match_code)]
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+class LocalClassifier:
+    """
+    A fast multi-label classifier trained on the results of earlier LLM
+    classifications with the same categories: character n-gram TF-IDF
+    features and one logistic regression per category. Texts are only
+    classified locally if the model is confident for every category, the
+    others are left to the LLM.
+    """
+
+    def __init__(self, key: str):
+        """
+        Args:
+            key (str): The key of the category set, see categories_key.
+        """
+        self.key = key
+        self.vectorizer = None
+        self.model = None
+        self.binarizer = None
+        self.trained_texts = 0
+        self.trained_at = None
+        # coverage and agreement on the validation texts, see evaluate
+        self.validation = {}
+
+    @property
+    def file_name(self) -> str:
+        return MODEL_FILE.format(self.key)
+
+    def fit(self, texts: list, labels: list, seed: int = 0):
+        """
+        Trains the model. A share of the texts is kept aside first to
+        measure the agreement with the LLM labels, then the model is trained
+        on all texts.
+
+        Args:
+            texts (list): The texts.
+            labels (list): The category ids of every text.
+            seed (int, optional): Seed of the validation split.
+
+        Raises:
+            ValueError: If there are less than MIN_TRAINING_TEXTS texts or
+                less than two categories.
+        """
+        if len(texts) < MIN_TRAINING_TEXTS:
+            raise ValueError(
+                f"{len(texts)} texts found, at least {MIN_TRAINING_TEXTS} are needed."
+            )
+        if len({cat for text_labels in labels for cat in text_labels}) < 2:
+            raise ValueError("The texts must be assigned to at least two categories.")
+        order = np.random.default_rng(seed).permutation(len(texts))
+        validation = order[: int(len(texts) * VALIDATION_SHARE)]
+        train = order[len(validation) :]
+        self._fit([texts[p] for p in train], [labels[p] for p in train])
+        self.validation = self.evaluate(
+            [texts[p] for p in validation], [labels[p] for p in validation]
+        )
+        self._fit(texts, labels)
+        self.trained_texts = len(texts)
+        self.trained_at = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    def _fit(self, texts: list, labels: list):
+        self.vectorizer = TfidfVectorizer(
+            analyzer="char_wb",
+            ngram_range=(2, 5),
+            sublinear_tf=True,
+            max_features=MAX_FEATURES,
+            dtype=np.float32,
+        )
+        self.binarizer = MultiLabelBinarizer()
+        targets = self.binarizer.fit_transform(labels)
+        self.model = OneVsRestClassifier(
+            LogisticRegression(C=REGULARISATION_C, solver="liblinear")
+        )
+        self.model.fit(self.vectorizer.fit_transform(texts), targets)
+
+    @property
+    def categories(self) -> list:
+        return [to_builtin(cat) for cat in self.binarizer.classes_]
+
+    def predict_proba(self, texts: list) -> np.ndarray:
+        """Returns the probability of every category (columns as in categories) for every text."""
+        batches = [
+            self.model.predict_proba(
+                self.vectorizer.transform(texts[start : start + PREDICT_BATCH_SIZE])
+            )
+            for start in range(0, len(texts), PREDICT_BATCH_SIZE)
+        ]
+        if not batches:
+            return np.zeros((0, len(self.categories)))
+        return np.vstack(batches)
+
+    def predict(
+        self,
+        texts: list,
+        min_probability: float = DEFAULT_MIN_PROBABILITY,
+        max_categories: int = None,
+    ) -> list:
+        """
+        Classifies the texts the model is confident about.
+
+        Args:
+            texts (list): The texts.
+            min_probability (float, optional): See DEFAULT_MIN_PROBABILITY.
+            max_categories (int, optional): Texts with more categories are
+                left to the LLM.
+
+        Returns:
+            list: The response for every text, a category list as string like
+            the answer of the LLM, None if the model is not confident.
+        """
+        probabilities = self.predict_proba(texts)
+        assigned = probabilities >= 0.5
+        counts = assigned.sum(axis=1)
+        confident = (
+            (np.maximum(probabilities, 1 - probabilities) >= min_probability).all(axis=1)
+            & (counts > 0)
+            & (counts <= (max_categories or probabilities.shape[1]))
+        )
+        categories = self.categories
+        return [
+            json.dumps([categories[c] for c in np.flatnonzero(row)]) if ok else None
+            for row, ok in zip(assigned, confident)
+        ]
+
+    def evaluate(
+        self, texts: list, labels: list, min_probability: float = DEFAULT_MIN_PROBABILITY
+    ) -> dict:
+        """
+        Compares the predictions with the LLM labels.
+
+        Args:
+            texts (list): The texts.
+            labels (list): The category ids the LLM assigned to every text.
+            min_probability (float, optional): See predict.
+
+        Returns:
+            dict: texts, coverage (share of texts classified locally) and
+            agreement (share of locally classified texts with the same
+            categories as the LLM).
+        """
+        responses = self.predict(texts, min_probability)
+        matches = [
+            set(json.loads(response)) == {to_builtin(cat) for cat in text_labels}
+            for response, text_labels in zip(responses, labels)
+            if response is not None
+        ]
+        return {
+            "texts": len(texts),
+            "coverage": len(matches) / len(texts) if len(texts) else 0.0,
+            "agreement": float(np.mean(matches)) if matches else 0.0,
+        }
+
+    def save(self):
+        os.makedirs(MODEL_PATH, exist_ok=True)
+        with open(self.file_name, "wb") as file:
+            pickle.dump(self, file)
+
+    @classmethod
+    def load(cls, key: str):
+        """Returns the saved model of a category set, None if there is none."""
+        file_name = MODEL_FILE.format(key)
+        if not os.path.exists(file_name):
+            return None
+        with open(file_name, "rb") as file:
+            return pickle.load(file)
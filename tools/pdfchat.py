@@ -1,6 +1,7 @@
 # https://blog.nextideatech.com/chat-with-documents-using-langchain-gpt-4-python/
 # https://github.com/shahidul034/Chat-with-pdf-using-LLM-langchain-and-streamlit
 import os
+import time
 from enum import Enum
 
 import pyperclip
@@ -14,9 +15,11 @@ from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
 from langchain.callbacks.manager import CallbackManager
+from langchain.callbacks.base import BaseCallbackHandler
 
 
 from tools.tool_base import ToolBase, DEMO_PATH, DEFAULT_MODEL
+from tools.telemetry import OUTCOME_OK
 from helper import (
     show_download_button,
     extract_text_from_file,
@@ -31,6 +34,23 @@ class InputFormat(Enum):
     FILE = 1
 
 
+class StreamlitStreamHandler(BaseCallbackHandler):
+    """Writes the tokens of a streamed answer to a Streamlit placeholder and
+    measures the time to the first token."""
+
+    def __init__(self, placeholder):
+        self.placeholder = placeholder
+        self.text = ""
+        self.start = time.perf_counter()
+        self.ttft = None
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.start
+        self.text += token
+        self.placeholder.markdown(self.text)
+
+
 class PdfChat(ToolBase):
     def __init__(self, logger):
         super().__init__(logger)
@@ -140,7 +160,8 @@ class PdfChat(ToolBase):
 
     def create_retriever(self, _embeddings, splits):
         try:
-            vectorstore = FAISS.from_texts(splits, _embeddings)
+            with self.track("embeddings", model=getattr(_embeddings, "model", None)):
+                vectorstore = FAISS.from_texts(splits, _embeddings)
         except (IndexError, ValueError) as e:
             st.error(f"Error creating vectorstore: {e}")
             return
@@ -174,10 +195,17 @@ class PdfChat(ToolBase):
         self.user_prompt = f'Antworte auf deutsch: ***{prompt}***'
         ok = (self.user_prompt) > '' and (self.qa is not None)
         if st.button("📨 Abschicken", disabled=(ok is False)):
-            self.response = self.qa.run(self.user_prompt)
+            placeholder = st.empty()
+            handler = StreamlitStreamHandler(placeholder)
+            self.response = self.qa.run(self.user_prompt, callbacks=[handler])
+            total = time.perf_counter() - handler.start
+            self.record_timing(handler.ttft or total, total)
+            self.record_call(total, 0, None, OUTCOME_OK, ttft=handler.ttft)
+            placeholder.empty()
 
         if self.response is not None:
             with st.expander(f'🤖 {self.model}', expanded=True):
                 st.markdown(self.response)
+                st.caption(self.timing_expression())
             if st.button("Text in Zwischenablage kopieren"):
                 pyperclip.copy(self.response)
@@ -0,0 +1,102 @@
+import pandas as pd
+
+from tools.rate_limiter import DEFAULT_RPM, DEFAULT_TPM
+
+# typical latency of a request, used for the duration estimate
+DEFAULT_SECONDS_PER_REQUEST = 2.0
+# expected completion tokens relative to the input text
+TRANSLATION_OUTPUT_RATIO = 1.2
+SIMPLIFY_OUTPUT_RATIO = 1.3
+TOKENS_PER_SENTENCE = 25
+CHARS_PER_TOKEN = 4
+
+
+class CostPlan:
+    """
+    Expected requests, tokens, cost and duration of a job, calculated before
+    the first request is sent.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        pricing: dict,
+        requests: int = 0,
+        tokens_in: int = 0,
+        tokens_out: int = 0,
+    ):
+        self.model = model
+        self.pricing = pricing
+        self.requests = requests
+        self.tokens_in = tokens_in
+        self.tokens_out = tokens_out
+
+    def add(self, tokens_in: int, tokens_out: int, requests: int = 1):
+        self.requests += requests
+        self.tokens_in += tokens_in
+        self.tokens_out += tokens_out
+
+    @property
+    def cost(self) -> float:
+        return (
+            self.pricing["in"] * self.tokens_in + self.pricing["out"] * self.tokens_out
+        ) / 1000
+
+    def duration(
+        self,
+        max_concurrency: int,
+        seconds_per_request: float = DEFAULT_SECONDS_PER_REQUEST,
+        rpm: int = DEFAULT_RPM,
+        tpm: int = DEFAULT_TPM,
+    ) -> float:
+        """
+        Expected duration of the job in seconds. The job is limited either by
+        the number of parallel requests or by the rate limits.
+        """
+        requests_per_minute = min(max_concurrency * 60 / seconds_per_request, rpm)
+        minutes = max(
+            self.requests / requests_per_minute,
+            (self.tokens_in + self.tokens_out) / tpm,
+        )
+        return minutes * 60
+
+    def to_dataframe(self, max_concurrency: int) -> pd.DataFrame:
+        seconds = self.duration(max_concurrency)
+        return pd.DataFrame(
+            {
+                "Kennzahl": [
+                    "Modell",
+                    "Anfragen",
+                    "Tokens in",
+                    "Tokens out (geschätzt)",
+                    "Kosten (geschätzt)",
+                    "Dauer (geschätzt)",
+                ],
+                "Wert": [
+                    self.model,
+                    f"{self.requests}",
+                    f"{self.tokens_in}",
+                    f"{self.tokens_out}",
+                    f"${self.cost:.2f}",
+                    f"{seconds / 60:.1f} min",
+                ],
+            }
+        )
+
+
+def limit_to_tokens(limit_number: int, limit_type_index: int) -> int:
+    """
+    Converts the length limit of a summary to tokens.
+
+    Args:
+        limit_number (int): The limit.
+        limit_type_index (int): 0 = characters, 1 = tokens, 2 = sentences.
+
+    Returns:
+        int: The expected number of tokens.
+    """
+    if limit_type_index == 0:
+        return limit_number // CHARS_PER_TOKEN
+    elif limit_type_index == 1:
+        return limit_number
+    return limit_number * TOKENS_PER_SENTENCE
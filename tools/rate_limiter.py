@@ -0,0 +1,221 @@
+import re
+import time
+import random
+import threading
+
+import openai
+
+# starting budgets, adjusted from the x-ratelimit-* headers of the responses
+DEFAULT_RPM = 500
+DEFAULT_TPM = 200000
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# approximation used for throttling, exact counts are not needed here
+CHARS_PER_TOKEN = 4
+
+NON_RETRYABLE_ERRORS = (
+    openai.BadRequestError,
+    openai.AuthenticationError,
+    openai.PermissionDeniedError,
+    openai.NotFoundError,
+    openai.UnprocessableEntityError,
+)
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def parse_duration(value: str) -> float:
+    """
+    Parses durations as used in the rate limit headers, e.g. '1s', '6m0s',
+    '20ms' or plain seconds.
+
+    Args:
+        value (str): The header value.
+
+    Returns:
+        float: The duration in seconds, None if the value cannot be parsed.
+    """
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if not parts:
+        return None
+    factors = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * factors[unit] for number, unit in parts)
+
+
+def estimate_tokens(*texts, max_tokens: int = 0) -> int:
+    """Cheap token estimate of a request, including the completion limit."""
+    return sum(len(text or "") for text in texts) // CHARS_PER_TOKEN + max_tokens
+
+
+def is_retryable(err: Exception) -> bool:
+    """
+    Returns True if a failed request may succeed when it is sent again.
+    Bad requests (e.g. context length exceeded), authentication errors and
+    an exhausted quota are never retried.
+    """
+    if isinstance(err, NON_RETRYABLE_ERRORS):
+        return False
+    if isinstance(err, openai.RateLimitError):
+        return getattr(err, "code", None) != "insufficient_quota"
+    if isinstance(err, RETRYABLE_ERRORS):
+        return True
+    if isinstance(err, openai.APIStatusError):
+        return err.status_code in (408, 409) or err.status_code >= 500
+    return False
+
+
+def retry_after(err: Exception) -> float:
+    """
+    Returns the wait time requested by the server for a failed request.
+
+    Args:
+        err (Exception): The exception raised by the client.
+
+    Returns:
+        float: Seconds to wait, None if the server sent no hint.
+    """
+    response = getattr(err, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        return parse_duration(headers["retry-after-ms"]) / 1000
+    for header in (
+        "retry-after",
+        "x-ratelimit-reset-requests",
+        "x-ratelimit-reset-tokens",
+    ):
+        seconds = parse_duration(headers.get(header))
+        if seconds is not None:
+            return seconds
+    return None
+
+
+def backoff_delay(attempt: int, retry_after_seconds: float = None) -> float:
+    """
+    Exponential backoff with jitter. A server hint takes precedence.
+
+    Args:
+        attempt (int): Number of failed attempts so far, starting with 1.
+        retry_after_seconds (float, optional): Wait time sent by the server.
+
+    Returns:
+        float: Seconds to wait before the next attempt.
+    """
+    if retry_after_seconds is not None:
+        return min(retry_after_seconds, BACKOFF_MAX) + random.uniform(0, 0.5)
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))
+    return random.uniform(delay / 2, delay)
+
+
+class TokenBucket:
+    """Bucket refilled continuously with capacity units per minute."""
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        rate = self.capacity / 60
+        self.level = min(self.capacity, self.level + (now - self.updated) * rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / (self.capacity / 60)
+
+
+class RateLimiter:
+    """
+    Throttles requests before they are sent so the requests per minute and
+    tokens per minute budgets of a model are not exceeded. The budgets adapt
+    to the limits reported by the API in the x-ratelimit-* headers.
+    """
+
+    def __init__(self, rpm: int = DEFAULT_RPM, tpm: int = DEFAULT_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.blocked_until = 0.0
+        self.throttled_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int = 0) -> float:
+        """
+        Blocks until a request with the given token estimate may be sent.
+
+        Args:
+            tokens (int, optional): Estimated tokens of the request.
+
+        Returns:
+            float: The number of seconds the call was throttled.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                wait = max(
+                    self.blocked_until - now,
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(tokens),
+                )
+                if wait <= 0:
+                    self.requests.level -= 1
+                    self.tokens.level -= min(tokens, self.tokens.capacity)
+                    self.throttled_seconds += waited
+                    return waited
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds: float):
+        """Blocks all requests for the given number of seconds, e.g. after a 429."""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers):
+        """
+        Adapts the budgets to the x-ratelimit-* headers of a response.
+
+        Args:
+            headers: The response headers.
+        """
+        with self._lock:
+            now = time.monotonic()
+            for bucket, name in ((self.requests, "requests"), (self.tokens, "tokens")):
+                limit = headers.get(f"x-ratelimit-limit-{name}")
+                remaining = headers.get(f"x-ratelimit-remaining-{name}")
+                try:
+                    if limit is not None:
+                        bucket.refill(now)
+                        bucket.capacity = float(limit)
+                    if remaining is not None:
+                        bucket.refill(now)
+                        bucket.level = min(bucket.level, float(remaining))
+                except ValueError:
+                    continue
+
+
+def get_rate_limiter(model: str) -> RateLimiter:
+    """Returns the process wide rate limiter of a model."""
+    with _limiters_lock:
+        limiter = _limiters.get(model)
+        if limiter is None:
+            limiter = RateLimiter()
+            _limiters[model] = limiter
+        return limiter
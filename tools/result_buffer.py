@@ -0,0 +1,89 @@
+import csv
+import time
+
+import pandas as pd
+
+# a flush is due after this many rows or seconds, whichever comes first
+FLUSH_ROWS = 500
+FLUSH_SECONDS = 5.0
+
+
+class ResultBuffer:
+    """
+    Collects the rows of a csv output file in memory, column by column, and
+    appends them to the file in batches. A flush is due after FLUSH_ROWS rows
+    or FLUSH_SECONDS seconds, so an interrupted job loses at most the rows of
+    the last interval. The file is written with the same csv dialect as
+    helper.append_row, the content is identical to appending row by row.
+    """
+
+    def __init__(
+        self,
+        file_name: str,
+        columns: list,
+        flush_rows: int = FLUSH_ROWS,
+        flush_seconds: float = FLUSH_SECONDS,
+        keep: bool = True,
+    ):
+        """
+        Args:
+            file_name (str): The csv file, the header must already exist.
+            columns (list): The column names.
+            flush_rows (int, optional): Rows collected before a flush.
+            flush_seconds (float, optional): Seconds after the last flush
+                before a flush is due.
+            keep (bool, optional): Keep the flushed rows in memory for
+                to_dataframe. Set to False for large columns that are only
+                needed in the file.
+        """
+        self.file_name = file_name
+        self.columns = list(columns)
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.keep = keep
+        self._data = {column: [] for column in self.columns}
+        # rows of _data that are not yet in the file
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def __len__(self):
+        return len(self._data[self.columns[0]])
+
+    def load(self):
+        """Reads the rows already in the file, e.g. when a job is resumed."""
+        df = pd.read_csv(self.file_name, sep=";")
+        for column in self.columns:
+            self._data[column] = df[column].tolist() + self._data[column]
+
+    def extend(self, rows: list):
+        """
+        Adds rows to the buffer and flushes it if a flush is due.
+
+        Args:
+            rows (list): Rows with one value per column.
+        """
+        for row in rows:
+            for column, value in zip(self.columns, row):
+                self._data[column].append(value)
+            self._pending += 1
+        if self._pending >= self.flush_rows or (
+            self._pending and time.monotonic() - self._last_flush >= self.flush_seconds
+        ):
+            self.flush()
+
+    def flush(self):
+        """Appends the pending rows to the file."""
+        if self._pending:
+            start = len(self) - self._pending
+            rows = zip(*(self._data[column][start:] for column in self.columns))
+            with open(self.file_name, "a", newline="", encoding="utf-8") as file:
+                writer = csv.writer(file, delimiter=";")
+                writer.writerows(rows)
+            if not self.keep:
+                self._data = {column: [] for column in self.columns}
+            self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Returns the rows kept in memory, including the pending ones."""
+        return pd.DataFrame(self._data, columns=self.columns)
@@ -1,8 +1,8 @@
 import streamlit as st
 
 import re
+import logging
 from datetime import datetime
-from openai import OpenAI
 import base64
 from docx import Document
 from docx.shared import Pt, Inches
@@ -14,6 +14,7 @@ from tools.tool_base import (
     ToolBase,
     LOGFILE,
 )
+from tools.planner import SIMPLIFY_OUTPUT_RATIO
 
 
 from tools.simplify_language_utils import (
@@ -49,6 +50,9 @@ MAX_CHARS_INPUT = 10_000
 # From our testing we derive a sensible temperature of 0.5 as  a good trade-off between creativity and coherence. Adjust this to your needs.
 TEMPERATURE = 0.5
 
+# Completion limit of a request.
+MAX_TOKENS = 4096
+
 # Constants for the formatting of the Word document that can be downloaded.
 FONT_WORDDOC = "Arial"
 FONT_SIZE_HEADING = 12
@@ -59,6 +63,9 @@ FONT_SIZE_FOOTER = 7
 LIMIT_HARD = 0
 LIMIT_MEDIUM = -2
 
+# Tags around the result, removed from the partial output while streaming.
+RESULT_TAGS = re.compile(r"</?(leichtesprache|einfachesprache)>")
+
 
 class InputFormat(Enum):
     DEMO = 0
@@ -87,10 +94,6 @@ class SimplifyLanguage(ToolBase):
         self.intro = self.get_intro()
         self.input_format = INPUT_FORMAT_OPTIONS[0]
 
-        self.openai_client = OpenAI(
-            api_key=get_var("OPENAI_API_KEY"),
-        )
-
     def show_settings(self):
         st.markdown("Einstellungen")
 
@@ -178,28 +181,44 @@ class SimplifyLanguage(ToolBase):
         result = "\n".join(result)
         return result.strip()
 
-    def invoke_openai_model(
+    def stream_openai_model(
         self,
+        placeholder,
         temperature=TEMPERATURE,
-        max_tokens=4096,
+        max_tokens=MAX_TOKENS,
     ):
-        """Invoke OpenAI model."""
+        """Stream the OpenAI model response into the placeholder and extract
+        the result once the response is complete."""
         final_prompt, system = self.create_prompt()
+        response = ""
         try:
-            message = self.openai_client.chat.completions.create(
-                model=self.model,
+            for delta in self.get_completion_stream(
+                final_prompt,
+                system_prompt=system,
                 temperature=temperature,
                 max_tokens=max_tokens,
-                messages=[
-                    {"role": "system", "content": system},
-                    {"role": "user", "content": final_prompt},
-                ],
-            )
-            message = message.choices[0].message.content.strip()
-            return True, self.get_result_from_response(message)
+            ):
+                response += delta
+                placeholder.markdown(RESULT_TAGS.sub("", response))
         except Exception as e:
-            print(f"Error: {e}")
-            return False, e
+            self.report(f"Error: {e}", logging.ERROR)
+            return False, ""
+        if response == "" or self.stream_error is not None:
+            return False, ""
+        return True, self.get_result_from_response(response)
+
+    def estimate_cost(self):
+        """Returns the expected tokens and cost of simplifying the input text."""
+        final_prompt, system = self.create_prompt()
+        prompt_tokens, system_tokens, text_tokens = self.count_tokens(
+            [final_prompt, system, self.text]
+        )
+        plan = self.new_cost_plan()
+        plan.add(
+            prompt_tokens + system_tokens,
+            min(int(text_tokens * SIMPLIFY_OUTPUT_RATIO), MAX_TOKENS),
+        )
+        return plan
 
     def run(self):
         def get_input_text():
@@ -239,6 +258,8 @@ class SimplifyLanguage(ToolBase):
             if st.session_state.method.startswith("Analyse")
             else "Vereinfachen"
         )
+        if st.button("Kosten schätzen"):
+            self.show_cost_plan(self.estimate_cost())
         if st.button(button_action):
             with placeholder_result:
                 text_output = st.text_area(
@@ -280,10 +301,9 @@ class SimplifyLanguage(ToolBase):
                         help="Verständlichkeit auf einer Skala von -10 bis 10 Punkten (von -10 = extrem schwer verständlich bis 10 = sehr gut verständlich). Texte in Einfacher Sprache haben meist einen Wert von 0 bis 4 oder höher, Texte in Leichter Sprache 2 bis 6 oder höher.",
                     )
 
-                with placeholder_analysis.container():
-                    with st.spinner("Ich arbeite..."):
-                        # Regular text simplification or analysis.
-                        success, response = self.invoke_openai_model()
+                # Regular text simplification or analysis, the partial output is
+                # shown while the response arrives.
+                success, response = self.stream_openai_model(placeholder_result)
 
                 if success is False:
                     st.error(
@@ -303,6 +323,7 @@ class SimplifyLanguage(ToolBase):
                         height=TEXT_AREA_HEIGHT,
                         value=response,
                     )
+                    st.caption(self.timing_expression())
                     if not st.session_state.method.startswith("Analyse"):
                         score_target = get_zix(response)
                         score_target_rounded = int(np.round(score_target, 0) + 0)
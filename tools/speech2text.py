@@ -3,13 +3,13 @@
 import streamlit as st
 import os
 from moviepy.editor import VideoFileClip
-from openai import OpenAI
 import pyperclip
 from enum import Enum
 import zipfile
 
 from helper import get_var, save_uploadedfile
 from tools.tool_base import ToolBase, TEMP_PATH, OUTPUT_PATH, DEMO_PATH
+from tools.llm_client import get_client
 from st_audiorec import st_audiorec
 
 DEMO_FILE = DEMO_PATH + "demo_audio.mp3"
@@ -107,12 +107,11 @@ class Speech2Text(ToolBase):
         return open(dummy_file, "rb")
             
     def transcribe(self, audio_stream: bytes) -> str:
-        client = OpenAI(
-            api_key=get_var("OPENAI_API_KEY"),
-        )
-        transcript = client.audio.transcriptions.create(
-            model="whisper-1", file=audio_stream, response_format="text"
-        )
+        client = get_client()
+        with self.track("audio.transcriptions", model="whisper-1"):
+            transcript = client.audio.transcriptions.create(
+                model="whisper-1", file=audio_stream, response_format="text"
+            )
         return transcript
 
     def run(self):
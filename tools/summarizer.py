@@ -17,12 +17,12 @@ from helper import (
     get_text_from_binary,
     download_file_button,
     get_var,
-    get_token_size,
     display_pdf,
     extract_text_from_file,
     save_json_object,
 )
 from tools.tokenizer import split_text
+from tools.planner import limit_to_tokens
 from tools.tool_base import (
     ToolBase,
     MODEL_OPTIONS,
@@ -34,7 +34,13 @@ from tools.tool_base import (
 logger = init_logging(__name__, LOGFILE)
 
 DEMO_FILES = "./data/demo/summary_folder/"
+TITLE_PROMPT_TEMPLATE = "Extract the title for the following text:\n\n{}"
+# expected length of an extracted title
+TITLE_TOKENS = 30
 SYSTEM_PROMPT_TEMPLATE = "You will be provided with a text. Your task is to summarize the text in German. The summary should contain a maximum of {}. Focus on the main results."
+REDUCE_PROMPT_TEMPLATE = "You will be provided with summaries of consecutive parts of one text. Your task is to combine them into one summary of the whole text in German. The summary should contain a maximum of {}. Focus on the main results."
+# separates the partial summaries merged in one request
+SUMMARY_SEPARATOR = "\n\n"
 LIMIT_OPTIONS = ["Zeichen", "Tokens", "Sätze"]
 FILE_FORMAT_OPTIONS = ["pdf", "txt"]
 INPUT_FORMAT_OPTIONS = ["Demo", "Datei Hochladen", "ZIP Datei hochladen"]
@@ -58,6 +64,36 @@ class OutputFormat(Enum):
     ZIP = 2
 
 
+class SummaryJob:
+    """
+    State of the map-reduce summary of one text. Level 0 are the chunks of
+    the text, every further level are the merged summaries of the previous
+    level. outputs holds the summary of every input of the current level,
+    None if it is missing or the request failed, so a job can be continued
+    after failures.
+    """
+
+    def __init__(self, file: str, chunks: list):
+        self.file = file
+        self.level = 0
+        self.inputs = chunks
+        self.outputs = [None] * len(chunks)
+        self.tokens = [0, 0]
+        # the result dict of summarize_text, updated when the job is continued
+        self.result = None
+
+    def failed(self) -> list:
+        """Returns the positions of the current level without summary."""
+        return [position for position, output in enumerate(self.outputs) if output is None]
+
+    @property
+    def summary(self) -> str:
+        """The summary of the text, empty while the job is incomplete."""
+        if len(self.outputs) == 1 and self.outputs[0] is not None:
+            return self.outputs[0]
+        return ""
+
+
 class Summary(ToolBase):
     def __init__(self, logger):
         super().__init__(logger)
@@ -75,6 +111,7 @@ class Summary(ToolBase):
         self.input_prefix = "input/"
         self.output_prefix = "output/"
         self.text = ""
+        self.summary_jobs = {}
 
         self.intro = self.get_intro()
         self.input_format = INPUT_FORMAT_OPTIONS[0]
@@ -84,9 +121,32 @@ class Summary(ToolBase):
         limit_expression = f"{self.limit_number} {self.limit_type}"
         return SYSTEM_PROMPT_TEMPLATE.format(limit_expression)
 
+    @property
+    def reduce_prompt(self):
+        limit_expression = f"{self.limit_number} {self.limit_type}"
+        return REDUCE_PROMPT_TEMPLATE.format(limit_expression)
+
+    def summary_tokens(self) -> int:
+        """Expected length of a summary in tokens."""
+        return min(
+            limit_to_tokens(self.limit_number, LIMIT_OPTIONS.index(self.limit_type)),
+            self.max_tokens,
+        )
+
+    def reduce_budget(self) -> int:
+        """Tokens of the partial summaries merged in one request."""
+        return (
+            self.chunk_size()
+            - self.count_tokens([self.reduce_prompt])[0]
+            - self.max_tokens
+        )
+
     def show_settings(self):
         self.input_format = st.radio(label="Input Format", options=INPUT_FORMAT_OPTIONS)
         self.model = self.get_model()
+        self.max_concurrency = self.get_max_concurrency()
+        self.use_cache = self.get_use_cache()
+        self.budget = self.get_budget()
         st.markdown("Begrenze die Zusammenfassung auf")
         cols = st.columns([1, 1, 2])
         with cols[0]:
@@ -152,61 +212,227 @@ class Summary(ToolBase):
                 )
 
     def extract_title(self, text: str):
-        prompt = f"Extract the title for the following text:\n\n{text}"
+        prompt = TITLE_PROMPT_TEMPLATE.format(text)
         title, tokens = self.get_completion(text=prompt, index=0)
         return title, tokens
 
+    def input_texts(self) -> list:
+        """Returns the texts of the selected demo files or the uploaded pdf file."""
+        input_format = INPUT_FORMAT_OPTIONS.index(self.input_format)
+        if input_format == InputFormat.DEMO.value:
+            return [
+                extract_text_from_file(os.path.join(DEMO_FILES, file))
+                for file in self.input_files
+            ]
+        elif input_format == InputFormat.FILE.value and getattr(self, "input_file", None):
+            if check_file_type(self.input_file).lower() == "pdf":
+                return [extract_text_from_uploaded_file(self.input_file)]
+        return []
+
+    def estimate_cost(self):
+        """
+        Splits the input texts into chunks and returns the expected requests,
+        tokens and cost. Every text needs a title request, one request per
+        chunk and, for more than one chunk, the requests merging the chunk
+        summaries level by level, see group_summaries. Zip files are not
+        estimated.
+
+        Returns:
+            CostPlan: The plan.
+        """
+        plan = self.new_cost_plan()
+        summary_tokens = self.summary_tokens()
+        reduce_tokens = self.count_tokens([self.reduce_prompt])[0]
+        group_size = max(2, self.reduce_budget() // max(summary_tokens, 1))
+        for text in self.input_texts():
+            self.plan_completions(
+                [TITLE_PROMPT_TEMPLATE.format(text[:500])],
+                tokens_out=[TITLE_TOKENS],
+                plan=plan,
+            )
+            chunks = self.split_document(text)
+            self.plan_completions(
+                chunks, tokens_out=[summary_tokens] * len(chunks), plan=plan
+            )
+            count = len(chunks)
+            while count > 1:
+                for start in range(0, count, group_size):
+                    size = min(group_size, count - start)
+                    plan.add(reduce_tokens + summary_tokens * size, summary_tokens)
+                count = -(-count // group_size)
+        return plan
+
+    def summarize_text(self, text: str, file: str, placeholder) -> dict:
+        """
+        Extracts the title and summarizes a text, the tokens are added to the
+        tool's counters.
+
+        Args:
+            text (str): The text.
+            file (str): Name of the file, used in progress messages.
+            placeholder: The placeholder object to write progress updates.
+
+        Returns:
+            dict: Title, summary and the tokens of the summary requests. The
+            summary is empty if a chunk failed, see retry_failed_chunks.
+        """
+        title, tokens = self.extract_title(text[:500])
+        self.add_tokens(tokens)
+        summary, tokens = self.generate_summary(text, file, placeholder)
+        result = {'title': title, 'summary': summary, 'tokens_in': tokens[0], 'tokens_out': tokens[1]}
+        self.summary_jobs[file].result = result
+        return result
+
     def save_file(self, file: str, result: dict):
         file_path = os.path.join(OUTPUT_PATH, file.replace(".pdf", ".json"))
         save_json_object(result, file_path)
 
-    def run(self):
-        def show_summary_text_field(result):
-            st.markdown(f"**Titel:** {result['title']}")
-            st.text_area("Zusammenfassung", value=result['summary'], height=400)
-            show_download_button(text_data=json.dumps(result, indent=4))
+    def split_document(self, text: str) -> list:
+        """Splits a text into chunks that fit into a request with the system prompt and the summary."""
+        chunks = split_text(
+            text,
+            system_prompt=self.system_prompt,
+            model_name=self.model,
+            max_tokens_per_chunk=self.chunk_size(),
+            expected_completion_tokens=self.max_tokens,
+        )
+        return [chunk for chunk in chunks if chunk.strip()]
 
-        def generate_summary(text: str, file: str, placeholder) -> str:
-            """
-            Generate a summary of the given text. if the text does not fit into the max_tokens limit,
-            it is split into chunks and a summary is generated for each chunk.
+    def group_summaries(self, summaries: list) -> list:
+        """
+        Groups consecutive summaries, so that every group fits into one
+        request of at most reduce_budget tokens. A group has at least two
+        summaries, so every level has fewer summaries than the previous one.
 
-            Args:
-                text (str): The input text to be summarized.
-                placeholder: The placeholder object to write progress updates.
+        Args:
+            summaries (list): The summaries of a level.
 
-            Returns:
-                str: The generated summary of the text.
-            """
-            self.tokens_in, self.tokens_out = 0, 0
-            input_chunks = split_text(
-                text,
-                system_prompt=self.system_prompt,
-                model_name=self.model,
-                max_tokens_per_chunk=self.chunk_size(),
-            )
-            output_chunks = []
-            for chunk in input_chunks:
-                response, tokens = self.get_completion(text=chunk, index=0)
-                output_chunks.append(response)
-                placeholder.write(
-                    f"File: {file}: Chunk {input_chunks.index(chunk) + 1} / {len(input_chunks)} completed"
-                )
+        Returns:
+            list: Lists of the positions of the summaries in every group.
+        """
+        budget = self.reduce_budget()
+        separator_tokens = self.count_tokens([SUMMARY_SEPARATOR])[0]
+        groups, group, group_tokens = [], [], 0
+        for position, tokens in enumerate(self.count_tokens(summaries)):
+            tokens += separator_tokens
+            if len(group) >= 2 and group_tokens + tokens > budget:
+                groups.append(group)
+                group, group_tokens = [], 0
+            group.append(position)
+            group_tokens += tokens
+        if len(group) == 1 and groups:
+            # a single remaining summary is merged with the previous group
+            groups[-1].extend(group)
+        elif group:
+            groups.append(group)
+        return groups
+
+    def summarize_level(self, job: SummaryJob, positions: list, placeholder):
+        """
+        Summarizes the inputs of the current level of a job in parallel. The
+        chunks of level 0 are summarized with the system prompt, the merged
+        summaries of the higher levels with the reduce prompt.
+
+        Args:
+            job (SummaryJob): The job.
+            positions (list): The positions of the inputs to summarize.
+            placeholder: The placeholder object to write progress updates.
+        """
+        system_prompt = self.system_prompt if job.level == 0 else self.reduce_prompt
+        stage = "Chunk" if job.level == 0 else f"Merge level {job.level}"
 
-            text = " ".join(output_chunks)
-            # make sure the summary is not longer than the limit
-            input_chunks = split_text(
-                text,
-                system_prompt=self.system_prompt,
-                model_name=self.model,
-                max_tokens_per_chunk=self.chunk_size(),
+        def summarize(position):
+            return self.get_completion(
+                job.inputs[position], position, system_prompt=system_prompt
             )
-            if len(input_chunks) > 1:
-                logger.info(
-                    f"Der Text ist für eine Zusammenfassung mit diesem Modell zu lang. Nur die ersten {self.chunk_size()} von {get_token_size(text)} token werden verwendet."
+
+        def show_progress(done, total, position, result):
+            response, tokens = result
+            tokens = tokens or [0, 0]
+            self.add_tokens(tokens)
+            job.tokens = [job.tokens[0] + tokens[0], job.tokens[1] + tokens[1]]
+            if response:
+                job.outputs[positions[position]] = response
+            placeholder.write(f"File: {job.file}: {stage} {done} / {total} completed")
+
+        self.run_concurrent(summarize, positions, progress_callback=show_progress)
+
+    def continue_summary(self, job: SummaryJob, placeholder) -> str:
+        """
+        Runs a job until one summary remains. The missing summaries of the
+        current level are generated, then the summaries are merged in groups,
+        see group_summaries, level by level. The job stops at a level with
+        failed summaries or when the budget is reached and can be continued
+        later.
+
+        Args:
+            job (SummaryJob): The job.
+            placeholder: The placeholder object to write progress updates.
+
+        Returns:
+            str: The summary, empty if the job is incomplete.
+        """
+        while True:
+            if job.failed():
+                self.summarize_level(job, job.failed(), placeholder)
+            if job.failed() or self.budget_exceeded:
+                return job.summary
+            if len(job.outputs) <= 1:
+                return job.summary
+            job.inputs = [
+                SUMMARY_SEPARATOR.join(job.outputs[position] for position in group)
+                for group in self.group_summaries(job.outputs)
+            ]
+            job.outputs = [None] * len(job.inputs)
+            job.level += 1
+
+    def generate_summary(self, text: str, file: str, placeholder) -> tuple:
+        """
+        Generate a summary of the given text with map-reduce: the text is
+        split into chunks that are summarized in parallel, the chunk summaries
+        are then merged in groups that fit into one request until a single
+        summary remains, so no part of the text is left out. Failed chunks
+        can be summarized again with retry_failed_chunks.
+
+        Args:
+            text (str): The input text to be summarized.
+            file (str): Name of the file, used in progress messages.
+            placeholder: The placeholder object to write progress updates.
+
+        Returns:
+            tuple: The summary, empty if a chunk failed, and the tokens [in,
+            out] of all requests, already added to the tool's counters.
+        """
+        job = SummaryJob(file, self.split_document(text))
+        self.summary_jobs[file] = job
+        return self.continue_summary(job, placeholder), job.tokens
+
+    def failed_jobs(self) -> list:
+        """Returns the jobs of the last run with failed chunks."""
+        return [job for job in self.summary_jobs.values() if job.failed()]
+
+    def retry_failed_chunks(self, placeholder):
+        """
+        Continues the jobs with failed chunks, the results and, for the demo
+        files, the output files are updated.
+        """
+        for job in self.failed_jobs():
+            if self.budget_reached():
+                self.budget_exceeded = True
+                break
+            summary = self.continue_summary(job, placeholder)
+            if job.result is not None:
+                job.result.update(
+                    {'summary': summary, 'tokens_in': job.tokens[0], 'tokens_out': job.tokens[1]}
                 )
-            text, tokens = self.get_completion(text=input_chunks[0], index=0)
-            return text, tokens
+                if INPUT_FORMAT_OPTIONS.index(self.input_format) == InputFormat.DEMO.value:
+                    self.save_file(job.file, job.result)
+
+    def run(self):
+        def show_summary_text_field(result):
+            st.markdown(f"**Titel:** {result['title']}")
+            st.text_area("Zusammenfassung", value=result['summary'], height=400)
+            show_download_button(text_data=json.dumps(result, indent=4))
 
         self.display_selected_model()
         if (
@@ -214,8 +440,13 @@ class Summary(ToolBase):
             == InputFormat.DEMO.value
         ):
             st.markdown(f"{len(self.input_files)} Dateien werden zusammengefasst.")
+        if st.button("Kosten schätzen"):
+            self.show_cost_plan(self.estimate_cost())
         if st.button("Zusammenfassung"):
             self.results = []
+            self.summary_jobs = {}
+            self.tokens_in, self.tokens_out = 0, 0
+            self.start_budget()
             with st.spinner("Generiere Zusammenfassung..."):
                 self.errors = []
                 placeholder = st.empty()
@@ -224,12 +455,11 @@ class Summary(ToolBase):
                     == InputFormat.DEMO.value
                 ):
                     for file in self.input_files:
+                        if self.budget_reached():
+                            self.budget_exceeded = True
+                            break
                         text = extract_text_from_file(os.path.join(DEMO_FILES, file))
-                        title, tokens = self.extract_title(text[:500])
-                        self.add_tokens(tokens)
-                        summary, tokens = generate_summary(text, file, placeholder)
-                        self.add_tokens(tokens)
-                        result = {'title': title, 'summary': summary, 'tokens_in': tokens[0], 'tokens_out': tokens[1]}
+                        result = self.summarize_text(text, file, placeholder)
                         self.results.append(result)
                         self.save_file(file, result)
 
@@ -240,9 +470,7 @@ class Summary(ToolBase):
                     if self.input_file:
                         if check_file_type(self.input_file).lower() == "pdf":
                             text = extract_text_from_uploaded_file(self.input_file)
-                            title, tokens = self.extract_title(text[:500])
-                            summary, tokens = generate_summary(text, self.input_file.name, placeholder)
-                            result = {'title': title, 'summary': summary, 'tokens_in': tokens[0], 'tokens_out': tokens[1]}
+                            result = self.summarize_text(text, self.input_file.name, placeholder)
                             self.results.append(result)
                 elif (
                     INPUT_FORMAT_OPTIONS.index(self.input_format)
@@ -272,8 +500,14 @@ class Summary(ToolBase):
                                             text = get_text_from_binary(binary_content)
                                             out_filename = file.filename
                                     if text > "":
-                                        generate_summary(text, placeholder)
-                                        summaries.append(self.output)
+                                        summary, tokens = self.generate_summary(
+                                            text, file.filename, placeholder
+                                        )
+                                        if not summary:
+                                            st.warning(
+                                                f"Die Zusammenfassung der Datei {file.filename} ist unvollständig, {len(self.summary_jobs[file.filename].failed())} Abschnitte sind fehlgeschlagen."
+                                            )
+                                        summaries.append(summary)
                                         file_names.append(out_filename)
                                     else:
                                         st.warning(
@@ -290,9 +524,21 @@ class Summary(ToolBase):
                     if self.output_file:
                         download_file_button(self.output_file, "Datei herunterladen")
                
-                if len(self.results) > 0:
-                    st.markdown('---')
-                    with st.expander('Verwendete Tokens'):
-                        st.markdown(self.token_use_expression())
-                    for result in self.results:
-                        show_summary_text_field(result)
+                self.show_budget_warning()
+
+        failed_jobs = [job for job in self.failed_jobs() if job.result is not None]
+        if failed_jobs:
+            st.warning(
+                f"{sum(len(job.failed()) for job in failed_jobs)} Abschnitte von {len(failed_jobs)} Dateien konnten nicht zusammengefasst werden."
+            )
+            if st.button("Fehlgeschlagene Abschnitte wiederholen"):
+                self.start_budget()
+                with st.spinner("Generiere Zusammenfassung..."):
+                    self.retry_failed_chunks(st.empty())
+                self.show_budget_warning()
+        if len(self.results) > 0:
+            st.markdown('---')
+            with st.expander('Verwendete Tokens'):
+                st.markdown(self.token_use_expression())
+            for result in self.results:
+                show_summary_text_field(result)
@@ -0,0 +1,221 @@
+import csv
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+# the store keeps the latest calls only, older records are dropped
+MAX_RECORDS = 100000
+PERCENTILES = [50, 95, 99]
+FIELDS = [
+    "timestamp",
+    "tool",
+    "model",
+    "operation",
+    "latency",
+    "ttft",
+    "retries",
+    "tokens_in",
+    "tokens_out",
+    "outcome",
+]
+OUTCOME_OK = "ok"
+OUTCOME_CACHED = "cached"
+OUTCOME_ERROR = "error"
+METRIC_PREFIX = "data_alchemy_llm"
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+
+class TelemetryStore:
+    """
+    In-memory store of outbound API calls. Recording a call only appends a
+    tuple to a bounded deque, aggregation is done when the data is read.
+    """
+
+    def __init__(self, max_records: int = MAX_RECORDS):
+        self._records = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        tool: str,
+        model: str,
+        operation: str,
+        latency: float,
+        retries: int = 0,
+        tokens_in: int = 0,
+        tokens_out: int = 0,
+        outcome: str = OUTCOME_OK,
+        ttft: float = None,
+    ):
+        """
+        Records one API call.
+
+        Args:
+            tool (str): Name of the calling tool.
+            model (str): The model used.
+            operation (str): The endpoint, e.g. chat, images or moderation.
+            latency (float): Duration of the call in seconds, including
+                retries.
+            retries (int, optional): Number of failed attempts before the call
+                succeeded or gave up.
+            tokens_in (int, optional): Prompt tokens.
+            tokens_out (int, optional): Completion tokens.
+            outcome (str, optional): OUTCOME_OK, OUTCOME_CACHED or
+                OUTCOME_ERROR.
+            ttft (float, optional): Time to first token of streamed calls.
+        """
+        with self._lock:
+            self._records.append(
+                (
+                    time.time(),
+                    tool,
+                    model,
+                    operation,
+                    latency,
+                    ttft,
+                    retries,
+                    tokens_in,
+                    tokens_out,
+                    outcome,
+                )
+            )
+
+    @contextmanager
+    def track(self, tool: str, model: str, operation: str):
+        """
+        Records the duration of the enclosed call. Tokens and retries can be
+        set on the yielded dict, an exception is recorded as error and
+        raised again.
+
+        Example:
+            with get_telemetry().track("Imagegen", "dall-e-3", "images") as call:
+                response = client.images.generate(...)
+        """
+        call = {"retries": 0, "tokens_in": 0, "tokens_out": 0, "outcome": OUTCOME_OK}
+        start = time.perf_counter()
+        try:
+            yield call
+        except Exception:
+            call["outcome"] = OUTCOME_ERROR
+            raise
+        finally:
+            self.record(
+                tool,
+                model,
+                operation,
+                time.perf_counter() - start,
+                retries=call["retries"],
+                tokens_in=call["tokens_in"],
+                tokens_out=call["tokens_out"],
+                outcome=call["outcome"],
+            )
+
+    def __len__(self):
+        return len(self._records)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def to_dataframe(self) -> pd.DataFrame:
+        with self._lock:
+            records = list(self._records)
+        return pd.DataFrame(records, columns=FIELDS)
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Aggregates the calls per tool, model, operation and outcome.
+
+        Returns:
+            pd.DataFrame: Number of calls, retries, tokens and the latency
+            percentiles in seconds.
+        """
+        df = self.to_dataframe()
+        keys = ["tool", "model", "operation", "outcome"]
+        if len(df) == 0:
+            return pd.DataFrame(
+                columns=keys
+                + ["calls", "retries", "tokens_in", "tokens_out"]
+                + [f"p{p}" for p in PERCENTILES]
+            )
+        rows = []
+        for key, group in df.groupby(keys, sort=True):
+            quantiles = np.percentile(group["latency"].to_numpy(), PERCENTILES)
+            rows.append(
+                list(key)
+                + [
+                    len(group),
+                    int(group["retries"].sum()),
+                    int(group["tokens_in"].sum()),
+                    int(group["tokens_out"].sum()),
+                ]
+                + list(quantiles)
+            )
+        return pd.DataFrame(
+            rows,
+            columns=keys
+            + ["calls", "retries", "tokens_in", "tokens_out"]
+            + [f"p{p}" for p in PERCENTILES],
+        )
+
+    def to_prometheus(self) -> str:
+        """Returns the aggregated calls in the Prometheus text format."""
+        summary = self.summary()
+        lines = [
+            f"# HELP {METRIC_PREFIX}_latency_seconds Latency of API calls.",
+            f"# TYPE {METRIC_PREFIX}_latency_seconds summary",
+        ]
+        counters = {
+            "retries_total": "Failed attempts that were retried.",
+            "tokens_in_total": "Prompt tokens.",
+            "tokens_out_total": "Completion tokens.",
+        }
+        for _, row in summary.iterrows():
+            labels = prometheus_labels(row)
+            for p in PERCENTILES:
+                lines.append(
+                    f'{METRIC_PREFIX}_latency_seconds{{{labels},quantile="{p / 100}"}} {row[f"p{p}"]:.6f}'
+                )
+            lines.append(f"{METRIC_PREFIX}_latency_seconds_count{{{labels}}} {row['calls']}")
+        for name, help_text in counters.items():
+            column = name.removesuffix("_total")
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} counter")
+            for _, row in summary.iterrows():
+                lines.append(
+                    f"{METRIC_PREFIX}_{name}{{{prometheus_labels(row)}}} {row[column]}"
+                )
+        return "\n".join(lines) + "\n"
+
+    def to_csv(self, file_name: str):
+        """Writes all recorded calls to a csv file."""
+        with self._lock:
+            records = list(self._records)
+        with open(file_name, "w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file, delimiter=";")
+            writer.writerow(FIELDS)
+            writer.writerows(records)
+
+
+def prometheus_labels(row) -> str:
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return ",".join(
+        f'{key}="{escape(row[key])}"' for key in ("tool", "model", "operation", "outcome")
+    )
+
+
+def get_telemetry() -> TelemetryStore:
+    """Returns the process wide telemetry store."""
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is None:
+            _telemetry = TelemetryStore()
+        return _telemetry
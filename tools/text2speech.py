@@ -2,10 +2,10 @@ import os
 from enum import Enum
 
 import streamlit as st
-from openai import OpenAI
 
 from helper import get_var, extract_text_from_file
 from tools.tool_base import ToolBase, TEMP_PATH, OUTPUT_PATH, DEMO_PATH
+from tools.llm_client import get_client
 
 DEMO_FILE = DEMO_PATH + "000000406031.pdf"
 TEMP_FILE = TEMP_PATH + "temp_audio."
@@ -54,8 +54,9 @@ class Text2Speech(ToolBase):
             st.info("Diese Option ist noch nicht verfügbar.")
 
     def convert2audio(self, text: str) -> str:
-        client = OpenAI()
-        response = client.audio.speech.create(model="tts-1", voice="alloy", input=text)
+        client = get_client()
+        with self.track("audio.speech", model="tts-1"):
+            response = client.audio.speech.create(model="tts-1", voice="alloy", input=text)
         
         # Assuming response.content contains the binary audio data
         with open(OUTPUT_FILE, "wb") as file:
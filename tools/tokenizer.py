@@ -14,7 +14,8 @@ from tools.tool_base import (
     MODEL_TOKEN_PRICING,
     DEMO_PATH,
     LOGFILE,
-    DEFAULT_MODEL
+    DEFAULT_MODEL,
+    get_encoding,
 )
 
 nltk.download("punkt")
@@ -76,14 +77,19 @@ def split_text(
     expected_completion_tokens: int = 1000,
 ):
     """
-    Splits a given text into chunks of sentences, where each chunk has a maximum size of chunk_size.
+    Splits a given text into chunks of lines, where each chunk has a maximum size of chunk_size.
+    Lines longer than a chunk are split into sentences, sentences longer than a chunk
+    into pieces of the maximum size.
 
     Args:
         text (str): The text to be split.
-        chunk_size (int, optional): The maximum size of each chunk. Defaults to 2048.
+        system_prompt (str, optional): System prompt sent with every chunk.
+        model_name (str, optional): Model of the tokenizer.
+        max_tokens_per_chunk (int, optional): Context size of a request.
+        expected_completion_tokens (int, optional): Tokens reserved for the answer.
 
     Returns:
-        list: A list of chunks, where each chunk is a string of sentences.
+        list: A list of chunks, where each chunk is a string of lines ending with a line break.
     """
     chunks = []
     current_chunk = ""
@@ -94,7 +100,14 @@ def split_text(
     )
     for line in text.split("\n"):
         line_token_count = len(calc_tokens(line, model_name))
-        if current_token_count + line_token_count > max_tokens_per_chunk:
+        if line_token_count > max_tokens_per_chunk:
+            if current_chunk:
+                chunks.append(current_chunk)
+            pieces = split_line(line, model_name, max_tokens_per_chunk)
+            chunks.extend(piece + "\n" for piece in pieces[:-1])
+            current_chunk = pieces[-1] + "\n"
+            current_token_count = len(calc_tokens(pieces[-1], model_name))
+        elif current_token_count + line_token_count > max_tokens_per_chunk and current_chunk:
             chunks.append(current_chunk)
             current_chunk = line + "\n"
             current_token_count = line_token_count
@@ -108,6 +121,32 @@ def split_text(
     return chunks
 
 
+def split_line(line: str, model_name, max_tokens: int) -> list:
+    """Splits a line longer than max_tokens into pieces of whole sentences if possible."""
+    encoding = get_encoding(model_name)
+    pieces = []
+    current_piece = ""
+    for sentence in sent_tokenize(line):
+        tokens = encoding.encode(sentence)
+        if len(tokens) > max_tokens:
+            if current_piece:
+                pieces.append(current_piece)
+                current_piece = ""
+            pieces.extend(
+                encoding.decode(tokens[start : start + max_tokens])
+                for start in range(0, len(tokens), max_tokens)
+            )
+            continue
+        candidate = f"{current_piece} {sentence}" if current_piece else sentence
+        if current_piece and len(encoding.encode(candidate)) > max_tokens:
+            pieces.append(current_piece)
+            candidate = sentence
+        current_piece = candidate
+    if current_piece:
+        pieces.append(current_piece)
+    return pieces or [line]
+
+
 class Tokenizer(ToolBase):
     def __init__(self, logger):
         super().__init__(logger)
@@ -1,9 +1,39 @@
 import streamlit as st
+import os
 import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from helper import get_var
-from openai import OpenAI
+from tools.llm_client import get_client, HTTP_TIMEOUT
+from openai import RateLimitError
+from tools.llm_cache import get_response_cache
+from tools.rate_limiter import (
+    get_rate_limiter,
+    estimate_tokens,
+    is_retryable,
+    retry_after,
+    backoff_delay,
+)
+from tools.planner import CostPlan
+from tools.telemetry import (
+    get_telemetry,
+    OUTCOME_OK,
+    OUTCOME_CACHED,
+    OUTCOME_ERROR,
+)
+from tools.batch import (
+    EXECUTION_MODE_OPTIONS,
+    BACKENDS,
+    DEFAULT_BACKEND,
+    list_jobs,
+)
 import tiktoken
 import json
+import numpy as np
+from functools import lru_cache
 
 # import boto3
 
@@ -17,20 +47,35 @@ UPLOAD_PATH = './data/uploads/'
 DOCS_PATH = DEMO_PATH + 'docs/'
 ENCODING_OPTIONS = ['utf-8', 'latin1', 'cp1252']
 LOGFILE = './data-alchemy-toolbox.log'
-SLEEP_TIME_AFTER_ERROR = 30
 DEFAULT_TEMPERATURE = 0.3
 DEFAULT_MAX_TOKENS = 500
+DEFAULT_MAX_CONCURRENCY = 8
+MAX_TIMINGS = 1000
+MAX_CONCURRENCY_LIMIT = 32
 MODEL_OPTIONS = ['gpt-4o']
 DEFAULT_MODEL = MODEL_OPTIONS[0]
 MODEL_TOKEN_PRICING = {
     MODEL_OPTIONS[0]: {'in': 0.0015, 'out': 0.002},
-
+    'gpt-4o-mini': {'in': 0.00015, 'out': 0.0006},
+    'text-embedding-3-small': {'in': 0.00002, 'out': 0.0},
 }
+EMBEDDING_MODEL = 'text-embedding-3-small'
+# inputs per embeddings request
+EMBEDDING_BATCH_SIZE = 256
 IMAGE_PATH = './assets/images/'
 MODEL_MAX_TOKENS = {MODEL_OPTIONS[0]: 128000}
 DEV_WORKSTATIONS = ['Liestal']
 
 
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """Returns the tiktoken encoding of a model, loaded once per process."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
 class ToolBase:
     def __init__(self, logger):
         self.logger = logger
@@ -39,6 +84,26 @@ class ToolBase:
         self.model = MODEL_OPTIONS[0]
         self.tokens_in = 0
         self.tokens_out = 0
+        self.max_concurrency = DEFAULT_MAX_CONCURRENCY
+        self.use_cache = True
+        self.execution_mode = EXECUTION_MODE_OPTIONS[0]
+        self.batch_backend = DEFAULT_BACKEND
+        self.cached_tokens_in = 0
+        self.cached_tokens_out = 0
+        self.embedding_tokens = 0
+        self._tokens_lock = threading.Lock()
+        self.timings = deque(maxlen=MAX_TIMINGS)
+        # cost limit of a job in USD, 0 means no limit
+        self.budget = 0.0
+        self.budget_exceeded = False
+        self._budget_start_cost = 0.0
+        # attempts and read timeout of a completion request
+        self.llm_retries = LLM_RETRIES
+        self.request_timeout = HTTP_TIMEOUT
+        # index -> reason of the last failed completion of a text
+        self.failed_calls = {}
+        # reason why the last streamed response failed or is incomplete
+        self.stream_error = None
 
     def chunk_size(self):
         return MODEL_MAX_TOKENS[self.model]
@@ -53,6 +118,90 @@ class ToolBase:
 
         )
 
+    def get_max_concurrency(self):
+        return st.number_input(
+            "Parallele Anfragen",
+            min_value=1,
+            max_value=MAX_CONCURRENCY_LIMIT,
+            value=self.max_concurrency,
+            step=1,
+            help="Anzahl Anfragen, die gleichzeitig an das LLM geschickt werden. Höhere Werte beschleunigen grosse Aufträge, können aber die Rate-Limits des Anbieters erreichen.",
+        )
+
+    def get_use_cache(self):
+        return st.checkbox(
+            "Antworten-Cache verwenden",
+            value=self.use_cache,
+            help="Identische Anfragen (gleiches Modell, gleicher Prompt und Text) werden aus dem lokalen Cache beantwortet und nicht erneut verrechnet. Deaktiviere den Cache, um neue Antworten zu erzwingen.",
+        )
+
+    def get_budget(self):
+        return st.number_input(
+            "Budget (USD)",
+            min_value=0.0,
+            value=float(self.budget),
+            step=0.5,
+            format="%.2f",
+            help="Maximale Kosten eines Auftrags. Wird das Budget erreicht, werden keine weiteren Anfragen gestartet und die bis dahin erhaltenen Resultate gespeichert. 0 bedeutet kein Limit.",
+        )
+
+    def get_execution_mode(self):
+        """
+        Shows the selection of the execution mode. In batch mode all requests
+        are submitted as one asynchronous batch job, which is cheaper and
+        suited for very large inputs, but results can take up to 24 hours.
+        """
+        self.execution_mode = st.radio(
+            "Ausführungsmodus",
+            options=EXECUTION_MODE_OPTIONS,
+            index=EXECUTION_MODE_OPTIONS.index(self.execution_mode),
+            help="Im Batch-Modus werden alle Anfragen als ein Auftrag eingereicht. Die Verarbeitung ist günstiger, kann aber bis zu 24 Stunden dauern. Der Status kann jederzeit geprüft werden, auch nach einem Neustart der App.",
+        )
+        if self.is_batch_mode():
+            backends = list(BACKENDS.keys())
+            self.batch_backend = st.selectbox(
+                "Batch-Backend",
+                options=backends,
+                index=backends.index(self.batch_backend),
+            )
+
+    def is_batch_mode(self):
+        return EXECUTION_MODE_OPTIONS.index(self.execution_mode) == 1
+
+    def show_batch_jobs(self, merge):
+        """
+        Lists the batch jobs of the tool. Pending jobs can be polled, completed
+        jobs are merged with the merge function once and can be downloaded.
+
+        Args:
+            merge (callable): Called with the completed BatchJob, returns the
+                path of the merged output file.
+        """
+        jobs = list_jobs(self.__class__.__name__)
+        if len(jobs) == 0:
+            return
+        st.markdown("**Batch-Jobs**")
+        for job in jobs:
+            cols = st.columns([3, 1, 1])
+            with cols[0]:
+                st.markdown(f"{job.job_id} ({job.created}): **{job.status}**")
+            with cols[1]:
+                if not job.merged and st.button("Status prüfen", key=f"poll_{job.job_id}"):
+                    if job.poll() == "completed":
+                        job.output_file = merge(job)
+                        job.merged = True
+                        job.save()
+                        st.rerun()
+            with cols[2]:
+                if job.merged and job.output_file and os.path.exists(job.output_file):
+                    with open(job.output_file, "rb") as fp:
+                        st.download_button(
+                            label="Herunterladen",
+                            data=fp,
+                            file_name=os.path.basename(job.output_file),
+                            key=f"download_{job.job_id}",
+                        )
+
     def get_intro(self):
         """
         Reads the markdown content from a file with the same name as the script and returns it.
@@ -69,11 +218,114 @@ class ToolBase:
         cost_tokens_out = (
             MODEL_TOKEN_PRICING[self.model]["out"] * self.tokens_out / 1000
         )
-        return f"""
+        expression = f"""
             Tokens in: {self.tokens_in} Kosten: ${cost_tokens_in: .2f}\n
             Tokens out: {self.tokens_out} Kosten: ${cost_tokens_out: .2f}\n
             Total Tokens: {self.tokens_in + self.tokens_out} Kosten: ${(cost_tokens_in + cost_tokens_out): .2f}
             """
+        if self.embedding_tokens > 0:
+            expression += f"""\n
+            Embedding Tokens: {self.embedding_tokens} Kosten: ${self.embedding_cost(): .4f}
+            """
+        if self.cached_tokens_in + self.cached_tokens_out > 0:
+            saved = (
+                MODEL_TOKEN_PRICING[self.model]["in"] * self.cached_tokens_in
+                + MODEL_TOKEN_PRICING[self.model]["out"] * self.cached_tokens_out
+            ) / 1000
+            expression += f"""\n
+            Tokens aus Cache (nicht verrechnet): in {self.cached_tokens_in}, out {self.cached_tokens_out}, Einsparung: ${saved: .2f}
+            """
+        return expression
+
+    def cost(self) -> float:
+        """Returns the cost in USD of the tokens used so far."""
+        pricing = MODEL_TOKEN_PRICING[self.model]
+        return (
+            pricing["in"] * self.tokens_in + pricing["out"] * self.tokens_out
+        ) / 1000 + self.embedding_cost()
+
+    def embedding_cost(self) -> float:
+        return MODEL_TOKEN_PRICING[EMBEDDING_MODEL]["in"] * self.embedding_tokens / 1000
+
+    def start_budget(self):
+        """Starts a new job, the budget applies to the cost from now on."""
+        self._budget_start_cost = self.cost()
+        self.budget_exceeded = False
+
+    def budget_reached(self) -> bool:
+        return self.budget > 0 and self.cost() - self._budget_start_cost >= self.budget
+
+    def new_cost_plan(self) -> CostPlan:
+        return CostPlan(self.model, MODEL_TOKEN_PRICING[self.model])
+
+    def plan_completions(
+        self,
+        texts: list,
+        system_prompt: str = None,
+        tokens_out: list = None,
+        output_ratio: float = None,
+        plan: CostPlan = None,
+    ) -> CostPlan:
+        """
+        Adds one request per text to a cost plan. The texts are tokenised in
+        one batch, the system prompt is counted once and added to every
+        request.
+
+        Args:
+            texts (list): The user inputs.
+            system_prompt (str, optional): Defaults to self.system_prompt.
+            tokens_out (list, optional): Expected completion tokens per text.
+                Defaults to self.max_tokens.
+            output_ratio (float, optional): Expected completion tokens as a
+                multiple of the text tokens, e.g. for translations. Takes
+                precedence over tokens_out.
+            plan (CostPlan, optional): The plan to extend. A new plan is
+                created if None.
+
+        Returns:
+            CostPlan: The plan.
+        """
+        if plan is None:
+            plan = self.new_cost_plan()
+        texts = list(texts)
+        if len(texts) == 0:
+            return plan
+        system_prompt = system_prompt or self.system_prompt
+        system_tokens = self.count_tokens([system_prompt])[0]
+        text_tokens = self.count_tokens(texts)
+        if output_ratio is not None:
+            tokens_out = [
+                min(int(tokens * output_ratio), self.max_tokens)
+                for tokens in text_tokens
+            ]
+        elif tokens_out is None:
+            tokens_out = [self.max_tokens] * len(texts)
+        plan.add(
+            sum(text_tokens) + system_tokens * len(texts),
+            sum(tokens_out),
+            requests=len(texts),
+        )
+        return plan
+
+    def estimate_cost(self) -> CostPlan:
+        """Returns the cost plan of the current input, None if not supported."""
+        return None
+
+    def show_cost_plan(self, plan: CostPlan):
+        """Shows the expected requests, tokens, cost and duration of a job."""
+        if plan is None:
+            return
+        st.table(plan.to_dataframe(self.max_concurrency).set_index("Kennzahl"))
+        if self.budget > 0 and plan.cost > self.budget:
+            st.warning(
+                f"Die geschätzten Kosten (${plan.cost:.2f}) übersteigen das Budget (${self.budget:.2f}). Der Auftrag wird beim Erreichen des Budgets abgebrochen."
+            )
+
+    def show_budget_warning(self):
+        if self.budget_exceeded:
+            st.warning(
+                f"Das Budget von ${self.budget:.2f} wurde erreicht, der Auftrag wurde vorzeitig beendet. Die bis dahin erhaltenen Resultate wurden gespeichert."
+            )
 
     def num_tokens_from_string(string: str, encoding_name: str) -> int:
         """Returns the number of tokens in a text string."""
@@ -81,53 +333,445 @@ class ToolBase:
         num_tokens = len(encoding.encode(string))
         return num_tokens
 
+    def count_tokens(self, texts: list) -> list:
+        """Returns the number of tokens of each text for the tool's model."""
+        encoding = get_encoding(self.model)
+        return [len(tokens) for tokens in encoding.encode_ordinary_batch(list(texts))]
+
     def add_tokens(self, tokens: list):
         if tokens:
             self.tokens_in += tokens[0]
             self.tokens_out += tokens[1]
 
-    def get_completion(self, text: str, index: int = 0):
+    def add_cached_tokens(self, tokens: list):
+        with self._tokens_lock:
+            self.cached_tokens_in += tokens[0]
+            self.cached_tokens_out += tokens[1]
+
+    def report(self, message: str, level: int = logging.INFO):
+        """
+        Shows a message in the app. Without a Streamlit session, e.g. when the
+        tool runs from the command line, the message is logged.
+
+        Args:
+            message (str): The message.
+            level (int, optional): logging.INFO, logging.WARNING or
+                logging.ERROR.
+        """
+        if get_script_run_ctx(suppress_warning=True) is None:
+            self.logger.log(level, message)
+        elif level >= logging.ERROR:
+            st.error(message)
+        elif level >= logging.WARNING:
+            st.warning(message)
+        else:
+            st.markdown(message)
+
+    def record_timing(self, ttft: float, total: float):
+        """
+        Records time to first token and total time of a call in seconds. For
+        calls without streaming both values are the same.
+        """
+        self.timings.append({"ttft": ttft, "total": total})
+
+    def timing_expression(self):
+        if len(self.timings) == 0:
+            return ""
+        timing = self.timings[-1]
+        return f"Erstes Token nach {timing['ttft']:.2f}s, Total {timing['total']:.2f}s"
+
+    def track(self, operation: str, model: str = None):
+        """
+        Context manager recording an API call of the tool in the telemetry
+        store, see TelemetryStore.track.
+        """
+        return get_telemetry().track(
+            self.__class__.__name__, model or self.model, operation
+        )
+
+    def record_call(
+        self,
+        latency: float,
+        retries: int,
+        tokens: list,
+        outcome: str,
+        ttft: float = None,
+    ):
+        """Records a chat completion of the tool in the telemetry store."""
+        get_telemetry().record(
+            self.__class__.__name__,
+            self.model,
+            "chat",
+            latency,
+            retries=retries,
+            tokens_in=tokens[0] if tokens else 0,
+            tokens_out=tokens[1] if tokens else 0,
+            outcome=outcome,
+            ttft=ttft,
+        )
+
+    def get_completion(
+        self,
+        text: str,
+        index: int = 0,
+        system_prompt: str = None,
+        use_cache: bool = None,
+        max_tokens: int = None,
+        response_format: dict = None,
+    ):
         """Generates a response using the OpenAI ChatCompletion API based on
-        the given text.
+        the given text. Responses are looked up in and stored to the response
+        cache unless caching is disabled. Cached responses report zero billed
+        tokens, their original usage is added to the cached token counters.
+        If the request fails, the reason is stored in failed_calls under the
+        index of the text.
 
         Args:
             text (str): The user's input.
+            index (int, optional): Index of the text, used in error messages.
+            system_prompt (str, optional): System prompt for this call.
+                Defaults to self.system_prompt.
+            use_cache (bool, optional): Bypass the cache if False. Defaults
+                to self.use_cache.
+            max_tokens (int, optional): Completion token limit for this call.
+                Defaults to self.max_tokens.
+            response_format (dict, optional): Format of the response, e.g.
+                {"type": "json_object"}. Defaults to plain text.
 
         Returns:
-            str: The generated response.
+            tuple: The generated response and the tokens [in, out] of the
+            request, ("", [0, 0]) if the request failed.
 
         Raises:
             None
         """
-        client = OpenAI(
-            api_key=get_var("OPENAI_API_KEY"),
-        )
-        retries = LLM_RETRIES
-        while retries > 0:
+        system_prompt = system_prompt or self.system_prompt
+        max_tokens = max_tokens or self.max_tokens
+        if use_cache is None:
+            use_cache = self.use_cache
+        call_start = time.perf_counter()
+        if use_cache:
+            cache = get_response_cache()
+            cache_key = cache.make_key(
+                self.model, system_prompt, text, self.temperature, max_tokens, response_format
+            )
+            cached = cache.get(cache_key)
+            if cached is not None:
+                self.add_cached_tokens(cached[1])
+                self.record_call(time.perf_counter() - call_start, 0, None, OUTCOME_CACHED)
+                return cached[0], [0, 0]
+        client = get_client(timeout=self.request_timeout, max_retries=0)
+        limiter = get_rate_limiter(self.model)
+        estimated_tokens = estimate_tokens(system_prompt, text, max_tokens=max_tokens)
+        options = {} if response_format is None else {"response_format": response_format}
+        attempt = 0
+        while attempt < self.llm_retries:
+            limiter.acquire(estimated_tokens)
+            start = time.perf_counter()
             try:
-                completion = client.chat.completions.create(
+                raw_response = client.chat.completions.with_raw_response.create(
                     model=self.model,
                     messages=[
-                        {"role": "system", "content": self.system_prompt},
+                        {"role": "system", "content": system_prompt},
                         {"role": "user", "content": text},
                     ],
                     temperature=self.temperature,
-                    max_tokens=self.max_tokens,
+                    max_tokens=max_tokens,
+                    **options,
                 )
+                limiter.update_from_headers(raw_response.headers)
+                completion = raw_response.parse()
                 tokens = [
                     completion.usage.prompt_tokens,
                     completion.usage.completion_tokens,
                 ]
-                return completion.choices[0].message.content.strip(), tokens
+                response = completion.choices[0].message.content.strip()
+                duration = time.perf_counter() - start
+                self.record_timing(duration, duration)
+                self.record_call(
+                    time.perf_counter() - call_start, attempt, tokens, OUTCOME_OK
+                )
+                if use_cache and response:
+                    cache.set(cache_key, response, tokens)
+                return response, tokens
+            except Exception as err:
+                attempt += 1
+                if not is_retryable(err) or attempt >= self.llm_retries:
+                    self.report(f"OpenAIError {err}, Index = {index}", logging.ERROR)
+                    self.record_call(
+                        time.perf_counter() - call_start, attempt - 1, None, OUTCOME_ERROR
+                    )
+                    with self._tokens_lock:
+                        self.failed_calls[index] = f"{type(err).__name__}: {err}"
+                    break
+                delay = backoff_delay(attempt, retry_after(err))
+                if isinstance(err, RateLimitError):
+                    limiter.pause(delay)
+                self.logger.warning(
+                    f"OpenAIError {err}, Index = {index}, retry in {delay:.1f}s"
+                )
+                time.sleep(delay)
+        return "", [0, 0]
+
+    def get_completion_stream(
+        self,
+        text: str,
+        system_prompt: str = None,
+        temperature: float = None,
+        max_tokens: int = None,
+        use_cache: bool = None,
+    ):
+        """Streams a response of the OpenAI ChatCompletion API.
+
+        Yields the text deltas as they arrive. When the stream is exhausted,
+        the token usage is added to the tool's counters and the time to first
+        token and the total time are recorded. Cached responses are yielded
+        in one piece. If the request fails or the connection drops during
+        the stream, the stream ends and the reason is stored in
+        stream_error, the response received so far is not cached.
+
+        Args:
+            text (str): The user's input.
+            system_prompt (str, optional): Defaults to self.system_prompt.
+            temperature (float, optional): Defaults to self.temperature.
+            max_tokens (int, optional): Defaults to self.max_tokens.
+            use_cache (bool, optional): Defaults to self.use_cache.
+
+        Yields:
+            str: The next part of the response.
+        """
+        system_prompt = system_prompt or self.system_prompt
+        temperature = self.temperature if temperature is None else temperature
+        max_tokens = max_tokens or self.max_tokens
+        if use_cache is None:
+            use_cache = self.use_cache
+        self.stream_error = None
+        cache = get_response_cache()
+        cache_key = cache.make_key(
+            self.model, system_prompt, text, temperature, max_tokens
+        )
+        call_start = time.perf_counter()
+        if use_cache:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                self.add_cached_tokens(cached[1])
+                self.record_timing(0.0, 0.0)
+                self.record_call(time.perf_counter() - call_start, 0, None, OUTCOME_CACHED)
+                yield cached[0]
+                return
+        client = get_client(timeout=self.request_timeout, max_retries=0)
+        limiter = get_rate_limiter(self.model)
+        estimated_tokens = estimate_tokens(system_prompt, text, max_tokens=max_tokens)
+        attempt = 0
+        while True:
+            limiter.acquire(estimated_tokens)
+            start = time.perf_counter()
+            try:
+                stream = client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": text},
+                    ],
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                break
             except Exception as err:
-                st.error(f"OpenAIError {err}, Index = {index}")
-                retries -= 1
-                time.sleep(SLEEP_TIME_AFTER_ERROR)
-        return "", 0
+                attempt += 1
+                if not is_retryable(err) or attempt >= self.llm_retries:
+                    self.report(f"OpenAIError {err}", logging.ERROR)
+                    self.stream_error = str(err)
+                    self.record_call(
+                        time.perf_counter() - call_start, attempt - 1, None, OUTCOME_ERROR
+                    )
+                    return
+                delay = backoff_delay(attempt, retry_after(err))
+                if isinstance(err, RateLimitError):
+                    limiter.pause(delay)
+                time.sleep(delay)
+
+        ttft = None
+        parts = []
+        tokens = [0, 0]
+        try:
+            for chunk in stream:
+                if chunk.usage is not None:
+                    tokens = [chunk.usage.prompt_tokens, chunk.usage.completion_tokens]
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        except Exception as err:
+            self.report(f"OpenAIError {err}", logging.ERROR)
+            self.stream_error = str(err)
+            self.record_call(
+                time.perf_counter() - call_start, attempt, tokens, OUTCOME_ERROR, ttft=ttft
+            )
+            return
+        total = time.perf_counter() - start
+        self.record_timing(total if ttft is None else ttft, total)
+        self.record_call(
+            time.perf_counter() - call_start, attempt, tokens, OUTCOME_OK, ttft=ttft
+        )
+        self.add_tokens(tokens)
+        response = "".join(parts).strip()
+        if use_cache and response:
+            cache.set(cache_key, response, tokens)
+
+    def run_concurrent(
+        self,
+        func,
+        items: list,
+        max_concurrency: int = None,
+        progress_callback=None,
+    ):
+        """Applies func to every item using a bounded thread pool.
+
+        The progress callback is invoked from the calling thread, so Streamlit
+        elements can be updated from it. If the callback returns False or the
+        budget is reached, items that have not been started yet are cancelled
+        and their result is None.
+
+        Args:
+            func (callable): Function called with a single item.
+            items (list): The items to process.
+            max_concurrency (int, optional): Maximum number of parallel calls.
+                Defaults to self.max_concurrency.
+            progress_callback (callable, optional): Called as
+                progress_callback(done, total, position, result) after each
+                finished item.
+
+        Returns:
+            list: The results of func, in the order of items.
+        """
+        items = list(items)
+        results = [None] * len(items)
+        if len(items) == 0:
+            return results
+        if self.budget_reached():
+            self.budget_exceeded = True
+            return results
+        max_workers = min(max_concurrency or self.max_concurrency, len(items))
+        # workers inherit the script context so st.* calls inside func work
+        ctx = get_script_run_ctx(suppress_warning=True)
+
+        def init_worker():
+            if ctx is not None:
+                add_script_run_ctx(threading.current_thread(), ctx)
+
+        with ThreadPoolExecutor(
+            max_workers=max_workers, initializer=init_worker
+        ) as executor:
+            # only max_workers items are in flight, so a stop takes effect
+            # before the remaining items are sent
+            pending_items = iter(enumerate(items))
+            futures = {}
+
+            def submit_next():
+                for position, item in pending_items:
+                    futures[executor.submit(func, item)] = position
+                    return
+
+            for _ in range(max_workers):
+                submit_next()
+            done = 0
+            proceed = True
+            while futures:
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    position = futures.pop(future)
+                    results[position] = future.result()
+                    done += 1
+                    if progress_callback is not None:
+                        if progress_callback(
+                            done, len(items), position, results[position]
+                        ) is False:
+                            proceed = False
+                    if self.budget_reached():
+                        self.budget_exceeded = True
+                        proceed = False
+                    if proceed:
+                        submit_next()
+        return results
+
+    def get_completions(
+        self,
+        texts: list,
+        max_concurrency: int = None,
+        progress_callback=None,
+        system_prompt: str = None,
+        indices: list = None,
+    ):
+        """Runs get_completion for a list of texts in parallel.
+
+        Token usage of every completed item is added to the tool's counters
+        before the progress callback is called, so running totals are
+        available while the batch is processed.
+
+        Args:
+            texts (list): The user inputs.
+            max_concurrency (int, optional): Maximum number of parallel
+                requests. Defaults to self.max_concurrency.
+            progress_callback (callable, optional): See run_concurrent.
+            system_prompt (str, optional): System prompt used for all texts.
+                Defaults to self.system_prompt.
+            indices (list, optional): Index reported for each text in error
+                messages. Defaults to the position in texts.
+
+        Returns:
+            list: (response, tokens) tuples in input order, None for items
+            cancelled by the progress callback.
+        """
+        if indices is None:
+            indices = range(len(texts))
+
+        def complete(item):
+            text, index = item
+            return self.get_completion(text, index, system_prompt=system_prompt)
+
+        def on_progress(done, total, position, result):
+            self.add_tokens(result[1])
+            if progress_callback is not None:
+                return progress_callback(done, total, position, result)
+
+        return self.run_concurrent(
+            complete,
+            list(zip(texts, indices)),
+            max_concurrency=max_concurrency,
+            progress_callback=on_progress,
+        )
+
+    def get_embeddings(self, texts: list, model: str = EMBEDDING_MODEL) -> np.ndarray:
+        """
+        Embeds the texts in one request. Callers split longer lists into
+        batches of EMBEDDING_BATCH_SIZE texts.
+
+        Args:
+            texts (list): The texts, must not be empty strings.
+            model (str, optional): The embedding model.
+
+        Returns:
+            np.ndarray: One L2 normalised float32 row per text, so the dot
+            product of two rows is their cosine similarity.
+        """
+        client = get_client()
+        with self.track("embeddings", model=model) as call:
+            response = client.embeddings.create(model=model, input=list(texts))
+            call["tokens_in"] = response.usage.prompt_tokens
+        with self._tokens_lock:
+            self.embedding_tokens += response.usage.prompt_tokens
+        vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
 
     def usage_compliance_check(self, text: str):
-        client = OpenAI()
-        response = client.moderations.create(input=text)
+        client = get_client()
+        with self.track("moderation", model="omni-moderation-latest"):
+            response = client.moderations.create(input=text)
         return response.model_dump()
 
     def show_settings(self):
@@ -1,6 +1,10 @@
 import os
 import json
+import time
+import hashlib
+import logging
 from enum import Enum
+from datetime import datetime
 
 import streamlit as st
 import pandas as pd
@@ -12,13 +16,122 @@ from helper import (
     extract_text_from_uploaded_file,
 )
 from tools.tool_base import ToolBase, DEMO_PATH, OUTPUT_PATH
+from tools.batch import BATCH_PATH, build_request, submit_batch
+from tools.planner import TRANSLATION_OUTPUT_RATIO
+from tools.input_reader import table_from_upload, PREVIEW_ROWS
+from tools.tokenizer import split_text
+from tools.translation_memory import get_translation_memory, DEFAULT_FUZZY_THRESHOLD
 
 SYSTEM_PROMPT_TEMPLATE = 'You will translate a user text from {} to {}. Only return the translated text, nothing else. If the input is a list, format the output as as list as well.'
 USER_PROMPT = 'Translate the following text: {}'
+PACKED_SYSTEM_PROMPT_TEMPLATE = 'You will translate the values of a JSON object from {} to {}. Return a JSON object with the same keys and the translated values, nothing else. Do not translate the keys. If a value is a list, translate every item and return a list with the same number of items.'
+PACKED_USER_PROMPT = 'Translate the values of the following JSON object: {}'
+# prepended to the prompt of a pack with similar segments in the translation memory
+PACKED_REFERENCE_PROMPT = 'Similar texts were translated before, use the same terms and style: {}\n\n'
+# upper limit for the values in one packed request, keeps single failures cheap
+MAX_PACK_INPUT_TOKENS = 1500
+MAX_PACK_SIZE = 100
+DEFAULT_PACK_SIZE = 50
+# tokens of the key, quotes and separators of a value in the json object
+PACK_VALUE_OVERHEAD = 8
+# completion limit of a pack as multiple of its tokens, translations into
+# other scripts need more tokens than the source
+PACK_OUTPUT_FACTOR = 2.0
+# prepended to the prompt of a text with a similar segment in the translation memory
+REFERENCE_PROMPT = 'A similar text was translated before, use the same terms and style.\nText: {}\nTranslation: {}\n\n'
+# token budget of a document chunk, its translation must fit into the
+# completion limit, see PACK_OUTPUT_FACTOR
+DOCUMENT_CHUNK_TOKENS = 1500
+# characters at the end of the previous chunk sent as context with a chunk
+CONTEXT_CHARS = 300
+CONTEXT_PROMPT = 'The text continues the following passage. It is context only, do not translate it: {}\n\n'
+FAILED_CHUNK_TEXT = '[Abschnitt {} konnte nicht übersetzt werden]'
+# key of the translated multi-lang json file with the fingerprints of the
+# source values each target language was translated from, the fingerprints
+# are downloaded with the translations
+FINGERPRINTS_KEY = '_fingerprints'
+TRANSLATION_SUFFIX = '_translation'
+CHANGE_NEW = 'neu'
+CHANGE_MODIFIED = 'geändert'
+CHANGE_PENDING = 'nicht übersetzt'
 DEMO_FILE = DEMO_PATH + 'demo_summary.txt'
 FILE_FORMAT_OPTIONS = ['txt', 'pdf', 'json']
 
 
+def normalize_json_value(text: str):
+    """Returns the value of a json text, the text itself if it is no json."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return text
+
+
+def rows_progress_expression(done: int, total: int, seconds: float) -> str:
+    """Progress of a table translation with rows/s and remaining time, the time is unknown until a row is done."""
+    if done == 0:
+        return f"0 von {total} Zeilen übersetzt, verbleibend ca. –"
+    rate = done / max(seconds, 1e-6)
+    remaining = max(total - done, 0) / rate
+    return (
+        f"{done} von {total} Zeilen übersetzt, {rate:.1f} Zeilen/s, "
+        f"verbleibend ca. {remaining // 60:.0f} min {remaining % 60:.0f} s"
+    )
+
+
+def is_valid_translation(value, translation) -> bool:
+    """True if translation is a text for a text or a list of texts with the same length for a list."""
+    if isinstance(value, list):
+        return (
+            isinstance(translation, list)
+            and len(translation) == len(value)
+            and all(isinstance(item, str) for item in translation)
+        )
+    return isinstance(translation, str)
+
+
+def fingerprint(value) -> str:
+    """Returns a short hash of a json value."""
+    content = json.dumps(value, ensure_ascii=False, sort_keys=True)
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def source_fingerprints(section: dict) -> dict:
+    """Returns the fingerprint of every value of a section, a list of fingerprints for list values."""
+    return {
+        key: [fingerprint(item) for item in value] if type(value) == list else fingerprint(value)
+        for key, value in section.items()
+    }
+
+
+def source_stem(json_file_name: str) -> str:
+    """Returns the name of the source file without extension, also for the translated file of an earlier run."""
+    return os.path.splitext(os.path.basename(json_file_name))[0].removesuffix(TRANSLATION_SUFFIX)
+
+
+def compare_fingerprints(current, previous):
+    """
+    Compares the fingerprints of a value with the fingerprints of the last
+    translation.
+
+    Returns:
+        The change: None if the value is unchanged, CHANGE_NEW or
+        CHANGE_MODIFIED for a text, for a list the positions of the new and
+        changed items, CHANGE_MODIFIED if items were removed.
+    """
+    if previous is None:
+        return CHANGE_NEW
+    if type(current) != list or type(previous) != list:
+        return None if current == previous else CHANGE_MODIFIED
+    positions = [
+        position
+        for position, item in enumerate(current)
+        if position >= len(previous) or previous[position] != item
+    ]
+    if positions:
+        return positions
+    return None if len(current) == len(previous) else CHANGE_MODIFIED
+
+
 class InputFormat(Enum):
     DEMO = 0
     FILE = 1
@@ -48,15 +161,40 @@ class Translation(ToolBase):
         self.output = None
         self.separator = ';'
         self.data = None
+        # uploaded key value pairs, read in chunks
+        self.data_source = None
+        self.row_count = 0
+        self.failed_rows = 0
         self.system_prompt = None
+        # source chunks of a document, their translations (None if failed or
+        # cancelled) and the languages, see translate_document
+        self.document_chunks = []
+        self.chunk_translations = []
+        self.document_langs = None
+        # fingerprints stored in the uploaded json file, see get_changed_items
+        self.fingerprints = None
+        # target language -> key -> change since the last translation
+        self.changes = {}
+        self._current_fingerprints = {}
+        self._section_fingerprints = None
+        # changed keys of a json file translated in one request
+        self.pack_size = DEFAULT_PACK_SIZE
+        self.use_tm = True
+        self.tm_fuzzy_threshold = DEFAULT_FUZZY_THRESHOLD
+        # fuzzy matches are reused as translation instead of being sent with the text
+        self.tm_reuse_fuzzy = False
+        self.reset_tm_stats()
 
     def set_system_prompt(self, lang_source: str = None, lang_target: str = None):
         if lang_source is None:
             lang_source = self.lang_source
             lang_target = self.lang_target
-        self.system_prompt = SYSTEM_PROMPT_TEMPLATE.format(
-            iso639.to_name(lang_source), iso639.to_name(lang_target)
-        )
+        self.system_prompt = self.get_system_prompt(lang_source, lang_target)
+
+    def get_system_prompt(
+        self, lang_source: str, lang_target: str, template: str = SYSTEM_PROMPT_TEMPLATE
+    ) -> str:
+        return template.format(iso639.to_name(lang_source), iso639.to_name(lang_target))
     
     def parse_json(self):
         def check_keys():
@@ -70,10 +208,35 @@ class Translation(ToolBase):
             return ok
         
         self.data = json.load(self.input_file)
+        # a file translated before carries the fingerprints of its translations
+        self.fingerprints = self.data.pop(FINGERPRINTS_KEY, None)
         return check_keys()
 
+    def json_output_file(self, input_file_name: str) -> str:
+        return OUTPUT_PATH + source_stem(input_file_name) + TRANSLATION_SUFFIX + '.json'
+
     def show_settings(self):
         self.input_type = st.radio('Input Format', options=self.formats)
+        if self.formats.index(self.input_type) in [
+            InputFormat.KEY_VALUE_PAIRS.value,
+            InputFormat.MULTI_LANG_JSON.value,
+        ]:
+            self.max_concurrency = self.get_max_concurrency()
+            self.budget = self.get_budget()
+        if self.formats.index(self.input_type) in [
+            InputFormat.KEY_VALUE_PAIRS.value,
+            InputFormat.MULTI_LANG_JSON.value,
+        ]:
+            self.pack_size = st.number_input(
+                'Einträge pro Anfrage',
+                min_value=1,
+                max_value=MAX_PACK_SIZE,
+                value=self.pack_size,
+                step=1,
+                help='Mehrere Einträge werden als JSON-Objekt in einer Anfrage übersetzt, die Grösse einer Anfrage ist zusätzlich durch die Anzahl Tokens begrenzt. Fehlende oder fehlerhafte Einträge der Antwort werden einzeln übersetzt. Bei 1 wird jeder Eintrag einzeln übersetzt.',
+            )
+        self.use_cache = self.get_use_cache()
+        self.show_tm_settings()
         index_source = list(self.language_dict.keys()).index(self.lang_source)
         index_target = list(self.language_dict.keys()).index(self.lang_target)
         if self.formats.index(self.input_type) != InputFormat.MULTI_LANG_JSON.value:
@@ -124,11 +287,15 @@ class Translation(ToolBase):
                 type=['csv'],
                 help='Lade die Datei hoch, die du übersetzen möchtest.',
             )
+            self.get_execution_mode()
             if self.input_file is not None:
-                self.data = pd.read_csv(self.input_file, sep=self.separator)
-                self.data.columns = ['key', 'value']
+                self.data_source = table_from_upload(
+                    self.input_file, columns=['key', 'value'], sep=self.separator
+                )
                 with st.expander('Schlüssel-Wert-Paare'):
-                    st.dataframe(self.data)
+                    st.dataframe(self.data_source.preview())
+            else:
+                self.data_source = None
         elif self.formats.index(self.input_type) == InputFormat.MULTI_LANG_JSON.value:
             if self.input_file:
                 if self.parse_json():
@@ -136,6 +303,11 @@ class Translation(ToolBase):
                         st.write(self.data['source'])
                     st.markdown(f'Übersetze von: {list(self.data.keys())[1]}')
                     st.markdown(f'Übersetze nach: {", ".join(list(self.data.keys())[2:])}')
+                    changed_items = self.get_changed_items()
+                    with st.expander(f'Änderungen seit der letzten Übersetzung ({len(changed_items)})'):
+                        if self.fingerprints is None:
+                            st.caption('Die Datei enthält keine Fingerprints, alle nicht übersetzten Einträge sind ausstehend. Die übrigen Werte werden mit dem Abschnitt der Quellsprache verglichen.')
+                        st.dataframe(self.changes_df(), hide_index=True)
                 else:
                     st.warning("Die json Datei hat Fehler, bitte überprüfe das Format")
         else:
@@ -146,39 +318,383 @@ class Translation(ToolBase):
         values = [lang["name"] for lang in iso639.data if lang["iso639_1"] != ""]
         return dict(zip(keys, values))
 
+    def show_tm_settings(self):
+        self.use_tm = st.checkbox(
+            'Translation Memory verwenden',
+            value=self.use_tm,
+            help='Bereits übersetzte Texte werden aus dem lokalen Translation Memory übernommen und nicht erneut übersetzt. Neue Übersetzungen werden im Translation Memory gespeichert.',
+        )
+        if self.use_tm:
+            self.tm_fuzzy_threshold = st.slider(
+                'Mindestähnlichkeit',
+                min_value=0.5,
+                max_value=0.99,
+                value=float(self.tm_fuzzy_threshold),
+                step=0.01,
+                help='Für Texte, die einem übersetzten Text mindestens so ähnlich sind, wird dessen Übersetzung als Referenz mitgeschickt, damit Begriffe und Stil einheitlich bleiben.',
+            )
+            self.tm_reuse_fuzzy = st.checkbox(
+                'Ähnliche Übersetzungen übernehmen',
+                value=self.tm_reuse_fuzzy,
+                help='Die Übersetzung eines ähnlichen Textes wird ohne Anfrage übernommen. Spart Kosten, kleine Unterschiede im Text werden aber nicht übersetzt.',
+            )
+
+    def reset_tm_stats(self):
+        self.tm_stats = {'segments': 0, 'exact': 0, 'fuzzy': 0, 'context': 0, 'tokens_saved': 0}
+
+    def tm_report(self) -> str:
+        """Returns the hit rate of the translation memory and the tokens saved."""
+        stats = self.tm_stats
+        hits = stats['exact'] + stats['fuzzy']
+        return (
+            f"Translation Memory: {hits} von {stats['segments']} Texten übernommen "
+            f"({hits / max(stats['segments'], 1):.0%}, {stats['exact']} identisch, {stats['fuzzy']} ähnlich), "
+            f"{stats['context']} mit ähnlicher Übersetzung als Referenz, {stats['tokens_saved']} Tokens eingespart"
+        )
+
+    def tm_reused(self, match) -> bool:
+        """True if the translation of a match is used without a request."""
+        return match is not None and (match[2] >= 1.0 or self.tm_reuse_fuzzy)
+
+    def untranslated(self, segments: list, lang_target: str) -> list:
+        """Returns the positions of the segments that are not reused from the translation memory."""
+        if not self.use_tm:
+            return list(range(len(segments)))
+        threshold = self.tm_fuzzy_threshold if self.tm_reuse_fuzzy else None
+        matches = get_translation_memory().lookup(
+            segments, self.lang_source, lang_target, threshold
+        )
+        return [position for position, match in enumerate(matches) if not self.tm_reused(match)]
+
+    def tm_matches(self, segments: list, lang_target: str) -> list:
+        """
+        Looks up the segments in the translation memory and counts them in
+        tm_stats.
+
+        Returns:
+            list: The match of every segment, see TranslationMemory.lookup,
+            None for all segments if the translation memory is not used.
+        """
+        self.tm_stats['segments'] += len(segments)
+        if not self.use_tm:
+            return [None] * len(segments)
+        matches = get_translation_memory().lookup(
+            segments, self.lang_source, lang_target, self.tm_fuzzy_threshold
+        )
+        for match in matches:
+            if self.tm_reused(match):
+                self.tm_stats['exact' if match[2] >= 1.0 else 'fuzzy'] += 1
+                self.tm_stats['tokens_saved'] += sum(match[3])
+            elif match is not None:
+                self.tm_stats['context'] += 1
+        return matches
+
+    def tm_store(self, entries: list, lang_target: str):
+        """Adds (source, target, tokens) entries to the translation memory if it is used."""
+        if self.use_tm and entries:
+            get_translation_memory().add(entries, self.lang_source, lang_target)
+
+    def split_document(self, text: str) -> list:
+        """Splits a document into chunks of whole lines or sentences of at most DOCUMENT_CHUNK_TOKENS tokens."""
+        chunks = split_text(
+            text,
+            model_name=self.model,
+            max_tokens_per_chunk=DOCUMENT_CHUNK_TOKENS,
+            expected_completion_tokens=0,
+        )
+        return [chunk for chunk in chunks if chunk.strip()]
+
+    def chunk_max_tokens(self) -> int:
+        return max(self.max_tokens, int(DOCUMENT_CHUNK_TOKENS * PACK_OUTPUT_FACTOR))
+
+    def chunk_prompt(self, chunks: list, position: int) -> str:
+        """Returns the prompt of a chunk, with the end of the previous chunk as context."""
+        prompt = USER_PROMPT.format(chunks[position])
+        if position == 0:
+            return prompt
+        context = chunks[position - 1].strip()
+        if len(context) > CONTEXT_CHARS:
+            context = context[-CONTEXT_CHARS:]
+            # start at a word
+            context = context[context.find(' ') + 1 :]
+        return CONTEXT_PROMPT.format(context) + prompt
+
+    def failed_chunks(self) -> list:
+        """Returns the positions of the chunks without translation."""
+        return [
+            position
+            for position, translation in enumerate(self.chunk_translations)
+            if translation is None
+        ]
+
+    def assemble_document(self) -> str:
+        """Joins the translated chunks in the order of the document, failed chunks are marked."""
+        return '\n'.join(
+            FAILED_CHUNK_TEXT.format(position + 1) if translation is None else translation
+            for position, translation in enumerate(self.chunk_translations)
+        )
+
+    def translate_chunks(self, positions: list, progress) -> list:
+        """
+        Translates chunks of the document in parallel and stores the
+        translations in chunk_translations.
+
+        Args:
+            positions (list): The positions of the chunks to translate.
+            progress: The progress bar.
+
+        Returns:
+            list: (source, translation, tokens) of the translated chunks for
+            the translation memory.
+        """
+        system_prompt = self.get_system_prompt(*self.document_langs)
+        entries = []
+
+        def translate(position):
+            return self.get_completion(
+                self.chunk_prompt(self.document_chunks, position),
+                position + 1,
+                system_prompt=system_prompt,
+                max_tokens=self.chunk_max_tokens(),
+            )
+
+        def show_progress(done, total, position, result):
+            response, tokens = result
+            self.add_tokens(tokens)
+            chunk = positions[position]
+            if response:
+                self.chunk_translations[chunk] = response.strip()
+                entries.append((self.document_chunks[chunk], self.chunk_translations[chunk], tokens))
+            progress.progress(
+                done / total,
+                f'Abschnitt {chunk + 1} von {len(self.document_chunks)} übersetzt ({done}/{total})',
+            )
+
+        self.run_concurrent(translate, positions, progress_callback=show_progress)
+        return entries
+
+    def translate_document(self, progress, placeholder=None) -> str:
+        """
+        Translates self.text. The text is split into chunks on line and
+        sentence boundaries, the chunks are translated in parallel, each with
+        the end of the previous chunk as context, and joined in the order of
+        the document. Chunks found in the translation memory are reused. A
+        document with a single chunk is streamed into the placeholder if
+        there is one. Failed chunks can be translated again with
+        retry_failed_chunks.
+
+        Args:
+            progress: The progress bar.
+            placeholder (optional): Placeholder for the streamed translation.
+
+        Returns:
+            str: The translated document, failed chunks are marked with
+            FAILED_CHUNK_TEXT.
+        """
+        self.document_langs = (self.lang_source, self.lang_target)
+        self.document_chunks = self.split_document(self.text)
+        self.chunk_translations = [None] * len(self.document_chunks)
+        positions = []
+        for position, match in enumerate(self.tm_matches(self.document_chunks, self.lang_target)):
+            if self.tm_reused(match):
+                self.chunk_translations[position] = match[1]
+            else:
+                positions.append(position)
+        if len(self.document_chunks) == 1 and positions and placeholder is not None:
+            tokens_in, tokens_out = self.tokens_in, self.tokens_out
+            with placeholder.container():
+                output = st.write_stream(
+                    self.get_completion_stream(
+                        self.chunk_prompt(self.document_chunks, 0),
+                        system_prompt=self.get_system_prompt(*self.document_langs),
+                        max_tokens=self.chunk_max_tokens(),
+                    )
+                )
+            # an interrupted stream leaves the chunk as failed
+            if output and self.stream_error is None:
+                self.chunk_translations[0] = output.strip()
+                entries = [(self.document_chunks[0], self.chunk_translations[0], [self.tokens_in - tokens_in, self.tokens_out - tokens_out])]
+            else:
+                entries = []
+        else:
+            entries = self.translate_chunks(positions, progress)
+        self.tm_store(entries, self.lang_target)
+        return self.assemble_document()
+
+    def retry_failed_chunks(self, progress) -> str:
+        """Translates the failed chunks of the last document again and returns the document."""
+        entries = self.translate_chunks(self.failed_chunks(), progress)
+        if self.use_tm and entries:
+            get_translation_memory().add(entries, *self.document_langs)
+        return self.assemble_document()
+
+    def csv_chunks(self):
+        """
+        Yields the key value pairs as DataFrames, an uploaded csv file is read
+        in chunks.
+        """
+        if self.data_source is not None:
+            yield from self.data_source.chunks()
+        elif isinstance(self.data, pd.DataFrame):
+            yield self.data
+
     def run_csv_translation(self, placeholder):
         """
-        Runs the translation process for a CSV file. Texts are translated line by line.
-        the result is stored in a new column called "translation" and in the end, the
-        dataframe is saved to a CSV file in the output folder and a download button is
-        displayed.
+        Runs the translation process for a CSV file. The file is read in
+        chunks, the texts of a chunk are translated in parallel. The result is
+        stored in a new column called "translation" and every chunk is
+        appended to a CSV file in the output folder, so the memory use does
+        not depend on the size of the file. In the end a preview and a
+        download button are displayed.
 
         Args:
             placeholder: The placeholder object used for displaying progress.
 
-        Returns:self.language_dict[lang]
+        Returns:
             None
         """
-        self.data["translation"] = ""
-        i = 1
-        for index, row in self.data.iterrows():
-            placeholder.markdown(f"Übersetze ({i}/{len(self.data)}): {row['value']}...")
-            prompt = USER_PROMPT.format(row["value"])
-            self.output, tokens = self.get_completion(text=prompt, index=index)
-            self.data.loc[index, "translation"] = self.output
-            i += 1
-        filename = OUTPUT_PATH + self.input_file.name.replace(
-            ".csv", "_translation.csv"
-        )
-        self.data.to_csv(filename, sep=self.separator, index=False)
+        filename, preview = self.translate_csv(self.input_file.name, placeholder)
         with st.expander("Übersetzung"):
-            st.dataframe(self.data)
-        st.download_button(
-            label="Übersetzung herunterladen",
-            data=filename,
-            file_name=filename,
+            st.dataframe(preview)
+        with open(filename, "rb") as file:
+            st.download_button(
+                label="Übersetzung herunterladen",
+                data=file,
+                file_name=os.path.basename(filename),
+            )
+
+    def csv_row_count(self) -> int:
+        if self.data_source is not None:
+            return self.data_source.count_rows()
+        return len(self.data) if isinstance(self.data, pd.DataFrame) else 0
+
+    def translate_csv(self, input_file_name: str, placeholder) -> tuple:
+        """
+        Translates the key value pairs chunk by chunk and appends every chunk
+        to the output file. The rows of a chunk are translated in packs of
+        pack_size rows, see translate_values, the translations are assigned
+        to the chunk at once. Empty values are not translated, rows that
+        failed or were cancelled remain empty and are counted in failed_rows.
+
+        Args:
+            input_file_name (str): Name of the input file, used for the name
+                of the output file.
+            placeholder: The placeholder object used for displaying progress.
+
+        Returns:
+            tuple: The path of the output file and the first rows of the
+            result.
+        """
+        filename = self.csv_output_file(input_file_name)
+        preview = None
+        self.failed_rows = 0
+        total = self.csv_row_count()
+        done = [0]
+        start = time.perf_counter()
+
+        def show_progress(lang, count, value):
+            done[0] += count
+            placeholder.markdown(
+                rows_progress_expression(done[0], total, time.perf_counter() - start)
+            )
+
+        for number, chunk in enumerate(self.csv_chunks()):
+            values = chunk["value"]
+            # the row index identifies a row in the packs and error messages
+            items = {
+                str(index): str(value)
+                for index, value in zip(chunk.index, values)
+                if pd.notna(value) and str(value).strip()
+            }
+            done[0] += len(chunk) - len(items)
+            results = self.translate_values(
+                {self.lang_target: items}, show_progress, as_json=False
+            )[self.lang_target]
+            chunk["translation"] = [results.get(str(index), "") for index in chunk.index]
+            self.failed_rows += len(items) - len(results)
+            chunk.to_csv(
+                filename,
+                sep=self.separator,
+                index=False,
+                mode="w" if number == 0 else "a",
+                header=number == 0,
+            )
+            if preview is None:
+                preview = chunk.head(PREVIEW_ROWS)
+        return filename, preview
+
+    def csv_output_file(self, input_file_name: str) -> str:
+        return OUTPUT_PATH + input_file_name.replace(".csv", "_translation.csv")
+
+    def save_csv_translation(self, input_file_name: str) -> str:
+        """Saves the translated key value pairs to the output folder."""
+        filename = self.csv_output_file(input_file_name)
+        self.data.to_csv(filename, sep=self.separator, index=False)
+        return filename
+
+    def submit_csv_translation_batch(self):
+        """
+        Submits the translation of all key value pairs as one batch job. The
+        input data is saved next to the job, so the translations can be merged
+        after a restart of the app.
+
+        Returns:
+            BatchJob: The submitted job.
+        """
+        self.set_system_prompt(self.lang_source, self.lang_target)
+        # a batch job is limited to 50'000 requests, the data fits into memory
+        data = pd.concat(list(self.csv_chunks()))
+        requests = [
+            build_request(
+                str(position),
+                self.model,
+                self.system_prompt,
+                USER_PROMPT.format(value),
+                self.temperature,
+                self.max_tokens,
+            )
+            for position, value in enumerate(data["value"])
+        ]
+        self.row_count = len(requests)
+        os.makedirs(BATCH_PATH, exist_ok=True)
+        data_file = BATCH_PATH + self.input_file.name.replace(
+            ".csv", f"_{datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}_data.csv"
+        )
+        data.to_csv(data_file, sep=self.separator, index=False)
+        meta = {
+            "data_file": data_file,
+            "input_file_name": self.input_file.name,
+            "separator": self.separator,
+        }
+        return submit_batch(
+            self.__class__.__name__, requests, meta, backend=self.batch_backend
         )
 
+    def merge_csv_translation_batch(self, job):
+        """
+        Adds the translations of a completed batch job to the saved input data
+        and writes the result to the output folder.
+
+        Args:
+            job (BatchJob): The completed job.
+
+        Returns:
+            str: The path of the translated csv file.
+        """
+        self.separator = job.meta["separator"]
+        self.data = pd.read_csv(job.meta["data_file"], sep=self.separator)
+        results = job.results()
+        translations = []
+        for position in range(len(self.data)):
+            result = results.get(str(position))
+            if result is None or result["error"]:
+                translations.append("")
+            else:
+                self.add_tokens(result["tokens"])
+                translations.append(result["content"])
+        self.data["translation"] = translations
+        return self.save_csv_translation(job.meta["input_file_name"])
+
     def init_translation(self):
             """
             Initializes the translation dictionary as follows:
@@ -197,64 +713,101 @@ class Translation(ToolBase):
                     translated[lang] = self.data[lang]
             return translated
     
+    def previous_fingerprints(self, lang: str) -> dict:
+        """
+        Returns the fingerprints of the source values the target language was
+        translated from. Without fingerprints for the language, the source
+        language section is used, it is synchronised with the source after
+        every translation.
+        """
+        if self.fingerprints is not None and self.fingerprints.get('lang_source') == self.lang_source:
+            languages = self.fingerprints.get('languages', {})
+            if lang in languages:
+                return languages[lang]
+        if self._section_fingerprints is None:
+            self._section_fingerprints = source_fingerprints(self.data.get(self.lang_source, {}))
+        return self._section_fingerprints
+
     def get_changed_items(self):
         """
-        Retrieves a list of items that have been changed or are new in the translation data.
-        For list, it checks if one item is new or changed in the list and marks it as changed.
+        Compares the fingerprints of the source values with the fingerprints
+        of the last translation into every target language. The changes are
+        stored in changes, for list values with the positions of the new and
+        changed items. Keys that are missing or empty in a target language
+        are pending (CHANGE_PENDING), e.g. all keys of a file translated for
+        the first time.
 
         Returns:
-            list: A list of keys representing the changed or new items.
-        """
-        changed_and_new_items = []
-        source_dict = self.data["source"]
-        source_lang_dict = self.data[self.lang_source]
-        for k, v in source_dict.items():
-            if k not in source_lang_dict:
-                changed_and_new_items.append(k)
-            elif type(source_dict[k]) == list:
-                for item in source_dict[k]:
-                    if not item.encode("utf-8") in [
-                        x.encode("utf-8") for x in source_lang_dict[k]
-                    ]:
-                        changed_and_new_items.append(k)
-                        break
-                    elif item.encode("utf-8") != source_lang_dict[k][
-                        source_lang_dict[k].index(item)
-                    ].encode("utf-8"):
-                        changed_and_new_items.append(k)
-                        break
-            elif v.encode("utf-8") != source_lang_dict[k].encode("utf-8"):
-                changed_and_new_items.append(k)
-        return changed_and_new_items
-    
+            list: The keys that are new or changed for at least one language.
+        """
+        self.lang_source = list(self.data.keys())[1]
+        self._section_fingerprints = None
+        self._current_fingerprints = source_fingerprints(self.data['source'])
+        self.changes = {}
+        changed = {}
+        for lang in list(self.data.keys())[2:]:
+            previous = self.previous_fingerprints(lang)
+            target = self.data[lang]
+            self.changes[lang] = {}
+            for key, value in self._current_fingerprints.items():
+                change = compare_fingerprints(value, previous.get(key))
+                if change is None and target.get(key) in (None, '', []):
+                    change = CHANGE_PENDING
+                if change is not None:
+                    self.changes[lang][key] = change
+                    changed[key] = True
+        return list(changed)
+
+    def changes_df(self) -> pd.DataFrame:
+        """Returns the changes of get_changed_items as table: key, change and target languages."""
+        rows = {}
+        for lang, lang_changes in self.changes.items():
+            for key, change in lang_changes.items():
+                if type(change) == list:
+                    change = f"Elemente {', '.join(str(position + 1) for position in change)} neu oder geändert"
+                row = rows.setdefault(key, {'Schlüssel': key, 'Änderung': change, 'Sprachen': []})
+                row['Sprachen'].append(lang)
+        for row in rows.values():
+            row['Sprachen'] = ', '.join(row['Sprachen'])
+        return pd.DataFrame(list(rows.values()), columns=['Schlüssel', 'Änderung', 'Sprachen'])
+
+    def update_fingerprints(self, translated: dict):
+        """
+        Sets the fingerprints of the source values that were translated into
+        a target language. Values that failed keep the previous fingerprint,
+        so they are translated again in the next run.
+
+        Args:
+            translated (dict): target language -> dict of the translated keys.
+        """
+        languages = {}
+        for lang, lang_changes in self.changes.items():
+            previous = self.previous_fingerprints(lang)
+            languages[lang] = {}
+            for key, value in self._current_fingerprints.items():
+                if key not in lang_changes or key in translated.get(lang, {}):
+                    languages[lang][key] = value
+                elif key in previous:
+                    languages[lang][key] = previous[key]
+        self.fingerprints = {'lang_source': self.lang_source, 'languages': languages}
+
     def get_items_to_translate(self, lang, changed_items: dict):
         """
         Retrieves the items that need to be translated for the specified language.
 
         Args:
             lang (str): The language code for which the translation is needed.
+            changed_items (dict): The new or changed keys for the language.
 
         Returns:
             dict: A dictionary containing the items to be translated.
         """
-        result = {}
-        source = self.data["source"]
-        target = self.data[lang]
-        in_keys = list(source.keys())
-        out_keys = list(target.keys())
-        for key in in_keys:
-            if type(source[key]) == list:
-                if not key in out_keys or key in changed_items:
-                    result[key] = source[key]
-                elif target[key] == []:
-                    result[key] = source[key]
-            else:
-                # item has not been created yet
-                if not key in out_keys or key in changed_items:
-                    result[key] = source[key]
-                elif target[key] == "":
-                    result[key] = source[key]
-        return result
+        # new, changed or not translated yet, see get_changed_items
+        return {
+            key: value
+            for key, value in self.data["source"].items()
+            if key in changed_items
+        }
 
     def parse_gpt_output(self, translated_dict: dict, lang: str):
         """_summary_
@@ -282,59 +835,377 @@ class Translation(ToolBase):
                     result[key] = self.data[lang][key]
         return result
     
-    def translate_json_file(self, progress):
+    def build_packs(self, values: list) -> list:
+        """
+        Groups json values into packs of at most pack_size values and
+        MAX_PACK_INPUT_TOKENS tokens.
+
+        Args:
+            values (list): The values to translate.
+
+        Returns:
+            list: Lists of positions in values.
+        """
+        packs, pack, pack_tokens = [], [], 0
+        value_tokens = self.count_tokens([json.dumps(value, ensure_ascii=False) for value in values])
+        for position, tokens in enumerate(value_tokens):
+            tokens += PACK_VALUE_OVERHEAD
+            if pack and (len(pack) == self.pack_size or pack_tokens + tokens > MAX_PACK_INPUT_TOKENS):
+                packs.append(pack)
+                pack, pack_tokens = [], 0
+            pack.append(position)
+            pack_tokens += tokens
+        if pack:
+            packs.append(pack)
+        return packs
+
+    def pack_prompt(self, items: dict, references: dict = None) -> str:
+        """Returns the prompt of a pack, items maps the keys to the values."""
+        prompt = PACKED_USER_PROMPT.format(json.dumps(items, ensure_ascii=False))
+        if references:
+            prompt = PACKED_REFERENCE_PROMPT.format(
+                json.dumps(references, ensure_ascii=False)
+            ) + prompt
+        return prompt
+
+    def parse_pack_response(self, response: str, items: dict) -> dict:
+        """
+        Parses the answer to a packed request.
+
+        Args:
+            response (str): The model response.
+            items (dict): The keys and values sent in the request.
+
+        Returns:
+            dict: key -> translation for every key with a valid translation:
+            a text for a text, a list of texts with the same length for a
+            list. Missing and malformed keys are left out.
         """
-        Uses OpenAI-API to automatically translate texts from one language to another.
+        response = response.strip()
+        if response.startswith("```"):
+            response = response.strip("`").removeprefix("json").strip()
+        try:
+            parsed = json.loads(response)
+        except json.JSONDecodeError:
+            return {}
+        if not isinstance(parsed, dict):
+            return {}
+        result = {}
+        for key, value in items.items():
+            translation = parsed.get(key)
+            if is_valid_translation(value, translation):
+                result[key] = translation
+        return result
 
-        Returns a dictionary with the translated texts. Note that this method requires the
-        OPENAI_API_KEY environment variable to be set with a valid API key for OpenAI's GPT-3 service.
+    def translate_value(
+        self, lang: str, key: str, value, reference=None, as_json: bool = True
+    ) -> tuple:
+        """
+        Translates a single json value or text.
 
-        By default, this method translates texts to English (the 'en' language code). To change the
-        target language, modify the `self.data` attribute before calling this method.
+        Returns:
+            tuple: The translation and the tokens [in, out]. The translation
+            of a text is the raw response if it is no json text, the
+            translation of a list must be a list of texts of the same length,
+            see is_valid_translation. It is None if the request failed or the
+            response is malformed.
+        """
+        prompt = json.dumps(value) if as_json else USER_PROMPT.format(value)
+        if reference is not None:
+            prompt = REFERENCE_PROMPT.format(reference[0], reference[1]) + prompt
+        response, tokens = self.get_completion(
+            prompt,
+            f"{lang}:{key}",
+            system_prompt=self.get_system_prompt(self.lang_source, lang),
+        )
+        if not response:
+            return None, tokens
+        if not as_json:
+            return response, tokens
+        translation = normalize_json_value(response)
+        if not isinstance(value, list) and not isinstance(translation, str):
+            # a text answered as plain text, e.g. a number
+            translation = response
+        if not is_valid_translation(value, translation):
+            return None, tokens
+        return translation, tokens
 
-        This method generates a prompt message and submits it to the GPT-3 API. The prompt message
-        includes the contents of `self.data`, which contains a list of texts to translate.
+    def translate_pack(
+        self, lang: str, items: dict, references: dict, as_json: bool = True
+    ) -> tuple:
+        """
+        Translates the values of a pack with one request, a pack with a
+        single value is translated like a single value.
 
-        The API response is parsed to obtain the translated texts, which are returned as a
-        dictionary with the original texts as keys and the translated texts as values.
+        Args:
+            lang (str): The target language.
+            items (dict): The keys and values to translate.
+            references (dict): Similar translated segments (source ->
+                translation) from the translation memory.
+            as_json (bool, optional): A single value is sent as json, see
+                translate_values.
 
-        Example usage:
-        >> translator = MyTranslator()
-        >> result = translator.translate()
-        >> # result will be a dictionary with the translated texts
+        Returns:
+            tuple: key -> translation for the keys with a valid translation
+            and the tokens [in, out] of the request.
         """
+        if len(items) == 1:
+            key, value = next(iter(items.items()))
+            reference = next(iter(references.items()), None)
+            translation, tokens = self.translate_value(lang, key, value, reference, as_json)
+            return ({} if translation is None else {key: translation}), tokens
+        prompt = self.pack_prompt(items, references)
+        response, tokens = self.get_completion(
+            prompt,
+            f"{lang}:{next(iter(items))}",
+            system_prompt=self.get_system_prompt(
+                self.lang_source, lang, PACKED_SYSTEM_PROMPT_TEMPLATE
+            ),
+            max_tokens=max(
+                self.max_tokens,
+                int(self.count_tokens([prompt])[0] * PACK_OUTPUT_FACTOR),
+            ),
+            response_format={"type": "json_object"},
+        )
+        if not response:
+            return {}, tokens
+        return self.parse_pack_response(response, items), tokens
 
+    def translate_values(
+        self, items: dict, progress_callback=None, as_json: bool = True
+    ) -> dict:
+        """
+        Translates the values of several target languages. Values found in
+        the translation memory are reused, the others are translated in packs
+        of pack_size values with a json object as answer, the packs of all
+        languages are sent in parallel. Keys missing or malformed in the
+        answer to a pack are translated one by one afterwards.
+
+        Args:
+            items (dict): target language -> dict of the keys and values to
+                translate.
+            progress_callback (callable, optional): Called with the target
+                language, the number of finished values and the last value
+                after every request.
+            as_json (bool, optional): The values are json values (texts or
+                lists), stored as json in the translation memory. Otherwise
+                they are texts, stored as they are, like the key value pairs
+                of a csv file.
+
+        Returns:
+            dict: target language -> dict of the translated keys, keys of
+            failed or cancelled requests are missing.
+        """
+        translated = {lang: {} for lang in items}
+        tasks = []
+        references = {}
+
+        def to_segment(value) -> str:
+            return json.dumps(value, ensure_ascii=False) if as_json else str(value)
+
+        for lang, lang_items in items.items():
+            keys = list(lang_items)
+            segments = [to_segment(value) for value in lang_items.values()]
+            open_keys = []
+            for key, match in zip(keys, self.tm_matches(segments, lang)):
+                if self.tm_reused(match):
+                    translated[lang][key] = (
+                        normalize_json_value(match[1]) if as_json else match[1]
+                    )
+                    continue
+                if match is not None:
+                    references[(lang, key)] = match
+                open_keys.append(key)
+            if progress_callback is not None and len(open_keys) < len(keys):
+                progress_callback(lang, len(keys) - len(open_keys), lang_items[keys[-1]])
+            for pack in self.build_packs([lang_items[key] for key in open_keys]):
+                tasks.append((lang, [open_keys[position] for position in pack]))
+
+        def translate(task):
+            lang, keys = task
+            pack_references = {
+                references[(lang, key)][0]: references[(lang, key)][1]
+                for key in keys
+                if (lang, key) in references
+            }
+            return self.translate_pack(
+                lang, {key: items[lang][key] for key in keys}, pack_references, as_json
+            )
+
+        entries = {lang: [] for lang in items}
+        retries = []
+
+        def run_tasks(task_list: list):
+            def on_progress(done, total, position, result):
+                lang, keys = task_list[position]
+                pack_translations, tokens = result
+                self.add_tokens(tokens)
+                for key, translation in pack_translations.items():
+                    translated[lang][key] = translation
+                    entries[lang].append(
+                        (
+                            to_segment(items[lang][key]),
+                            to_segment(translation),
+                            # the tokens of a pack are shared by its values
+                            [count // len(keys) for count in tokens] if tokens else None,
+                        )
+                    )
+                # a single value that failed is not retried again
+                missing = [key for key in keys if key not in pack_translations] if len(keys) > 1 else []
+                retries.extend((lang, [key]) for key in missing)
+                if progress_callback is not None:
+                    progress_callback(lang, len(keys) - len(missing), items[lang][keys[-1]])
+
+            self.run_concurrent(translate, task_list, progress_callback=on_progress)
+
+        run_tasks(tasks)
+        if retries and not self.budget_exceeded:
+            self.report(
+                f"{len(retries)} Einträge fehlen in den Antworten oder sind fehlerhaft, sie werden einzeln übersetzt.",
+                logging.WARNING,
+            )
+            run_tasks(list(retries))
+        for lang, lang_entries in entries.items():
+            self.tm_store(lang_entries, lang)
+        return translated
+
+    def translate_json_file(self, progress):
+        """
+        Translates the new and changed entries of the multi-lang json file
+        into all target languages, see translate_values.
+
+        Args:
+            progress: The progress bar.
+
+        Returns:
+            dict: The translated multi-lang dictionary, the source language
+            section is synchronised with the source section. Entries that
+            failed or were cancelled remain empty and are translated in the
+            next run.
+        """
         translated = self.init_translation()
         changed_items = self.get_changed_items()
-        st.markdown(f'{len(changed_items)} neue oder geänderte Ausdrücke gefunden.')
+        self.report(f'{len(changed_items)} neue oder geänderte Ausdrücke gefunden.')
+        if changed_items:
+            self.logger.debug(f'Änderungen seit der letzten Übersetzung:\n{self.changes_df().to_string(index=False)}')
         #languages start with 3 item: 0: source: 1: source lang diff, 2: first lang
-        cnt = 0
         target_lang_list = list(self.data.keys())[2:]
-        total = len(changed_items) * len(target_lang_list)
+        items = {
+            lang: self.get_items_to_translate(lang, self.changes[lang])
+            for lang in target_lang_list
+        }
+        total = sum(len(lang_items) for lang_items in items.values())
+        done = [0]
+
+        def show_progress(lang, count, value):
+            done[0] += count
+            progress.progress(
+                min(done[0] / max(total, 1), 1.0),
+                f'Übersetze nach {self.language_dict[lang]} ({done[0]}/{total}): {value}',
+            )
+
+        results = self.translate_values(items, show_progress)
+        self.update_fingerprints(results)
         for lang in target_lang_list:
-            items_to_translate = self.get_items_to_translate(lang, changed_items)
-            language = self.language_dict[lang]
-            self.set_system_prompt(self.lang_source, lang)
-            for key, value in items_to_translate.items():
-                text = json.dumps(value)
-                response, tokens = self.get_completion(text, index=0)
-                self.add_tokens(tokens)
-                try:
-                    translated[lang][key] = json.loads(response)
-                except json.JSONDecodeError:
-                    translated[lang][key] = response
-                cnt += 1
-                progress.progress(cnt / total, f'Übersetze nach {language} ({cnt}/{total}): {value}')
+            for key, value in items[lang].items():
+                # failed or cancelled, translated in the next run
+                translated[lang][key] = results[lang].get(
+                    key, [] if type(value) == list else ""
+                )
             translated[lang] = self.parse_gpt_output(translated[lang], lang)
-        progress.progress(1.0, f'Übersetzung abgeschlossen ({cnt}/{total})')
-            
+        progress.progress(1.0, f'Übersetzung abgeschlossen ({done[0]}/{total})')
 
         # synch source long with source so there are no differences after the translation
         translated[self.lang_source] = self.data['source']
+        translated[FINGERPRINTS_KEY] = self.fingerprints
         return translated
-    
+
+    def plan_values(self, items: dict, lang: str, plan, as_json: bool = True):
+        """
+        Adds the packs of translate_values for one target language to a cost
+        plan, values reused from the translation memory are left out. The
+        answer to a pack is about as long as the json object.
+        """
+        keys = list(items)
+        segments = [
+            json.dumps(value, ensure_ascii=False) if as_json else str(value)
+            for value in items.values()
+        ]
+        keys = [keys[position] for position in self.untranslated(segments, lang)]
+        prompts = []
+        for pack in self.build_packs([items[key] for key in keys]):
+            if len(pack) == 1:
+                value = items[keys[pack[0]]]
+                prompts.append(json.dumps(value) if as_json else USER_PROMPT.format(value))
+            else:
+                prompts.append(self.pack_prompt({keys[p]: items[keys[p]] for p in pack}))
+        self.plan_completions(
+            prompts,
+            system_prompt=self.get_system_prompt(
+                self.lang_source,
+                lang,
+                PACKED_SYSTEM_PROMPT_TEMPLATE if self.pack_size > 1 else SYSTEM_PROMPT_TEMPLATE,
+            ),
+            tokens_out=[
+                int(tokens * TRANSLATION_OUTPUT_RATIO)
+                for tokens in self.count_tokens(prompts)
+            ],
+            plan=plan,
+        )
+
+    def estimate_cost(self):
+        """
+        Tokenises the input and returns the expected requests, tokens and
+        cost of the translation. The length of a translation is estimated
+        from the length of the source text.
+
+        Returns:
+            CostPlan: The plan, None if there is no input.
+        """
+        input_format = self.formats.index(self.input_type)
+        if input_format == InputFormat.KEY_VALUE_PAIRS.value:
+            if self.data_source is None and not isinstance(self.data, pd.DataFrame):
+                return None
+            plan = self.new_cost_plan()
+            for chunk in self.csv_chunks():
+                items = {
+                    str(index): str(value)
+                    for index, value in zip(chunk.index, chunk["value"])
+                    if pd.notna(value) and str(value).strip()
+                }
+                self.plan_values(items, self.lang_target, plan, as_json=False)
+            return plan
+        elif input_format == InputFormat.MULTI_LANG_JSON.value:
+            if not isinstance(self.data, dict):
+                return None
+            plan = self.new_cost_plan()
+            self.get_changed_items()
+            for lang in list(self.data.keys())[2:]:
+                items = self.get_items_to_translate(lang, self.changes[lang])
+                self.plan_values(items, lang, plan)
+            return plan
+        if not getattr(self, 'text', None):
+            return None
+        self.set_system_prompt(self.lang_source, self.lang_target)
+        chunks = self.split_document(self.text)
+        prompts = [
+            self.chunk_prompt(chunks, position)
+            for position in self.untranslated(chunks, self.lang_target)
+        ]
+        return self.plan_completions(
+            prompts,
+            tokens_out=[
+                int(tokens * TRANSLATION_OUTPUT_RATIO)
+                for tokens in self.count_tokens(prompts)
+            ],
+        )
+
     def run(self):
+        if st.button('Kosten schätzen'):
+            self.show_cost_plan(self.estimate_cost())
         if st.button('Übersetzung'):
+            self.start_budget()
+            self.reset_tm_stats()
             placeholder = st.empty()
             progress = st.progress(0, text='Übersetzung läuft')
             if self.formats.index(self.input_type) in [
@@ -343,22 +1214,43 @@ class Translation(ToolBase):
                 InputFormat.URL.value,
             ]:
                 self.set_system_prompt(self.lang_source, self.lang_target)
-                prompt = USER_PROMPT.format(self.text)
-                self.output, tokens = self.get_completion(text=prompt, index=0)
-                self.tokens_in, self.tokens_out = tokens[0], tokens[1]
+                self.tokens_in, self.tokens_out = 0, 0
+                self.output = self.translate_document(progress, placeholder)
+                placeholder.empty()
+                progress.progress(1.0, text=self.timing_expression())
                 st.markdown(self.token_use_expression())
             elif (
                 self.formats.index(self.input_type)
                 == InputFormat.KEY_VALUE_PAIRS.value
             ):
-                self.set_system_prompt(self.lang_source, self.lang_target)
-                self.run_csv_translation(placeholder)
+                if self.is_batch_mode():
+                    job = self.submit_csv_translation_batch()
+                    st.success(f"Batch-Job {job.job_id} mit {self.row_count} Einträgen wurde eingereicht.")
+                else:
+                    self.set_system_prompt(self.lang_source, self.lang_target)
+                    self.run_csv_translation(placeholder)
             elif self.formats.index(self.input_type) == InputFormat.MULTI_LANG_JSON.value:
                 self.output = self.translate_json_file(progress)
             else:
                 st.warning('Diese Option wird noch nicht unterstützt.')
+            if self.use_tm and self.tm_stats['segments']:
+                st.markdown(self.tm_report())
+            self.show_budget_warning()
+
+        if self.formats.index(self.input_type) == InputFormat.KEY_VALUE_PAIRS.value:
+            self.show_batch_jobs(self.merge_csv_translation_batch)
+        elif self.formats.index(self.input_type) <= InputFormat.URL.value and self.failed_chunks():
+            st.warning(
+                f'{len(self.failed_chunks())} von {len(self.document_chunks)} Abschnitten konnten nicht übersetzt werden.'
+            )
+            if st.button('Fehlgeschlagene Abschnitte wiederholen'):
+                self.start_budget()
+                self.output = self.retry_failed_chunks(st.progress(0, text='Übersetzung läuft'))
 
         if self.output is not None:
             with st.expander('Übersetzung', expanded=True):
                 st.write(self.output)
-            st.download_button('Herunterladen', json.dumps(self.output), 'translation.json', 'json')
+            file_name = 'translation.json'
+            if self.formats.index(self.input_type) == InputFormat.MULTI_LANG_JSON.value:
+                file_name = os.path.basename(self.json_output_file(self.input_file.name))
+            st.download_button('Herunterladen', json.dumps(self.output), file_name, 'json')
@@ -0,0 +1,275 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from difflib import SequenceMatcher
+
+from tools.llm_cache import CACHE_PATH
+
+MEMORY_FILE = CACHE_PATH + "translation_memory.db"
+# minimal similarity of a fuzzy match, see similarity
+DEFAULT_FUZZY_THRESHOLD = 0.8
+# only segments of this length are indexed for fuzzy matches, short
+# segments differ in meaning by a few characters, long ones are documents
+MIN_FUZZY_LENGTH = 10
+MAX_FUZZY_LENGTH = 1000
+# candidates with the most common trigrams compared per fuzzy lookup
+FUZZY_CANDIDATES = 10
+# trigrams of a segment used to find the candidates, evenly sampled from
+# the sorted trigrams, keeps the lookup of long segments cheap
+FUZZY_GRAMS = 32
+# keys per query of an exact lookup, below the sqlite variable limit
+LOOKUP_BATCH_SIZE = 500
+
+CREATE_SEGMENTS = """
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    pair TEXT,
+    key TEXT,
+    source TEXT,
+    target TEXT,
+    tokens_in INTEGER,
+    tokens_out INTEGER,
+    created REAL,
+    last_used REAL,
+    UNIQUE (pair, key)
+);
+"""
+CREATE_TRIGRAMS = """
+CREATE TABLE IF NOT EXISTS trigrams (
+    pair TEXT,
+    gram TEXT,
+    segment_id INTEGER
+);
+"""
+# covers the candidate query, the trigram table itself is never read
+CREATE_TRIGRAM_INDEX = """
+CREATE INDEX IF NOT EXISTS idx_trigrams_segment ON trigrams (pair, gram, segment_id);
+"""
+# replaced by idx_trigrams_segment
+DROP_TRIGRAM_INDEX = "DROP INDEX IF EXISTS idx_trigrams;"
+
+_whitespace = re.compile(r"\s+")
+_memory = None
+_memory_lock = threading.Lock()
+
+
+def normalize_segment(text: str) -> str:
+    """Unicode NFC, whitespace collapsed, the text used for exact matches."""
+    return _whitespace.sub(" ", unicodedata.normalize("NFC", str(text))).strip()
+
+
+def trigrams(text: str) -> set:
+    text = f"  {text.casefold()} "
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def sample_grams(text: str) -> list:
+    """Returns at most FUZZY_GRAMS trigrams of a text, the same text always gives the same sample."""
+    grams = sorted(trigrams(text))
+    if len(grams) <= FUZZY_GRAMS:
+        return grams
+    step = len(grams) / FUZZY_GRAMS
+    return [grams[int(i * step)] for i in range(FUZZY_GRAMS)]
+
+
+def similarity(a: str, b: str, threshold: float = 0.0) -> float:
+    """
+    Similarity of two normalised segments between 0 and 1, based on the edit
+    operations. Only identical segments, i.e. exact matches, have the
+    similarity 1. Returns 0 without comparing the segments if their upper
+    bounds are below threshold.
+    """
+    matcher = SequenceMatcher(None, a, b, autojunk=False)
+    if matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold:
+        return 0.0
+    return matcher.ratio()
+
+
+class TranslationMemory:
+    """
+    Persistent memory of translated segments per language pair. Segments are
+    found by their normalised text (exact match) or, for segments of
+    MIN_FUZZY_LENGTH to MAX_FUZZY_LENGTH characters, by their similarity to
+    stored segments: candidates sharing the most character trigrams are
+    compared with similarity.
+    """
+
+    def __init__(self, file_name: str = MEMORY_FILE):
+        folder = os.path.dirname(file_name)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(file_name, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(CREATE_SEGMENTS)
+        self._conn.execute(CREATE_TRIGRAMS)
+        self._conn.execute(DROP_TRIGRAM_INDEX)
+        self._conn.execute(CREATE_TRIGRAM_INDEX)
+        self._conn.commit()
+
+    @staticmethod
+    def make_pair(lang_source: str, lang_target: str) -> str:
+        return f"{lang_source}>{lang_target}"
+
+    @staticmethod
+    def make_key(segment: str) -> str:
+        return hashlib.sha256(normalize_segment(segment).encode("utf-8")).hexdigest()
+
+    def lookup(
+        self,
+        segments: list,
+        lang_source: str,
+        lang_target: str,
+        fuzzy_threshold: float = None,
+    ) -> list:
+        """
+        Looks up the translations of segments.
+
+        Args:
+            segments (list): The source segments.
+            lang_source (str): The source language code.
+            lang_target (str): The target language code.
+            fuzzy_threshold (float, optional): Minimal similarity of a fuzzy
+                match, only exact matches are returned if None or 1.
+
+        Returns:
+            list: For every segment None or a tuple (source, target, score,
+            tokens) of the best match, score is 1.0 for exact matches and
+            tokens are [tokens_in, tokens_out] of the original translation.
+        """
+        pair = self.make_pair(lang_source, lang_target)
+        keys = [self.make_key(segment) for segment in segments]
+        found = {}
+        with self._lock:
+            unique_keys = list(set(keys))
+            for start in range(0, len(unique_keys), LOOKUP_BATCH_SIZE):
+                batch = unique_keys[start : start + LOOKUP_BATCH_SIZE]
+                rows = self._conn.execute(
+                    f"SELECT key, source, target, tokens_in, tokens_out FROM segments WHERE pair = ? AND key IN ({','.join('?' * len(batch))})",
+                    [pair, *batch],
+                ).fetchall()
+                for key, source, target, tokens_in, tokens_out in rows:
+                    found[key] = (source, target, 1.0, [tokens_in, tokens_out])
+            if found:
+                self._conn.executemany(
+                    "UPDATE segments SET last_used = ? WHERE pair = ? AND key = ?",
+                    [(time.time(), pair, key) for key in found],
+                )
+                self._conn.commit()
+        matches = [found.get(key) for key in keys]
+        # only identical segments reach the similarity 1, they are exact matches
+        if fuzzy_threshold is not None and fuzzy_threshold < 1:
+            missing = {
+                normalize_segment(segment)
+                for segment, match in zip(segments, matches)
+                if match is None
+            }
+            fuzzy = self.fuzzy_matches(list(missing), pair, fuzzy_threshold)
+            for position, segment in enumerate(segments):
+                if matches[position] is None:
+                    matches[position] = fuzzy.get(normalize_segment(segment))
+        return matches
+
+    def fuzzy_matches(self, segments: list, pair: str, threshold: float) -> dict:
+        """
+        Returns the most similar stored segment with at least threshold
+        similarity for every normalised segment with a match, see lookup.
+        The candidates of all segments are read in one go.
+        """
+        segments = [s for s in segments if MIN_FUZZY_LENGTH <= len(s) <= MAX_FUZZY_LENGTH]
+        candidates = {}
+        with self._lock:
+            for segment in segments:
+                grams = sample_grams(segment)
+                candidates[segment] = self._conn.execute(
+                    f"""
+                    SELECT s.source, s.target, s.tokens_in, s.tokens_out
+                    FROM segments s JOIN (
+                        SELECT segment_id, COUNT(*) AS shared FROM trigrams
+                        WHERE pair = ? AND gram IN ({','.join('?' * len(grams))})
+                        GROUP BY segment_id ORDER BY shared DESC LIMIT ?
+                    ) c ON s.id = c.segment_id
+                    """,
+                    [pair, *grams, FUZZY_CANDIDATES],
+                ).fetchall()
+        matches = {}
+        for segment, rows in candidates.items():
+            best = None
+            for source, target, tokens_in, tokens_out in rows:
+                score = similarity(segment, normalize_segment(source), threshold)
+                if score >= threshold and (best is None or score > best[2]):
+                    best = (source, target, score, [tokens_in, tokens_out])
+            if best is not None:
+                matches[segment] = best
+        return matches
+
+    def add(self, entries: list, lang_source: str, lang_target: str):
+        """
+        Stores translated segments, an existing translation of a segment is
+        replaced.
+
+        Args:
+            entries (list): Tuples (source, target, tokens).
+            lang_source (str): The source language code.
+            lang_target (str): The target language code.
+        """
+        pair = self.make_pair(lang_source, lang_target)
+        now = time.time()
+        with self._lock:
+            for source, target, tokens in entries:
+                tokens = tokens or [0, 0]
+                key = self.make_key(source)
+                row = self._conn.execute(
+                    "SELECT id, tokens_in, tokens_out FROM segments WHERE pair = ? AND key = ?",
+                    (pair, key),
+                ).fetchone()
+                if row is not None:
+                    # responses from the response cache have no token usage,
+                    # the usage of the original translation is kept
+                    if not any(tokens):
+                        tokens = [row[1], row[2]]
+                    self._conn.execute(
+                        "UPDATE segments SET target = ?, tokens_in = ?, tokens_out = ?, last_used = ? WHERE id = ?",
+                        (target, tokens[0], tokens[1], now, row[0]),
+                    )
+                    continue
+                cursor = self._conn.execute(
+                    "INSERT INTO segments (pair, key, source, target, tokens_in, tokens_out, created, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (pair, key, source, target, tokens[0], tokens[1], now, now),
+                )
+                normalized = normalize_segment(source)
+                if MIN_FUZZY_LENGTH <= len(normalized) <= MAX_FUZZY_LENGTH:
+                    self._conn.executemany(
+                        "INSERT INTO trigrams VALUES (?, ?, ?)",
+                        [(pair, gram, cursor.lastrowid) for gram in trigrams(normalized)],
+                    )
+            self._conn.commit()
+
+    def clear(self):
+        """Removes all segments."""
+        with self._lock:
+            self._conn.execute("DELETE FROM segments")
+            self._conn.execute("DELETE FROM trigrams")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """Returns the number of segments per language pair."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT pair, COUNT(*) FROM segments GROUP BY pair"
+            ).fetchall()
+        return dict(rows)
+
+
+def get_translation_memory() -> TranslationMemory:
+    """Returns the process wide translation memory, creating it on first use."""
+    global _memory
+    with _memory_lock:
+        if _memory is None:
+            _memory = TranslationMemory()
+        return _memory